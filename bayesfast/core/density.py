@@ -414,17 +414,7 @@ class Pipeline(_PipelineBase):
             x = np.atleast_1d(x)
             if x.ndim == 1:
                 if x.dtype.kind == 'f':
-                    if self.copy_input:
-                        x = x.copy()
-                    if not original_space:
-                        x = self.to_original(x)
-                    var_dict = VariableDict()
-                    if self._input_cum is None:
-                        var_dict._fun[self._input_vars[0]] = x
-                    else:
-                        for i, n in enumerate(self._input_vars):
-                            var_dict._fun[n] = x[
-                                self._input_cum[i]:self._input_cum[i + 1]]
+                    var_dict = self._fun_input(x, original_space)
                 elif x.dtype.kind == 'O':
                     return np.asarray([self.fun(_x, original_space,
                                                 use_surrogate) for _x in x])
@@ -434,41 +424,91 @@ class Pipeline(_PipelineBase):
                 return np.asarray(
                     [self.fun(_x, original_space, use_surrogate) for _x in x])
 
+        for i, _module in self._fun_schedule(use_surrogate):
+            try:
+                _input = [var_dict._fun[n] for n in _module._input_vars]
+                _output = _module.fun(*_input)
+                self._fun_update(var_dict, _module, _output)
+            except Exception:
+                raise RuntimeError(
+                    'pipeline fun evaluation failed at step #{}.'.format(i))
+        return var_dict
+
+    def _fun_input(self, x, original_space):
+        if self.copy_input:
+            x = x.copy()
+        if not original_space:
+            x = self.to_original(x)
+        var_dict = VariableDict()
+        if self._input_cum is None:
+            var_dict._fun[self._input_vars[0]] = x
+        else:
+            for i, n in enumerate(self._input_vars):
+                var_dict._fun[n] = x[self._input_cum[i]:self._input_cum[i + 1]]
+        return var_dict
+
+    def _fun_schedule(self, use_surrogate):
+        """The modules to be evaluated by fun, with the index of each step."""
         start, stop = self._get_start_stop()
         if use_surrogate and self.has_surrogate:
             si = np.searchsorted(self._surrogate_recipe[:, 1], start)
             if si == self.n_surrogate:
                 use_surrogate = False
+        schedule = []
         i = start
         while i <= stop:
-            try:
-                if use_surrogate and self.has_surrogate:
-                    if i < self._surrogate_recipe[si, 1]:
-                        _module = self._module_list[i]
-                        di = 1
-                    elif i == self._surrogate_recipe[si, 1]:
-                        _module = self._surrogate_list[
-                            self._surrogate_recipe[si, 0]]
-                        di = self._surrogate_recipe[si, 2]
-                        if si == self.n_surrogate - 1:
-                            use_surrogate = False
-                        else:
-                            si += 1
-                    else:
-                        raise RuntimeError('unexpected value for i and si.')
-                else:
+            if use_surrogate and self.has_surrogate:
+                if i < self._surrogate_recipe[si, 1]:
                     _module = self._module_list[i]
                     di = 1
+                elif i == self._surrogate_recipe[si, 1]:
+                    _module = self._surrogate_list[
+                        self._surrogate_recipe[si, 0]]
+                    di = self._surrogate_recipe[si, 2]
+                    if si == self.n_surrogate - 1:
+                        use_surrogate = False
+                    else:
+                        si += 1
+                else:
+                    raise RuntimeError('unexpected value for i and si.')
+            else:
+                _module = self._module_list[i]
+                di = 1
+            schedule.append((i, _module))
+            i += di
+        return schedule
+
+    @staticmethod
+    def _fun_update(var_dict, _module, _output):
+        for j, n in enumerate(_module._output_vars):
+            var_dict._fun[n] = _output[j]
+        for n in _module._delete_vars:
+            del var_dict._fun[n]
+
+    async def afun(self, x, original_space=None, use_surrogate=None):
+        """
+        Asynchronous version of `fun` for a single point, which awaits the
+        modules whose `fun` are coroutine functions, so that many evaluations
+        can be in flight at the same time, e.g. with the `asyncio` backend.
+        """
+        original_space, use_surrogate = self._check_os_us(original_space,
+                                                          use_surrogate)
+        x = np.atleast_1d(x)
+        if x.ndim != 1 or x.dtype.kind != 'f':
+            raise ValueError('afun only supports a single point, as a 1-d '
+                             'array of float.')
+        var_dict = self._fun_input(x, original_space)
+        for i, _module in self._fun_schedule(use_surrogate):
+            try:
                 _input = [var_dict._fun[n] for n in _module._input_vars]
-                _output = _module.fun(*_input)
-                for j, n in enumerate(_module._output_vars):
-                    var_dict._fun[n] = _output[j]
-                for n in _module._delete_vars:
-                    del var_dict._fun[n]
+                if hasattr(_module, 'afun'):
+                    _output = await _module.afun(*_input)
+                else:
+                    _output = _module.fun(*_input)
+                self._fun_update(var_dict, _module, _output)
             except Exception:
                 raise RuntimeError(
                     'pipeline fun evaluation failed at step #{}.'.format(i))
-            i += di
         return var_dict
 
     __call__ = fun
@@ -649,6 +689,19 @@ class Density(Pipeline, _DensityBase):
         original_space, use_surrogate = self._check_os_us(original_space,
                                                           use_surrogate)
         _fun = self.fun(x, original_space, use_surrogate)
+        return self._logp_from_fun(x, _fun, original_space, use_surrogate)
+
+    __call__ = logp
+
+    async def alogp(self, x, original_space=None, use_surrogate=None):
+        """Asynchronous version of `logp` for a single point, see `afun`."""
+        x = np.asarray(x)
+        original_space, use_surrogate = self._check_os_us(original_space,
+                                                          use_surrogate)
+        _fun = await self.afun(x, original_space, use_surrogate)
+        return self._logp_from_fun(x, _fun, original_space, use_surrogate)
+
+    def _logp_from_fun(self, x, _fun, original_space, use_surrogate):
         _logp = VariableDict.get(_fun, self.density_name, 'fun')[..., 0]
         if self._use_decay and use_surrogate:
             x_o = x if original_space else self.to_original(x)
@@ -659,8 +712,6 @@ class Density(Pipeline, _DensityBase):
             _logp += self._get_diff(x_trans=x)
         return _logp
 
-    __call__ = logp
-
     def grad(self, x, original_space=None, use_surrogate=None):
         x = np.asarray(x)
         if x.dtype.kind != 'f':
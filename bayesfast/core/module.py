@@ -3,6 +3,8 @@ from collections import namedtuple
 from ..utils.collections import PropertyList
 from ..utils import all_isinstance
 import warnings
+import inspect
+import asyncio
 
 __all__ = ['ModuleBase', 'Module', 'Surrogate']
 
@@ -11,6 +13,37 @@ __all__ = ['ModuleBase', 'Module', 'Surrogate']
 # TODO: check if Surrogate has been fitted?
 
 
+async def _await(awaitable):
+    return await awaitable
+
+
+def _get_running_loop():
+    try:
+        return asyncio.get_running_loop()
+    except AttributeError: # python 3.6
+        return asyncio._get_running_loop()
+    except RuntimeError:
+        return None
+
+
+def _run_sync(awaitable):
+    """
+    Run the awaitable to completion with a new event loop. If an event loop is
+    already running in this thread, e.g. in Jupyter or when called from a
+    coroutine, the new loop is run in a separate thread, and the running loop
+    is blocked in the meantime; use `afun` instead in that case.
+    """
+    if _get_running_loop() is not None:
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(1) as executor:
+            return executor.submit(_run_sync, awaitable).result()
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(_await(awaitable))
+    finally:
+        loop.close()
+
+
 class ModuleBase:
     """
     Base class for Module.
@@ -150,8 +183,30 @@ class ModuleBase:
     def _fun_wrapped(self, *args):
         args = self._reshape(args, 'input')
         fun_out = self._fun(*args, *self._fun_args, **self._fun_kwargs)
+        if inspect.isawaitable(fun_out):
+            fun_out = _run_sync(fun_out)
         return self._reshape(fun_out, 'output_fun')
 
+    async def afun(self, *args):
+        """
+        Asynchronous version of `fun`. If `fun` is a coroutine function, it
+        will be awaited, so that other evaluations can proceed in the meantime.
+        Otherwise, it is simply called.
+        """
+        if not self.has_fun:
+            return self.fun(*args)
+        self._ncall_fun += 1
+        args = self._reshape(args, 'input')
+        fun_out = self._fun(*args, *self._fun_args, **self._fun_kwargs)
+        if inspect.isawaitable(fun_out):
+            fun_out = await fun_out
+        return self._reshape(fun_out, 'output_fun')
+
+    @property
+    def is_async(self):
+        """Whether `fun` is a coroutine function."""
+        return self.has_fun and inspect.iscoroutinefunction(self._fun)
+
     @property
     def has_fun(self):
         try:
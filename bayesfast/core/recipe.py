@@ -3,9 +3,9 @@ from .density import Density, DensityLite
 from .sample import sample
 from ..modules.poly import PolyConfig, PolyModel
 from ..samplers import SampleTrace, NTrace, _HTrace, TraceTuple
-from ..samplers import _get_step_size, _get_metric
+from ..samplers import _get_step_size, _get_metric, DelayedAcceptance
 from ..utils import all_isinstance, Laplace, untemper_laplace_samples
-from ..utils.parallel import ParallelBackend, get_backend
+from ..utils.parallel import ParallelBackend, StragglerPolicy, get_backend
 from ..utils.random import get_generator
 from ..utils.sobol import multivariate_normal
 from ..utils import SystematicResampler, integrated_time
@@ -15,20 +15,22 @@ import numpy as np
 from collections import namedtuple, OrderedDict
 import warnings
 from copy import deepcopy
+from functools import partial
 from scipy.special import logsumexp
+import os
+import dill
+import hashlib
 
 __all__ = ['BaseStep', 'OptimizeStep', 'SampleStep', 'PostStep', 'Recipe']
 
 # TODO: RecipeTrace.n_call
 # TODO: early stop in pipeline evaluation
-# TODO: early stop by comparing KL
 # TODO: use tqdm to add progress bar for map
 # TODO: better control when we don't have enough points before resampling
 # TODO: {} as default value
 # TODO: monitor the progress of IS
 # TODO: improve optimization with trust region?
 #       https://arxiv.org/pdf/1804.00154.pdf
-# TODO: add checkpoint facility
 # TODO: review Recipe.__getstate__
 
 
@@ -227,11 +229,22 @@ class OptimizeStep(BaseStep):
 
 
 class SampleStep(BaseStep):
-    """Configuring a step for sampling."""
+    """
+    Configuring a step for sampling.
+
+    If `warm_start` is `True` and this is the first SampleStep following an
+    OptimizeStep that did not sample the surrogate, the chains will be
+    initialized from the Laplace approximation: the `diag` or `full` metric
+    starts from the Laplace covariance, with the `diag` metric the step size
+    guess is rescaled by the conditioning of the Laplace correlation matrix,
+    and each chain starts from a different point of the quasi-random Laplace
+    samples.
+    """
     def __init__(self, surrogate_list=(), alpha_n=2., sample_trace=None,
                  resampler={}, reuse_samples=0, reuse_step_size=True,
                  reuse_metric=True, random_generator=None, logp_cutoff=True,
-                 alpha_min=0.75, alpha_supp=1.25, x_0=None, fitted=False):
+                 alpha_min=0.75, alpha_supp=1.25, x_0=None, fitted=False,
+                 warm_start=False):
         super().__init__(surrogate_list, alpha_n, fitted, sample_trace, x_0,
                          random_generator, reuse_metric)
         self.resampler = resampler
@@ -240,6 +253,7 @@ class SampleStep(BaseStep):
         self.logp_cutoff = logp_cutoff
         self.alpha_min = alpha_min
         self.alpha_supp = alpha_supp
+        self.warm_start = warm_start
 
     @property
     def resampler(self):
@@ -308,19 +322,38 @@ class SampleStep(BaseStep):
             raise ValueError('invalid value for alpha_supp.')
         self._alpha_supp = asu
 
+    @property
+    def warm_start(self):
+        return self._warm_start
+
+    @warm_start.setter
+    def warm_start(self, ws):
+        self._warm_start = bool(ws)
+
     @property
     def n_eval_min(self):
         return int(self.alpha_min * self.n_eval)
 
 
 class PostStep:
-    """Configuring a step for post-processing."""
+    """
+    Configuring a step for post-processing.
+
+    If `delayed_acceptance` is not `None`, instead of importance sampling, the
+    samples of the true density will be drawn with delayed-acceptance MCMC,
+    using the surrogate of the last step as the first stage. `sample_trace`
+    configures this sampling, and by default the chains continue from the
+    surrogate samples, with the step size and metric reused.
+    """
     def __init__(self, n_is=0, k_trunc=0.25, evidence_method=None,
-                 random_generator=None):
+                 random_generator=None, delayed_acceptance=None,
+                 sample_trace=None):
         self.n_is = n_is
         self.k_trunc = k_trunc
         self.evidence_method = evidence_method
         self.random_generator = random_generator
+        self.delayed_acceptance = delayed_acceptance
+        self.sample_trace = sample_trace
 
     @property
     def n_is(self):
@@ -380,11 +413,50 @@ class PostStep:
         else:
             self._random_generator = np.random.default_rng(generator)
 
+    @property
+    def delayed_acceptance(self):
+        return self._delayed_acceptance
+
+    @delayed_acceptance.setter
+    def delayed_acceptance(self, da):
+        if da is None or isinstance(da, DelayedAcceptance):
+            pass
+        elif da is True:
+            da = DelayedAcceptance()
+        elif isinstance(da, dict):
+            da = DelayedAcceptance(**da)
+        else:
+            raise ValueError('invalid value for delayed_acceptance.')
+        self._delayed_acceptance = da
+
+    @property
+    def sample_trace(self):
+        return self._sample_trace
+
+    @sample_trace.setter
+    def sample_trace(self, t):
+        if t is None or isinstance(t, (dict, _HTrace)):
+            self._sample_trace = t
+        else:
+            raise ValueError('invalid value for sample_trace.')
+
 
 class SampleStrategy:
     """Configuring a multi-step sample strategy."""
     def __init__(self):
         self._i = 0
+        self._n_skipped = 0
+        self._n_call_saved = 0
+
+    @property
+    def n_skipped(self):
+        """The number of SampleSteps skipped by early termination."""
+        return getattr(self, '_n_skipped', 0)
+
+    @property
+    def n_call_saved(self):
+        """The number of true model evaluations saved by early termination."""
+        return getattr(self, '_n_call_saved', 0)
 
     def update(self, sample_results):
         raise NotImplementedError('abstract method.')
@@ -395,8 +467,34 @@ class SampleStrategy:
 
 
 class StaticSample(SampleStrategy):
-    """Configuring a static multi-step sample strategy."""
-    def __init__(self, sample_steps, multiplicity=None, verbose=True):
+    """
+    Configuring a static multi-step sample strategy.
+
+    Parameters
+    ----------
+    sample_steps : SampleStep, dict, or sequence of them
+        The SampleSteps to run.
+    multiplicity : None or sequence of positive int, optional
+        If not `None`, each element of `sample_steps` will be repeated by the
+        corresponding times. Set to `None` by default.
+    verbose : bool, optional
+        Whether to print the progress messages. Set to `True` by default.
+    kl_threshold : None or positive float, optional
+        If not `None`, the remaining SampleSteps will be skipped once the KL
+        divergence between the surrogate posteriors of two successive steps is
+        smaller than `kl_threshold`. Set to `None` by default.
+
+    Notes
+    -----
+    The KL divergence `KL(q_i || q_{i-1})` is estimated from the samples of
+    the latest surrogate posterior `q_i`, with the previous surrogate models
+    evaluated on (a thinned subset of) them, as `log(mean(w)) - mean(log(w))`
+    where `w = q_{i-1} / q_i`, which does not depend on the unknown
+    normalizations. No true model evaluation is needed for this check, and the
+    `n_eval` evaluations of each skipped step are recorded in `n_call_saved`.
+    """
+    def __init__(self, sample_steps, multiplicity=None, verbose=True,
+                 kl_threshold=None):
         super().__init__()
         if multiplicity is not None:
             if not hasattr(sample_steps, '__iter__'):
@@ -411,6 +509,7 @@ class StaticSample(SampleStrategy):
                                   'interpret it.', RuntimeWarning)
         self.sample_steps = sample_steps
         self.verbose = verbose
+        self.kl_threshold = kl_threshold
 
     @property
     def sample_steps(self):
@@ -446,8 +545,39 @@ class StaticSample(SampleStrategy):
     def verbose(self, v):
         self._verbose = bool(v)
 
+    @property
+    def kl_threshold(self):
+        return getattr(self, '_kl_threshold', None)
+
+    @kl_threshold.setter
+    def kl_threshold(self, kt):
+        if kt is None:
+            self._kl_threshold = None
+        else:
+            try:
+                kt = float(kt)
+                assert kt > 0.
+            except Exception:
+                raise ValueError('kl_threshold should be a positive float or '
+                                 'None.')
+            self._kl_threshold = kt
+
     def update(self, sample_results):
         i_step = len(sample_results)
+        if (i_step < self.n_step and self.kl_threshold is not None and
+            i_step > 0 and sample_results[-1].kl is not None and
+            sample_results[-1].kl < self.kl_threshold):
+            skipped = self.sample_steps[i_step:]
+            self._n_skipped = len(skipped)
+            self._n_call_saved = sum(s.n_eval for s in skipped if
+                                     s.has_surrogate and not s._fitted)
+            if self.verbose:
+                print('\n *** StaticSample: iter #{}, KL = {:.4g} < '
+                      'kl_threshold, skipping the remaining {} SampleStep(s) '
+                      'and about {} true model evaluations. *** \n'.format(
+                      i_step, sample_results[-1].kl, self._n_skipped,
+                      self._n_call_saved))
+            return None
         if i_step < self.n_step:
             if self.verbose:
                 print('\n *** StaticSample: returning the #{} SampleStep. *** '
@@ -478,7 +608,7 @@ class RecipeTrace:
     The default behavior of SampleStrategy initialization may change later.
     """
     def __init__(self, optimize=None, sample=None, post=None,
-                 sample_multiplicity=None):
+                 sample_multiplicity=None, sample_kl_threshold=None):
         if isinstance(optimize, OptimizeStep) or optimize is None:
             self._s_optimize = deepcopy(optimize)
         elif isinstance(optimize, dict):
@@ -491,7 +621,9 @@ class RecipeTrace:
         else:
             try:
                 # TODO: update this when DynamicSample is ready
-                self._strategy = StaticSample(sample, sample_multiplicity)
+                self._strategy = StaticSample(
+                    sample, sample_multiplicity,
+                    kl_threshold=sample_kl_threshold)
             except:
                 raise ValueError('failed to initialize a StaticSample.')
 
@@ -558,12 +690,19 @@ class RecipeTrace:
         else:
             return self._r_post.n_call
 
+    @property
+    def n_call_saved(self):
+        """The number of true model evaluations saved by early termination."""
+        return self._strategy.n_call_saved
+
     # TODO: update this when DynamicSample is ready
     @property
     def finished(self):
         if self._n_sample is not None:
             return RecipePhases(self._i_optimize == self._n_optimize,
-                                self._i_sample == self._n_sample,
+                                (self._i_sample == self._n_sample or
+                                 self._i_sample + self._strategy.n_skipped ==
+                                 self._n_sample),
                                 self._i_post == self._n_post)
         else:
             raise NotImplementedError
@@ -583,7 +722,8 @@ OptimizeResult = namedtuple('OptimizeResult', 'x_max, f_max, surrogate_list, '
 
 
 SampleResult = namedtuple('SampleResult', 'samples, surrogate_list, '
-                          'var_dicts, sample_trace')
+                          'var_dicts, sample_trace, kl')
+SampleResult.__new__.__defaults__ = (None,)
 
 
 PostResult = namedtuple('PostResult', 'samples, weights, weights_trunc, logp, '
@@ -591,11 +731,121 @@ PostResult = namedtuple('PostResult', 'samples, weights, weights_trunc, logp, '
                         'trace_p, trace_q, n_call, x_max, f_max')
 
 
+def _dump(obj, filename):
+    """Pickle to a temporary file first, so that the dump is atomic."""
+    with open(filename + '.tmp', 'wb') as f:
+        dill.dump(obj, f)
+    os.replace(filename + '.tmp', filename)
+
+
+def _isin_rows(a, b):
+    """Whether each row of a is also a row of b."""
+    rows = {r.tobytes() for r in np.ascontiguousarray(b, dtype=a.dtype)}
+    return np.array([r.tobytes() in rows for r in np.ascontiguousarray(a)],
+                    dtype=bool)
+
+
+def _describe(obj, depth=4):
+    """A deterministic description of the configuration stored in obj."""
+    if obj is None or isinstance(obj, (bool, int, float, str, np.number,
+                                       np.bool_)):
+        return repr(obj)
+    elif isinstance(obj, np.ndarray) and obj.dtype.kind != 'O':
+        return '{}{}'.format(hashlib.sha1(
+            np.ascontiguousarray(obj).tobytes()).hexdigest(), obj.shape)
+    elif isinstance(obj, (list, tuple, np.ndarray)):
+        return [_describe(o, depth) for o in obj]
+    elif isinstance(obj, dict):
+        return [(str(k), _describe(v, depth)) for k, v in obj.items()]
+    elif (depth > 0 and hasattr(obj, '__dict__') and
+          type(obj).__module__.startswith('bayesfast')):
+        return type(obj).__name__, _describe(vars(obj), depth - 1)
+    else:
+        return type(obj).__name__
+
+
+def _laplace_warm_start(sample_trace, laplace_result, laplace_samples):
+    """Initialize the metric, step size and x_0 from the Laplace fit."""
+    cov = laplace_result.cov.copy()
+    if isinstance(sample_trace._metric, str):
+        if sample_trace._metric == 'diag':
+            sample_trace._metric = np.diag(cov).copy()
+            # with a diagonal metric, the preconditioned target has roughly
+            # the correlation matrix of the Laplace fit as its covariance,
+            # whose narrowest direction has a width of sqrt(lambda_min). The
+            # stable leapfrog step size scales with this width, so the initial
+            # guess (which assumes a unit-scale target) is shrunk by
+            # sqrt(lambda_min), clipped to [0.01, 1]. A full metric whitens
+            # the target, so it needs no rescaling.
+            std = np.diag(cov)**0.5
+            lam_min = np.linalg.eigvalsh(cov / np.outer(std, std))[0]
+            factor = min(1., max(lam_min, 1e-4)**0.5)
+            if sample_trace._step_size is None:
+                sample_trace._step_size = factor
+            elif not hasattr(sample_trace._step_size, 'current'):
+                sample_trace._step_size = factor * float(
+                    sample_trace._step_size)
+        elif sample_trace._metric == 'full':
+            sample_trace._metric = cov
+    # the quasi-random samples spread more evenly than random choices
+    if laplace_samples.shape[0] >= sample_trace.n_chain:
+        sample_trace.x_0 = laplace_samples[:sample_trace.n_chain]
+        sample_trace._x_0_transformed = True
+
+
 class Recipe:
+    """
+    Running the optimize, sample and post steps of BayesFast.
 
+    Notes
+    -----
+    If `checkpoint` is given as a directory, the state of the Recipe, including
+    the RecipeTrace, the Density and the global random generator, will be saved
+    there after each step, together with the true model evaluations and the
+    sampling checkpoints of the current step. The evaluations are saved as one
+    file for each parallel map. When `run` is called again with the same
+    `checkpoint`, the Recipe resumes from the last finished step, and reuses
+    the saved evaluations and chain states of the interrupted step, so that
+    the results are identical to those without interruption. A fingerprint of
+    the configuration of the steps and the Density is saved together, and
+    resuming with a different configuration will raise a RuntimeError.
+
+    If `straggler_policy` is not `None`, the true model evaluations used to fit
+    the surrogates will be run with
+    `ParallelBackend.map_tolerant`, i.e. with per-task timeouts, retries and
+    speculative re-execution of the slowest tasks. The points that fail or time
+    out are dropped. A SampleStep continues with the completed subset as long
+    as `n_eval_min` points are left, or otherwise supplementary points are
+    evaluated if `logp_cutoff` is `True`.
+
+    If `pipelined` is `True`, the true model evaluations of the next
+    SampleStep are started when the chains of the current SampleStep have
+    finished a fraction `pipeline_fraction` of the post-warmup iterations,
+    using the samples so far, and run on the workers that are not used by the
+    chains. The next surrogate is fitted as soon as `n_eval_min` of them have
+    finished, while the remaining points that have not been started are
+    cancelled, and those in flight are added to the step's `var_dicts` after
+    its sampling. This only applies to a static sample strategy with NUTS/HMC,
+    between two steps with surrogates where the latter needs new evaluations,
+    and is not used with `checkpoint`. It also requires more workers than
+    chains, otherwise a warning is raised and the steps are run one after
+    another. Note that the results depend on the timing of the evaluations,
+    and are not exactly reproducible.
+
+    If `sample_kl_threshold` is not `None`, the remaining SampleSteps will be
+    skipped once the surrogate posteriors of two successive steps agree, see
+    `StaticSample` for details. The number of true model evaluations saved is
+    recorded in `recipe_trace.n_call_saved`.
+
+    If `verbose` is `False`, the progress messages of the Recipe will not be
+    printed.
+    """
     def __init__(self, density, parallel_backend=None, recipe_trace=None,
                  optimize=None, sample=None, post=None,
-                 sample_multiplicity=None, copy_density=True):
+                 sample_multiplicity=None, copy_density=True,
+                 checkpoint=None, straggler_policy=None, pipelined=False,
+                 sample_kl_threshold=None, pipeline_fraction=0.5,
+                 verbose=True):
         if isinstance(density, (Density, DensityLite)):
             self._density = deepcopy(density) if copy_density else density
         else:
@@ -605,7 +855,8 @@ class Recipe:
 
         if recipe_trace is None:
             recipe_trace = RecipeTrace(optimize, sample, post,
-                                       sample_multiplicity)
+                                       sample_multiplicity,
+                                       sample_kl_threshold)
         elif isinstance(recipe_trace, RecipeTrace):
             pass
         elif isinstance(recipe_trace, dict):
@@ -613,16 +864,28 @@ class Recipe:
         else:
             raise ValueError('recipe_trace should be a RecipeTrace or None.')
         self._recipe_trace = recipe_trace
+        self._fingerprint = hashlib.sha1(repr(_describe(
+            (self._density, recipe_trace))).encode()).hexdigest()
+        self.checkpoint = checkpoint
+        self.straggler_policy = straggler_policy
+        self.pipelined = pipelined
+        self.pipeline_fraction = pipeline_fraction
+        self._pipeline = None
+        self._leftover = None
+        self._map_cache = []
+        self._i_map = 0
+        self.verbose = verbose
 
     def __getstate__(self):
         """We need this to make self._parallel_backend work correctly."""
         self_dict = self.__dict__.copy()
         del self_dict['_parallel_backend'], self_dict['_recipe_trace']
+        del self_dict['_map_cache'], self_dict['_pipeline']
+        del self_dict['_leftover']
         # TODO: review this
-        #       we remove recipe_trace because it contains a PropertyList
-        #       that is not pickle-able
-        #       however, this may lead to unexpected bahaviors
-        #       if one wants to pickle this Recipe object
+        #       we remove recipe_trace since it can be large and is not needed
+        #       when the methods of Recipe are sent to the workers
+        #       to save the whole state, use the checkpoint facility instead
         return self_dict
 
     @property
@@ -647,6 +910,275 @@ class Recipe:
     def recipe_trace(self):
         return self._recipe_trace
 
+    @property
+    def checkpoint(self):
+        return self._checkpoint
+
+    @checkpoint.setter
+    def checkpoint(self, path):
+        if path is None:
+            self._checkpoint = None
+        else:
+            try:
+                path = os.fspath(path)
+                os.makedirs(path, exist_ok=True)
+            except Exception:
+                raise ValueError('checkpoint should be a str or None.')
+            self._checkpoint = path
+
+    @property
+    def straggler_policy(self):
+        return self._straggler_policy
+
+    @straggler_policy.setter
+    def straggler_policy(self, policy):
+        if policy is None or isinstance(policy, StragglerPolicy):
+            self._straggler_policy = policy
+        elif isinstance(policy, dict):
+            self._straggler_policy = StragglerPolicy(**policy)
+        else:
+            raise ValueError('straggler_policy should be a StragglerPolicy, a '
+                             'dict or None.')
+
+    @property
+    def verbose(self):
+        return self._verbose
+
+    @verbose.setter
+    def verbose(self, v):
+        self._verbose = bool(v)
+
+    @property
+    def pipelined(self):
+        return self._pipelined
+
+    @pipelined.setter
+    def pipelined(self, p):
+        self._pipelined = bool(p)
+
+    @property
+    def pipeline_fraction(self):
+        return self._pipeline_fraction
+
+    @pipeline_fraction.setter
+    def pipeline_fraction(self, pf):
+        try:
+            pf = float(pf)
+            assert 0. < pf < 1.
+        except Exception:
+            raise ValueError('pipeline_fraction should be a float in (0, 1).')
+        self._pipeline_fraction = pf
+
+    def _checkpoint_file(self, name):
+        return os.path.join(self._checkpoint, name)
+
+    def _sample_checkpoint(self, name):
+        if self._checkpoint is None:
+            return None
+        else:
+            return self._checkpoint_file(name)
+
+    def _save_checkpoint(self):
+        """Save the state when a step has finished."""
+        self._map_cache = []
+        self._i_map = 0
+        if self._checkpoint is None:
+            return
+        _dump({'density': self._density, 'recipe_trace': self._recipe_trace,
+               'random_state': get_generator().bit_generator.state,
+               'fingerprint': self._fingerprint},
+              self._checkpoint_file('recipe.pkl'))
+        self._remove_map_cache(0)
+
+    def _map_cache_file(self, i):
+        return self._checkpoint_file('map-{}.pkl'.format(i))
+
+    def _remove_map_cache(self, start):
+        """Remove the saved evaluations of the maps from #start."""
+        i = start
+        while os.path.isfile(self._map_cache_file(i)):
+            os.remove(self._map_cache_file(i))
+            i += 1
+
+    def _load_checkpoint(self):
+        """Restore the state, and return whether a checkpoint is found."""
+        if (self._checkpoint is None or
+            not os.path.isfile(self._checkpoint_file('recipe.pkl'))):
+            return False
+        with open(self._checkpoint_file('recipe.pkl'), 'rb') as f:
+            state = dill.load(f)
+        if state.get('fingerprint') != self._fingerprint:
+            raise RuntimeError(
+                'the checkpoint in {} was saved with a different configuration '
+                'of the Recipe. Please use another directory for checkpoint, '
+                'or remove the existing files to start over.'.format(
+                self._checkpoint))
+        self._density = state['density']
+        self._recipe_trace = state['recipe_trace']
+        get_generator().bit_generator.state = state['random_state']
+        self._map_cache = []
+        while os.path.isfile(self._map_cache_file(len(self._map_cache))):
+            with open(self._map_cache_file(len(self._map_cache)), 'rb') as f:
+                self._map_cache.append(dill.load(f))
+        self._i_map = 0
+        if self._verbose:
+            print('\n ***** Recipe: resuming from the checkpoint in {}. ***** '
+                  '\n'.format(self._checkpoint))
+        return True
+
+    def _map(self, fun, x, out_shape=None, tolerant=False):
+        """
+        Parallel map, reusing the results saved before interruption. If
+        `tolerant` and `straggler_policy` is set, the failed points are `None`.
+        """
+        if self._i_map < len(self._map_cache):
+            x_cache, res = self._map_cache[self._i_map]
+            if np.array_equal(x_cache, x):
+                self._i_map += 1
+                return res
+            del self._map_cache[self._i_map:]
+            if self._checkpoint is not None:
+                self._remove_map_cache(self._i_map)
+        with self.parallel_backend:
+            if tolerant and self._straggler_policy is not None:
+                res = self.parallel_backend.map_tolerant(
+                    self.parallel_backend.broadcast(fun), np.asarray(x),
+                    policy=self._straggler_policy)[0]
+            else:
+                res = self.parallel_backend.map(
+                    self.parallel_backend.broadcast(fun), np.asarray(x),
+                    chunksize='auto', shared_memory='auto',
+                    out_shape=out_shape)
+        if self._checkpoint is not None:
+            self._map_cache.append((np.array(x, copy=True), res))
+            _dump(self._map_cache[-1], self._map_cache_file(self._i_map))
+            self._i_map += 1
+        return res
+
+    def _next_pipelined(self, i, this_step, sample_trace):
+        """Return the next SampleStep if it can be pipelined, otherwise None."""
+        strategy = self.recipe_trace._strategy
+        if not (self._pipelined and self._checkpoint is None and
+                isinstance(strategy, StaticSample) and
+                i + 1 < strategy.n_step and this_step.has_surrogate and
+                isinstance(sample_trace, _HTrace) and sample_trace.i_iter == 0
+                and sample_trace.n_iter - sample_trace.n_warmup >= 4):
+            return None
+        next_step = strategy.sample_steps[i + 1]
+        if not (next_step.has_surrogate and not next_step._fitted and
+                next_step.x_0 is None and next_step.n_eval > 0):
+            return None
+        if self.parallel_backend.n_worker <= sample_trace.n_chain:
+            warnings.warn(
+                'the pipelined mode needs more workers than the {} chains, '
+                'but only {} are available, so the SampleSteps will be run one '
+                'after another.'.format(sample_trace.n_chain,
+                self.parallel_backend.n_worker), RuntimeWarning)
+            return None
+        return next_step
+
+    def _sample_pipelined(self, sample_trace, next_step):
+        """
+        Sample the surrogate, starting the evaluations of the next step when
+        the chains have finished `pipeline_fraction` of the iterations.
+        """
+        n_run = sample_trace.n_warmup + int(self._pipeline_fraction *
+                                            (sample_trace.n_iter -
+                                             sample_trace.n_warmup))
+        with self.parallel_backend:
+            t = sample(self.density, sample_trace=sample_trace, n_run=n_run,
+                       parallel_backend=self.parallel_backend)
+            x = t.get(flatten=True)
+            logq = t.get(return_type='logp', flatten=True)
+            if x.shape[0] >= next_step.n_eval:
+                if next_step.resampler is None:
+                    i_resample = np.arange(next_step.n_eval)
+                else:
+                    i_resample = next_step.resampler(logq, next_step.n_eval)
+                n_free = self.parallel_backend.n_worker - sample_trace.n_chain
+                # the function is not broadcast, since the old broadcasts may
+                # be released before the background tasks are finished
+                tm = self.parallel_backend.map_tolerant(
+                    partial(self.density.fun, original_space=True,
+                    use_surrogate=False), x[i_resample],
+                    policy=self._straggler_policy, background=True,
+                    max_in_flight=n_free)
+                self._pipeline = (tm, x[i_resample], logq[i_resample])
+                if self._verbose:
+                    print(' Recipe: started {} true model evaluations for the '
+                          'next SampleStep after {} iterations, using {} idle '
+                          'workers.'.format(next_step.n_eval, n_run, n_free))
+            t = sample(self.density, sample_trace=t,
+                       parallel_backend=self.parallel_backend)
+        if self._pipeline is not None:
+            self._pipeline[0].max_in_flight = None
+        return t
+
+    def _collect_pipeline(self, this_step):
+        """
+        Wait for `n_eval_min` evaluations started by the last step, and
+        cancel the others that have not been started. Also return the points
+        that have been started.
+        """
+        tm, x, logq = self._pipeline
+        self._pipeline = None
+        res, is_done = tm.wait(this_step.n_eval_min)
+        tm.cancel()
+        self._leftover = (tm, is_done)
+        if not np.any(is_done):
+            raise RuntimeError('all the {} true model evaluations have failed '
+                               'or timed out.'.format(is_done.size))
+        var_dicts = np.asarray([res[j] for j in np.where(is_done)[0]])
+        return var_dicts, logq[is_done], x[tm.is_started]
+
+    def _collect_leftover(self, var_dicts):
+        """Add the evaluations that were still running when fitting."""
+        tm, is_used = self._leftover
+        self._leftover = None
+        res, is_done = tm.wait()
+        i_new = np.where(is_done & ~is_used)[0]
+        if i_new.size > 0:
+            var_dicts = np.concatenate((var_dicts,
+                                        np.asarray([res[j] for j in i_new])))
+        return var_dicts
+
+    # the max number of samples used to estimate the KL divergence
+    _kl_n_max = 1000
+
+    def _kl_step(self, sample_trace, prev_surrogate_list):
+        """Estimate KL(q_i || q_{i-1}) from the samples of q_i."""
+        x = sample_trace.get(flatten=True)
+        logq = sample_trace.get(return_type='logp', flatten=True)
+        if x.shape[0] > self._kl_n_max:
+            i_kl = np.linspace(0, x.shape[0] - 1, self._kl_n_max).astype(np.int)
+            x, logq = x[i_kl], logq[i_kl]
+        surrogate_list = self.density._surrogate_list
+        try:
+            self.density._surrogate_list = prev_surrogate_list
+            logq_prev = self.density.logp(x, original_space=True,
+                                          use_surrogate=True)
+        finally:
+            self.density._surrogate_list = surrogate_list
+        log_w = logq_prev - logq
+        if not np.all(np.isfinite(log_w)):
+            return np.inf
+        return float(logsumexp(log_w) - np.log(log_w.size) - np.mean(log_w))
+
+    @staticmethod
+    def _drop_failed(var_dicts, x):
+        """Remove the points whose true model evaluation has failed."""
+        is_done = np.array([vd is not None for vd in var_dicts], dtype=bool)
+        if np.all(is_done):
+            return np.asarray(var_dicts), x
+        if not np.any(is_done):
+            raise RuntimeError('all the {} true model evaluations have failed '
+                               'or timed out.'.format(is_done.size))
+        warnings.warn('{} of the {} true model evaluations have failed or timed'
+                      ' out, and will be dropped.'.format(
+                      np.sum(~is_done), is_done.size), RuntimeWarning)
+        var_dicts = np.asarray([vd for vd in var_dicts if vd is not None])
+        return var_dicts, x[is_done]
+
     def _opt_surro(self, x_0, var_dicts):
         step = self.recipe_trace._s_optimize
         result = self.recipe_trace._r_optimize
@@ -715,15 +1247,16 @@ class Recipe:
                         x_0 = step.x_0.copy()
                 self.density.use_surrogate = False
                 self.density.original_space = True
-                with self.parallel_backend:
-                    var_dicts = self.parallel_backend.map(self.density.fun, x_0)
+                var_dicts, x_0 = self._drop_failed(
+                    self._map(self.density.fun, x_0, tolerant=True), x_0)
                 self.density.fit(var_dicts)
             self._opt_surro(x_0, var_dicts)
             _a = result[-1].f_max
             _pq = _a.logp_trans - _a.logq_trans
-            print(' OptimizeStep proceeding: iter #0 finished, while current '
-                  'logp = {:.3f}, logp_trans = {:.3f}, delta_pq = '
-                  '{:.3f}.'.format(_a.logp, _a.logp_trans, _pq))
+            if self._verbose:
+                print(' OptimizeStep proceeding: iter #0 finished, while '
+                      'current logp = {:.3f}, logp_trans = {:.3f}, delta_pq = '
+                      '{:.3f}.'.format(_a.logp, _a.logp_trans, _pq))
 
             for i in range(1, step.max_iter):
                 if step.n_eval <= 0:
@@ -738,18 +1271,19 @@ class Recipe:
                 x_0 = x_0[:step.n_eval].copy()
                 self.density.use_surrogate = False
                 self.density.original_space = True
-                with self.parallel_backend:
-                    var_dicts = self.parallel_backend.map(self.density.fun, x_0)
+                var_dicts, x_0 = self._drop_failed(
+                    self._map(self.density.fun, x_0, tolerant=True), x_0)
                 self.density.fit(var_dicts)
                 self._opt_surro(x_0, var_dicts)
                 _a = result[-1].f_max
                 _b = result[-2].f_max
                 _pp = _a.logp_trans - _b.logp_trans
                 _pq = _a.logp_trans - _a.logq_trans
-                print(' OptimizeStep proceeding: iter #{} finished, while '
-                      'current logp = {:.3f}, logp_trans = {:.3f}, delta_pp = '
-                      '{:.3f}, delta_pq = {:.3f}.'.format(i, _a.logp,
-                      _a.logp_trans, _pp, _pq))
+                if self._verbose:
+                    print(' OptimizeStep proceeding: iter #{} finished, '
+                          'while current logp = {:.3f}, logp_trans = {:.3f}, '
+                          'delta_pp = {:.3f}, delta_pq = {:.3f}.'.format(
+                          i, _a.logp, _a.logp_trans, _pp, _pq))
                 if i == step.max_iter - 1:
                     warnings.warn('Optimization did not converge within the max'
                                   ' number of iterations.', RuntimeWarning)
@@ -767,8 +1301,9 @@ class Recipe:
                 i_max = is_max[np.argmin(diff_all[is_max])]
 
             result.append(result[i_max])
-            print(' OptimizeStep proceeding: we will use iter #{} as it has '
-                  'the highest logp_trans.\n'.format(i_max))
+            if self._verbose:
+                print(' OptimizeStep proceeding: we will use iter #{} as it '
+                      'has the highest logp_trans.\n'.format(i_max))
 
         else:
             if step.x_0 is None:
@@ -810,7 +1345,8 @@ class Recipe:
         if step.has_surrogate and step.run_sampling:
             self._opt_sample()
         recipe_trace._i_optimize = 1
-        print('\n ***** OptimizeStep finished. ***** \n')
+        if self._verbose:
+            print('\n ***** OptimizeStep finished. ***** \n')
 
     def _opt_sample(self):
         step = self.recipe_trace._s_optimize
@@ -830,11 +1366,13 @@ class Recipe:
         self._density.surrogate_list = result[-1].surrogate_list
         self._density.use_surrogate = True
         t = sample(self.density, sample_trace=sample_trace,
-                   parallel_backend=self.parallel_backend)
+                   parallel_backend=self.parallel_backend,
+                   checkpoint=self._sample_checkpoint('optimize'))
         x = t.get(flatten=True)
         result[-1] = result[-1]._replace(samples=x, sample_trace=t)
-        print('\n *** Finished sampling the surrogate density defined by the '
-              'selected OptimizeStep. *** \n')
+        if self._verbose:
+            print('\n *** Finished sampling the surrogate density defined by '
+                  'the selected OptimizeStep. *** \n')
 
     def _sam_step(self):
         steps = self.recipe_trace._s_sample
@@ -858,7 +1396,7 @@ class Recipe:
                     prev_step = steps[i - 1]
 
             get_prev_density = (get_prev_step and this_step.x_0 is None and
-                                prev_step.sample_trace is not None)
+                                prev_result.sample_trace is not None)
 
             if get_prev_samples:
                 if this_step.x_0 is None:
@@ -877,20 +1415,29 @@ class Recipe:
                 prev_density = prev_result.sample_trace.get(return_type='logp',
                                                             flatten=True)
 
-            if isinstance(sample_trace, _HTrace):
+            if (isinstance(sample_trace, _HTrace) and this_step.warm_start and
+                get_prev_step and i == 0 and this_step.x_0 is None and
+                prev_result.sample_trace is None and
+                sample_trace.tuned is None and sample_trace.x_0 is None):
+                _laplace_warm_start(sample_trace, prev_result.laplace_result,
+                                    prev_samples)
+
+            if isinstance(sample_trace, SampleTrace):
                 if sample_trace.x_0 is None and get_prev_samples:
                     sample_trace.x_0 = prev_samples
                     sample_trace._x_0_transformed = prev_transformed
 
-                if get_prev_step:
+            if isinstance(sample_trace, _HTrace):
+                if get_prev_step and sample_trace.tuned is None:
                     if sample_trace._step_size is None:
                         if (this_step.reuse_step_size and
-                            prev_result.sample_trace is not None):
+                            isinstance(prev_result.sample_trace,
+                                       (_HTrace, TraceTuple))):
                             sample_trace._step_size = _get_step_size(
                                 prev_result.sample_trace)
 
-                    if (sample_trace._metric == 'diag' or
-                        sample_trace._metric == 'full'):
+                    if (isinstance(sample_trace._metric, str) and
+                        sample_trace._metric in ('diag', 'full')):
                         if (this_step.reuse_metric and
                             prev_result.sample_trace is not None):
                             sample_trace._metric = _get_metric(
@@ -923,30 +1470,44 @@ class Recipe:
                             'the true density. Please make sure this is what '
                             'you want.', RuntimeWarning)
 
-                    if get_prev_density:
-                        if this_step.resampler is None:
-                            i_resample = np.arange(this_step.n_eval)
-                        else:
-                            i_resample = this_step.resampler(prev_density,
-                                                             this_step.n_eval)
-
+                    if self._pipeline is not None:
+                        # started when sampling the previous step
+                        var_dicts, logq_fit, x_started = (
+                            self._collect_pipeline(this_step))
+                        i_resample = np.arange(0)
+                        # do not use them again as the supplementary points
+                        is_new = ~_isin_rows(prev_samples, x_started)
+                        prev_samples = prev_samples[is_new]
+                        if get_prev_density:
+                            prev_density = prev_density[is_new]
                     else:
-                        if (this_step.resampler is not None or
-                            this_step.logp_cutoff):
-                            warnings.warn('resampler and logp_cutoff will be '
-                                          'ignored, when get_prev_density is '
-                                          'False.', RuntimeWarning)
-                        if this_step.n_eval > 0:
-                            i_resample = np.arange(this_step.n_eval)
-                        else:
-                            i_resample = np.arange(prev_samples.shape[0])
+                        if get_prev_density:
+                            if this_step.resampler is None:
+                                i_resample = np.arange(this_step.n_eval)
+                            else:
+                                i_resample = this_step.resampler(
+                                    prev_density, this_step.n_eval)
 
-                    x_fit = prev_samples[i_resample]
-                    self.density.use_surrogate = False
-                    self.density.original_space = True
-                    with self.parallel_backend:
-                        var_dicts = np.asarray(
-                            self.parallel_backend.map(self.density.fun, x_fit))
+                        else:
+                            if (this_step.resampler is not None or
+                                this_step.logp_cutoff):
+                                warnings.warn(
+                                    'resampler and logp_cutoff will be '
+                                    'ignored, when get_prev_density is False.',
+                                    RuntimeWarning)
+                            if this_step.n_eval > 0:
+                                i_resample = np.arange(this_step.n_eval)
+                            else:
+                                i_resample = np.arange(prev_samples.shape[0])
+
+                        x_fit = prev_samples[i_resample]
+                        self.density.use_surrogate = False
+                        self.density.original_space = True
+                        var_dicts, i_resample = self._drop_failed(
+                            self._map(self.density.fun, x_fit, tolerant=True),
+                            i_resample)
+                        if get_prev_density:
+                            logq_fit = prev_density[i_resample]
                     var_dicts_fit = var_dicts.copy()
 
                     if this_step.reuse_samples:
@@ -960,7 +1521,6 @@ class Recipe:
                         logp_fit = np.concatenate(
                             [vd.fun[self.density.density_name] for vd in
                             var_dicts_fit])
-                        logq_fit = prev_density[i_resample]
                         logq_min = np.min(logq_fit)
                         np.delete(prev_samples, i_resample, axis=0)
                         np.delete(prev_density, i_resample, axis=0)
@@ -997,10 +1557,9 @@ class Recipe:
                             x_fit = prev_samples[i_resample]
                             self.density.use_surrogate = False
                             self.density.original_space = True
-                            with self.parallel_backend:
-                                var_dicts_supp = np.asarray(
-                                    self.parallel_backend.map(self.density.fun,
-                                    x_fit))
+                            var_dicts_supp, i_resample = self._drop_failed(
+                                self._map(self.density.fun, x_fit,
+                                          tolerant=True), i_resample)
                             logp_supp = np.concatenate(
                                 [vd.fun[self.density.density_name] for vd in
                                 var_dicts_supp])
@@ -1019,35 +1578,69 @@ class Recipe:
                             var_dicts_fit = np.concatenate(
                                 (var_dicts_fit, var_dicts_supp[is_good]))
 
+                    elif ((self._straggler_policy is not None or
+                           self._pipelined) and
+                          len(var_dicts) < this_step.n_eval_min):
+                        raise RuntimeError(
+                            'only {} true model evaluations have succeeded, '
+                            'fewer than n_eval_min = {}.'.format(
+                            len(var_dicts), this_step.n_eval_min))
+
                     self.density.fit(var_dicts_fit)
 
                 self.density.use_surrogate = True
-                t = sample(self.density, sample_trace=sample_trace,
-                           parallel_backend=self.parallel_backend)
+                next_step = self._next_pipelined(i, this_step, sample_trace)
+                if next_step is None:
+                    t = sample(self.density, sample_trace=sample_trace,
+                               parallel_backend=self.parallel_backend,
+                               checkpoint=self._sample_checkpoint(
+                               'sample-{}'.format(i)))
+                else:
+                    t = self._sample_pipelined(sample_trace, next_step)
+                if self._leftover is not None:
+                    var_dicts = self._collect_leftover(var_dicts)
                 x = t.get(flatten=True)
                 surrogate_list = deepcopy(self._density._surrogate_list)
+                if (getattr(recipe_trace._strategy, 'kl_threshold', None) is
+                    not None and i > 0 and results[i - 1].surrogate_list):
+                    kl = self._kl_step(t, results[i - 1].surrogate_list)
+                    if self._verbose:
+                        print(' SampleStep proceeding: KL between the '
+                              'surrogate posteriors of iter #{} and #{} is '
+                              '{:.4g}.'.format(i, i - 1, kl))
+                else:
+                    kl = None
                 results.append(SampleResult(
                     samples=x, surrogate_list=surrogate_list,
-                    var_dicts=var_dicts, sample_trace=t))
+                    var_dicts=var_dicts, sample_trace=t, kl=kl))
 
             else:
                 if isinstance(self._density, Density):
                     self.density.use_surrogate = False
                 t = sample(self.density, sample_trace=sample_trace,
-                           parallel_backend=self.parallel_backend)
+                           parallel_backend=self.parallel_backend,
+                           checkpoint=self._sample_checkpoint(
+                           'sample-{}'.format(i)))
                 x = t.get(flatten=True)
                 results.append(SampleResult(samples=x, surrogate_list=(),
                                             var_dicts=None, sample_trace=t))
 
             steps.append(this_step)
-            print('\n *** SampleStep proceeding: iter #{} finished. *** '
-                  '\n'.format(i))
+            if self._verbose:
+                print('\n *** SampleStep proceeding: iter #{} finished. *** '
+                      '\n'.format(i))
 
             recipe_trace._i_sample += 1
+            self._save_checkpoint()
             i = recipe_trace._i_sample
             this_step = recipe_trace._strategy.update(results)
 
-        print('\n ***** SampleStep finished. ***** \n')
+        if self._pipeline is not None:
+            # the next step has been skipped
+            self._pipeline[0].cancel()
+            self._pipeline = None
+        if self._verbose:
+            print('\n ***** SampleStep finished. ***** \n')
 
     def _pos_step(self):
         step = self.recipe_trace._s_post
@@ -1116,6 +1709,17 @@ class Recipe:
             raise RuntimeError('you have run neither OptimizeStep nor '
                                'SampleStep before the PostStep.')
 
+        n_da = None
+        if x_q is not None and step.delayed_acceptance is not None:
+            trace_p = sample(self.density,
+                             sample_trace=self._da_trace(step, trace_q),
+                             parallel_backend=self.parallel_backend,
+                             checkpoint=self._sample_checkpoint('post'),
+                             delayed_acceptance=step.delayed_acceptance)
+            x_p = trace_p.get(return_type='samples', flatten=False)
+            logp_p = trace_p.get(return_type='logp', flatten=False)
+            n_da = step.delayed_acceptance.n_true
+
         if x_p is not None:
             samples = x_p.reshape((-1, x_p.shape[-1]))
             weights = np.ones(samples.shape[0])
@@ -1150,10 +1754,8 @@ class Recipe:
 
                 self.density.use_surrogate = False
                 self.density.original_space = True
-                with self.parallel_backend:
-                    logp = np.asarray(
-                        self.parallel_backend.map(self.density.logp,
-                        samples)).reshape(-1)
+                logp = np.asarray(self._map(self.density.logp, samples,
+                                            out_shape=())).reshape(-1)
                 weights = np.exp(logp - logq)
                 if step.k_trunc < 0:
                     weights_trunc = weights.copy()
@@ -1189,7 +1791,8 @@ class Recipe:
                               'we only have Laplace samples.', RuntimeWarning)
 
         try:
-            n_call = recipe_trace.n_call + step.n_is
+            n_call = recipe_trace.n_call + (step.n_is if n_da is None else
+                                            n_da)
             warnings.warn('as of now, n_call does not take the possible logp '
                           'calls during evidence evaluation into account.',
                           RuntimeWarning)
@@ -1199,7 +1802,34 @@ class Recipe:
             samples, weights, weights_trunc, logp, logq, logz, logz_err, x_p,
             x_q, logp_p, logq_q, trace_p, trace_q, n_call, x_max, f_max)
         recipe_trace._i_post = 1
-        print('\n ***** PostStep finished. ***** \n')
+        if self._verbose:
+            print('\n ***** PostStep finished. ***** \n')
+
+    def _da_trace(self, step, trace_q):
+        """The trace for delayed acceptance, continuing from trace_q."""
+        if isinstance(step.sample_trace, _HTrace):
+            sample_trace = deepcopy(step.sample_trace)
+        else:
+            n_sample = trace_q.n_iter - trace_q.n_warmup
+            kwargs = {'n_chain': trace_q.n_chain, 'n_warmup': 100,
+                      'n_iter': 100 + n_sample}
+            if step.sample_trace is not None:
+                kwargs.update(step.sample_trace)
+            sample_trace = NTrace(**kwargs)
+        if sample_trace.x_0 is None:
+            x_q = trace_q.get(original_space=False, flatten=False)
+            # continue each chain from its last draw
+            x_q = x_q.reshape((-1,) + x_q.shape[-2:])
+            sample_trace._x_0 = x_q[:, -1].copy()
+            sample_trace._x_0_transformed = True
+        if isinstance(trace_q, (_HTrace, TraceTuple)):
+            if sample_trace._step_size is None:
+                sample_trace._step_size = _get_step_size(trace_q)
+            if (isinstance(sample_trace._metric, str) and
+                sample_trace._metric in ('diag', 'full')):
+                sample_trace._metric = _get_metric(trace_q,
+                                                   sample_trace._metric)
+        return sample_trace
 
     def _f_logp(self, x):
         return self.density.logp(x, original_space=True, use_surrogate=False)
@@ -1208,13 +1838,17 @@ class Recipe:
         return self.density.logp(x, original_space=True, use_surrogate=True)
 
     def run(self):
+        if not self._load_checkpoint():
+            self._save_checkpoint()
         f_opt, f_sam, f_pos = self.recipe_trace.finished
         if not f_opt:
             self._opt_step()
+            self._save_checkpoint()
         if not f_sam:
             self._sam_step()
         if not f_pos:
             self._pos_step()
+            self._save_checkpoint()
 
     def get(self):
         try:
@@ -1,15 +1,21 @@
 from .density import *
 from ..utils.sobol import multivariate_normal
 from ..utils.parallel import ParallelBackend, get_backend
-from ..utils.random import get_generator
+from ..utils.random import get_generator, spawn_generator
 from ..samplers import NUTS, HMC, TNUTS, THMC
-from ..samplers import NTrace, HTrace, TNTrace, THTrace, ETrace
-from ..samplers import SampleTrace, TraceTuple
+from ..samplers import NTrace, HTrace, TNTrace, THTrace, ETrace, STrace
+from ..samplers import SampleTrace, TraceTuple, ConvergenceMonitor, Checkpoint
+from ..samplers import EnsembleSampler, SMC, ReplicaExchange, PooledWarmup
+from ..samplers import DelayedAcceptance, SamplerProfiler
 from threadpoolctl import threadpool_limits
 import numpy as np
 import warnings
+import threading
+import os
+from copy import deepcopy
 from inspect import isclass
 from multiprocess import Manager
+from queue import Empty
 try:
     from distributed import Pub, Sub
     HAS_DASK = True
@@ -19,15 +25,74 @@ except Exception:
 __all__ = ['sample']
 
 # TODO: use tqdm to rewrite sampling progress report
-# TODO: add saving results every x iterations
 # TODO: fix multi-threading
 
 
 def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
-           parallel_backend=None, verbose=True):
+           parallel_backend=None, verbose=True, monitor=None,
+           checkpoint=None, tempering=None, pooled_warmup=None,
+           delayed_acceptance=None, profiler=None):
     if not isinstance(density, (Density, DensityLite)):
         raise ValueError('density should be a Density or DensityLite.')
 
+    if monitor is None or isinstance(monitor, ConvergenceMonitor):
+        pass
+    elif isinstance(monitor, dict):
+        monitor = ConvergenceMonitor(**monitor)
+    else:
+        raise ValueError('monitor should be a ConvergenceMonitor, dict or '
+                         'None.')
+
+    if checkpoint is None or isinstance(checkpoint, Checkpoint):
+        pass
+    elif isinstance(checkpoint, dict):
+        checkpoint = Checkpoint(**checkpoint)
+    elif isinstance(checkpoint, (str, os.PathLike)):
+        checkpoint = Checkpoint(checkpoint)
+    else:
+        raise ValueError('checkpoint should be a Checkpoint, dict, str or '
+                         'None.')
+
+    if tempering is None or isinstance(tempering, ReplicaExchange):
+        pass
+    elif isinstance(tempering, dict):
+        tempering = ReplicaExchange(**tempering)
+    else:
+        raise ValueError('tempering should be a ReplicaExchange, dict or '
+                         'None.')
+
+    if pooled_warmup is None or isinstance(pooled_warmup, PooledWarmup):
+        pass
+    elif isinstance(pooled_warmup, dict):
+        pooled_warmup = PooledWarmup(**pooled_warmup)
+    else:
+        raise ValueError('pooled_warmup should be a PooledWarmup, dict or '
+                         'None.')
+
+    if delayed_acceptance is None:
+        pass
+    else:
+        if isinstance(delayed_acceptance, DelayedAcceptance):
+            pass
+        elif isinstance(delayed_acceptance, dict):
+            delayed_acceptance = DelayedAcceptance(**delayed_acceptance)
+        else:
+            raise ValueError('delayed_acceptance should be a '
+                             'DelayedAcceptance, dict or None.')
+        if not (isinstance(density, Density) and density.has_surrogate):
+            raise ValueError('delayed_acceptance needs a Density with '
+                             'surrogate models.')
+
+    if profiler is None or isinstance(profiler, SamplerProfiler):
+        pass
+    elif isinstance(profiler, dict):
+        profiler = SamplerProfiler(**profiler)
+    elif callable(profiler):
+        profiler = SamplerProfiler(callback=profiler)
+    else:
+        raise ValueError('profiler should be a SamplerProfiler, dict, callable '
+                         'or None.')
+
     if isinstance(sample_trace, NTrace):
         sampler = 'NUTS'
     elif isinstance(sample_trace, HTrace):
@@ -37,7 +102,9 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
     elif isinstance(sample_trace, THTrace):
         sampler = 'THMC'
     elif isinstance(sample_trace, ETrace):
-        raise NotImplementedError
+        sampler = 'Ensemble'
+    elif isinstance(sample_trace, STrace):
+        sampler = 'SMC'
     elif sample_trace is None or isinstance(sample_trace, dict):
         sample_trace = {} if (sample_trace is None) else sample_trace
         if sampler == 'NUTS':
@@ -49,7 +116,9 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
         elif sampler == 'THMC':
             sample_trace = THTrace(**sample_trace)
         elif sampler == 'Ensemble':
-            raise NotImplementedError
+            sample_trace = ETrace(**sample_trace)
+        elif sampler == 'SMC':
+            sample_trace = STrace(**sample_trace)
         else:
             raise ValueError('unexpected value for sampler.')
     elif isinstance(sample_trace, TraceTuple):
@@ -64,8 +133,10 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
         raise ValueError('unexpected value for sample_trace.')
 
     if isinstance(sample_trace, SampleTrace):
-        if sample_trace.random_generator is None:
-            sample_trace.random_generator = get_generator()
+        if sample_trace._random_generator is None:
+            # fix the generator in the parent, so that the chains do not depend
+            # on the state of the (possibly reused) workers
+            sample_trace.random_generator = deepcopy(get_generator())
             get_generator().normal()
         if sample_trace.x_0 is None:
             dim = density.input_size
@@ -79,15 +150,91 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
             sample_trace._x_0 = density.from_original(sample_trace._x_0)
             sample_trace._x_0_transformed = True
 
+    if tempering is not None:
+        if not ((sampler == 'NUTS' or sampler == 'HMC') and
+                isinstance(sample_trace, SampleTrace)):
+            raise NotImplementedError('currently tempering only supports NUTS '
+                                      'and HMC with a new SampleTrace.')
+        if (monitor is not None or checkpoint is not None or
+            pooled_warmup is not None or delayed_acceptance is not None):
+            raise NotImplementedError(
+                'currently tempering cannot be used together with monitor, '
+                'checkpoint, pooled_warmup or delayed_acceptance.')
+        # chain i has beta = betas[i // n_ladder], so that the first n_ladder
+        # chains are the untempered ones
+        n_ladder = sample_trace.n_chain
+        n_total = n_ladder * tempering.n_temp
+        sample_trace = deepcopy(sample_trace)
+        x_0 = sample_trace._x_0.reshape((-1, sample_trace._x_0.shape[-1]))
+        if x_0.shape[0] == n_ladder:
+            sample_trace._x_0 = np.tile(x_0, (tempering.n_temp, 1))
+        sample_trace.n_chain = n_total
+
+    if delayed_acceptance is not None:
+        if not (sampler == 'NUTS' or sampler == 'HMC'):
+            raise NotImplementedError('currently delayed_acceptance only '
+                                      'supports NUTS and HMC.')
+        def logp_true(x):
+            return density.logp(x, original_space=False, use_surrogate=False)
+        delayed_acceptance._activate(logp_true)
+
+    if checkpoint is not None:
+        resumed_traces = checkpoint._load(sample_trace.n_chain)
+        if verbose and resumed_traces:
+            print(' Checkpoint: resuming chain(s) {} from {}.'.format(
+                sorted(resumed_traces), checkpoint.path))
+    else:
+        resumed_traces = {}
+
     if parallel_backend is None:
         parallel_backend = get_backend()
     else:
         parallel_backend = ParallelBackend(parallel_backend)
 
+    if sampler == 'Ensemble':
+        if monitor is not None or profiler is not None:
+            raise NotImplementedError('currently monitor and profiler are not '
+                                      'supported by the Ensemble sampler.')
+        if 0 in resumed_traces:
+            sample_trace = resumed_traces[0]
+        elif not sample_trace.chain_initialized:
+            sample_trace = deepcopy(sample_trace)
+            sample_trace._init_chain(0)
+        return _sample_ensemble(density, sample_trace, n_run,
+                                parallel_backend, verbose, checkpoint)
+
+    if sampler == 'SMC':
+        if (monitor is not None or checkpoint is not None or
+            pooled_warmup is not None or profiler is not None):
+            raise NotImplementedError('currently monitor, checkpoint, '
+                                      'pooled_warmup and profiler are not '
+                                      'supported by the SMC sampler.')
+        if not sample_trace.chain_initialized:
+            sample_trace = deepcopy(sample_trace)
+            sample_trace._init_chain(0)
+        return _sample_smc(density, sample_trace, n_run, parallel_backend,
+                           verbose)
+
     if parallel_backend.kind == 'multiprocess':
         use_dask = False
         dask_key = None
-        process_lock = Manager().Lock()
+        manager = Manager()
+        process_lock = manager.Lock()
+        if (monitor is not None or tempering is not None or
+            profiler is not None):
+            message_queue = manager.Queue()
+        if monitor is not None:
+            monitor._activate(sample_trace.n_chain, queue=message_queue,
+                              event=manager.Event())
+        if tempering is not None:
+            tempering._activate(
+                n_ladder, spawn_generator(sample_trace.random_generator,
+                n_total + 1, jump_current=False)[-1], queue=message_queue,
+                reply_queues=[manager.Queue() for _ in range(n_total)])
+        if pooled_warmup is not None:
+            pooled_warmup._activate(shared=manager.dict())
+        if profiler is not None:
+            profiler._activate(queue=message_queue)
     elif parallel_backend.kind == 'ray':
         use_dask = False
         dask_key = None
@@ -101,6 +248,16 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
         process_lock = None
         sub = Sub(dask_key)
         finished = 0
+        if monitor is not None:
+            monitor._activate(sample_trace.n_chain, dask_key=dask_key)
+        if tempering is not None:
+            tempering._activate(
+                n_ladder, spawn_generator(sample_trace.random_generator,
+                n_total + 1, jump_current=False)[-1], dask_key=dask_key)
+        if pooled_warmup is not None:
+            pooled_warmup._activate(dask_key=dask_key)
+        if profiler is not None:
+            profiler._activate(dask_key=dask_key)
     elif parallel_backend.kind == 'sharedmem':
         use_dask = False
         dask_key = None
@@ -109,36 +266,101 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
         use_dask = False
         dask_key = None
         process_lock = None
-    # elif parallel_backend.kind == 'serial':
-    #     use_dask = False
-    #     dask_key = None
-    #     process_lock = None
+    elif (parallel_backend.kind == 'thread' or
+          parallel_backend.kind == 'asyncio'):
+        use_dask = False
+        dask_key = None
+        process_lock = threading.Lock()
+    elif parallel_backend.kind == 'serial':
+        use_dask = False
+        dask_key = None
+        process_lock = None
     else:
         raise RuntimeError('unexpected value for parallel_backend.kind.')
+    in_process = parallel_backend.kind in ('serial', 'thread', 'asyncio')
+    if profiler is not None and not (parallel_backend.kind == 'multiprocess' or
+                                     parallel_backend.kind == 'dask'):
+        # the records will be collected from the traces after sampling
+        profiler._activate()
+    if monitor is not None and not (parallel_backend.kind == 'multiprocess' or
+                                    parallel_backend.kind == 'dask'):
+        raise NotImplementedError('currently monitor only supports the '
+                                  'multiprocess and dask backends.')
+    if tempering is not None and not (parallel_backend.kind == 'multiprocess'
+                                      or parallel_backend.kind == 'dask'):
+        raise NotImplementedError('currently tempering only supports the '
+                                  'multiprocess and dask backends.')
+    if pooled_warmup is not None and not (
+        parallel_backend.kind == 'multiprocess' or
+        parallel_backend.kind == 'dask'):
+        raise NotImplementedError('currently pooled_warmup only supports the '
+                                  'multiprocess and dask backends.')
+
+    def _monitor_message(msg):
+        stop = monitor._collect(*msg[1:])
+        if stop and verbose:
+            r = monitor.records[-1]
+            print(' ConvergenceMonitor: stopping all the chains after {} '
+                  'iterations, with max rhat = {:.4f}, min ess_bulk = {:.1f} '
+                  'and min ess_tail = {:.1f}.'.format(r.i_iter, r.rhat,
+                  r.ess_bulk, r.ess_tail))
+
+    def _check_workers():
+        # all the chains in a ladder should run at the same time
+        if parallel_backend.kind == 'multiprocess':
+            n_worker = parallel_backend.backend_activated._processes
+        else:
+            n_worker = sum(parallel_backend.backend.nthreads().values())
+        if n_worker < sample_trace.n_chain:
+            raise RuntimeError(
+                'replica exchange needs {} workers to run all the chains at '
+                'the same time, but there are only {} workers.'.format(
+                sample_trace.n_chain, n_worker))
 
     def nested_helper(sample_trace, i):
         """Without this, there will be an UnboundLocalError."""
-        if isinstance(sample_trace, SampleTrace):
+        if i in resumed_traces:
+            sample_trace = resumed_traces[i]
+        elif isinstance(sample_trace, SampleTrace):
+            if in_process:
+                sample_trace = deepcopy(sample_trace)
             sample_trace._init_chain(i)
+            return sample_trace
         elif isinstance(sample_trace, TraceTuple):
             sample_trace = sample_trace.sample_traces[i]
         else:
             raise RuntimeError('unexpected type for sample_trace.')
-        return sample_trace
+        # the other backends work on the copies sent to the workers
+        return deepcopy(sample_trace) if in_process else sample_trace
 
     def _sampler_worker(i, sampler_class):
         try:
+            # the linear algebra of each iteration is too small to benefit from
+            # more threads, so n_thread of the backend is not used here
             with threadpool_limits(1):
                 _sample_trace = nested_helper(sample_trace, i)
-                def logp_and_grad(x):
-                    return density.logp_and_grad(x, original_space=False)
+                beta = 1. if tempering is None else tempering._beta(i)
+                if delayed_acceptance is not None:
+                    def logp_and_grad(x):
+                        return density.logp_and_grad(
+                            x, original_space=False, use_surrogate=True)
+                elif beta == 1.:
+                    def logp_and_grad(x):
+                        return density.logp_and_grad(x, original_space=False)
+                else:
+                    def logp_and_grad(x):
+                        logp, grad = density.logp_and_grad(
+                            x, original_space=False)
+                        return beta * logp, beta * grad
                 _sampler = sampler_class(
                     logp_and_grad=logp_and_grad, sample_trace=_sample_trace,
-                    dask_key=dask_key, process_lock=process_lock)
+                    dask_key=dask_key, process_lock=process_lock,
+                    monitor=monitor, checkpoint=checkpoint,
+                    tempering=tempering, pooled_warmup=pooled_warmup,
+                    delayed_acceptance=delayed_acceptance, profiler=profiler)
                 t = _sampler.run(n_run, verbose)
-                t._samples_original = density.to_original(t.samples)
-                t._logp_original = density.to_original_density(
-                    t.logp, x_trans=t.samples)
+                if beta == 1.:
+                    t._set_original(density)
             return t
         except Exception:
             if use_dask:
@@ -148,6 +370,8 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
 
     with parallel_backend:
         if any(sampler == _ for _ in ('NUTS', 'HMC', 'TNUTS', 'THMC')):
+            if tempering is not None:
+                _check_workers()
             if use_dask:
                 foo = parallel_backend.map_async(
                     _sampler_worker, range(sample_trace.n_chain),
@@ -165,20 +389,115 @@ def sample(density, sample_trace=None, sampler='NUTS', n_run=None,
                     elif msg[0] == 'SamplingFinished':
                         print(msg[1])
                         finished += 1
+                    elif msg[0] == 'SamplingDraws' and monitor is not None:
+                        _monitor_message(msg)
+                    elif (msg[0] == 'ReplicaExchange' and
+                          tempering is not None):
+                        tempering._collect(*msg[1:])
+                    elif msg[0] == 'SamplerEvents' and profiler is not None:
+                        profiler._collect(*msg[1:])
                     else:
                         warnings.warn('unexpected message: {}.'.format(msg),
                                       RuntimeWarning)
                     if finished == sample_trace.n_chain:
                         break
+                if tempering is not None and finished < sample_trace.n_chain:
+                    tempering._abort()
+                tt = parallel_backend.gather(foo)
+            elif (monitor is not None or tempering is not None or
+                  (profiler is not None and
+                   parallel_backend.kind == 'multiprocess')):
+                foo = parallel_backend.map_async(
+                    _sampler_worker, range(sample_trace.n_chain),
+                    [eval(sampler)] * sample_trace.n_chain)
+                while True:
+                    try:
+                        msg = message_queue.get(timeout=0.05)
+                        if msg[0] == 'ReplicaExchange':
+                            tempering._collect(*msg[1:])
+                        elif msg[0] == 'SamplerEvents':
+                            profiler._collect(*msg[1:])
+                        elif msg[0] == 'SamplingDraws':
+                            _monitor_message(msg)
+                        else:
+                            warnings.warn('unexpected message: {}.'.format(
+                                msg), RuntimeWarning)
+                    except Empty:
+                        if foo.ready():
+                            # drain the messages sent right before finishing
+                            if message_queue.empty():
+                                break
+                if tempering is not None and not foo.successful():
+                    tempering._abort()
                 tt = parallel_backend.gather(foo)
             else:
                 tt = parallel_backend.map(
                     _sampler_worker, range(sample_trace.n_chain),
                     [eval(sampler)] * sample_trace.n_chain)
+            if monitor is not None:
+                monitor._deactivate()
+                n_min = min(t.i_iter for t in tt)
+                for t in tt:
+                    if t.i_iter > n_min:
+                        t._truncate(n_min)
+            if pooled_warmup is not None:
+                pooled_warmup._deactivate()
+            if profiler is not None:
+                profiler._deactivate(tt)
+            if delayed_acceptance is not None:
+                delayed_acceptance._deactivate(tt)
+                if verbose:
+                    da = delayed_acceptance
+                    print(' DelayedAcceptance: {} true evaluations for {} '
+                          'iterations, {} screened out by the surrogate, '
+                          'acceptance rate {:.3f}, {} true evaluations saved '
+                          'compared with {} surrogate evaluations.'.format(
+                          da.n_true, da.n_iter, da.n_screened,
+                          da.acceptance_rate, da.n_saved, da.n_surrogate))
+            if tempering is not None:
+                tempering._deactivate()
+                tt = tt[:n_ladder]
+                for t in tt:
+                    t._n_chain = n_ladder
             return TraceTuple(tt)
 
-        elif sampler == 'Ensemble':
-            raise NotImplementedError
-
         else:
             raise RuntimeError('unexpected value for sampler.')
+
+
+def _sample_ensemble(density, sample_trace, n_run, parallel_backend, verbose,
+                     checkpoint):
+    """Run the ensemble in this process, and only parallelize logp."""
+    def logp(x):
+        return density.logp(x, original_space=False)
+
+    if sample_trace.use_map:
+        def batch_logp(x):
+            return parallel_backend.map(logp_b, x, chunksize='auto',
+                                        shared_memory='auto', out_shape=())
+        with parallel_backend:
+            logp_b = parallel_backend.broadcast(logp)
+            sampler = EnsembleSampler(batch_logp, sample_trace, checkpoint)
+            t = sampler.run(n_run, verbose)
+    else:
+        sampler = EnsembleSampler(logp, sample_trace, checkpoint)
+        t = sampler.run(n_run, verbose)
+    t._set_original(density)
+    return t
+
+
+def _sample_smc(density, sample_trace, n_run, parallel_backend, verbose):
+    """Run SMC in this process, and evaluate each generation with one map."""
+    def logp(x):
+        return density.logp(x, original_space=False)
+
+    def batch_logp(x):
+        return parallel_backend.map(logp_b, x, chunksize='auto',
+                                    shared_memory='auto', out_shape=())
+
+    with parallel_backend:
+        logp_b = parallel_backend.broadcast(logp)
+        t = SMC(batch_logp, sample_trace).run(n_run, verbose)
+    if t.finished:
+        t._set_original(density)
+    return t
@@ -4,7 +4,7 @@ from .importance import importance
 from .harmonic import harmonic
 from ..utils.parallel import ParallelBackend, get_backend
 from ..transforms import SIT
-from ..samplers import TraceTuple
+from ..samplers import TraceTuple, ETrace, STrace
 from threadpoolctl import threadpool_limits
 import warnings
 
@@ -118,7 +118,7 @@ class _GBaseQ(_GBase):
     def run(self, x_p, logp, logp_p=None):
         if not callable(logp):
             raise ValueError('logp should be callable.')
-        if isinstance(x_p, TraceTuple):
+        if isinstance(x_p, (TraceTuple, ETrace, STrace)):
             pass
         else:
             try:
@@ -129,12 +129,12 @@ class _GBaseQ(_GBase):
 
         if self.n_q is not None:
             n_q = self.n_q
-            if isinstance(x_p, TraceTuple):
+            if isinstance(x_p, (TraceTuple, ETrace, STrace)):
                 x_p = x_p.get(flatten=False)
         else:
             f_call = self.f_call
             if f_call is not None:
-                if isinstance(x_p, TraceTuple):
+                if isinstance(x_p, (TraceTuple, ETrace, STrace)):
                     n_p = x_p.n_call
                     n_q = int(n_p * f_call)
                     x_p = x_p.get(flatten=False)
@@ -146,7 +146,7 @@ class _GBaseQ(_GBase):
                 else:
                     raise RuntimeError('unexpected value for x_p.')
             if f_call is None:
-                if isinstance(x_p, TraceTuple):
+                if isinstance(x_p, (TraceTuple, ETrace, STrace)):
                     x_p = x_p.get(flatten=False)
                 if isinstance(x_p, np.ndarray):
                     n_q = np.prod(x_p.shape[:-1])
@@ -172,7 +172,9 @@ class _GBaseQ(_GBase):
         with self.parallel_backend:
             x_shape = x.shape
             x = x.reshape((-1, x_shape[-1]))
-            map_result = self.parallel_backend.map(logp, x)
+            map_result = self.parallel_backend.map(
+                self.parallel_backend.broadcast(logp), x, chunksize='auto',
+                shared_memory='auto', out_shape=())
         return np.asarray(map_result).reshape(x_shape[:-1])
 
 
@@ -238,7 +240,7 @@ class GHM(_GBase):
     __doc__ = a.format('Harmonic Mean')
 
     def run(self, x_p, logp=None, logp_p=None):
-        if isinstance(x_p, TraceTuple):
+        if isinstance(x_p, (TraceTuple, ETrace, STrace)):
             x_p = x_p.get(flatten=False)
         else:
             try:
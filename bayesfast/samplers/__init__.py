@@ -3,4 +3,11 @@ from .nuts import NUTS
 from .thmc import THMC
 from .tnuts import TNUTS
 from .ensemble import EnsembleSampler
+from .smc import SMC
 from .sample_trace import *
+from .monitor import ConvergenceMonitor
+from .checkpoint import Checkpoint
+from .tempering import ReplicaExchange
+from .pooling import PooledWarmup
+from .delayed import DelayedAcceptance
+from .profiler import SamplerProfiler
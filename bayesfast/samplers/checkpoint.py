@@ -0,0 +1,171 @@
+import os
+import uuid
+import dill
+import numpy as np
+from ..utils.collections import ArrayBuffer
+
+__all__ = ['Checkpoint']
+
+
+class Checkpoint:
+    """
+    Periodically saving the state of each chain to disk during sampling.
+
+    Parameters
+    ----------
+    path : str
+        The directory to store the checkpoint files. Will be created if it
+        does not exist.
+    save_every : positive int, optional
+        Each chain saves its full state every `save_every` iterations, and
+        when it finishes. Set to `100` by default.
+    resume : bool, optional
+        Whether to resume from the existing checkpoint files in `path`. Set to
+        `True` by default.
+
+    Notes
+    -----
+    The state of a chain, including the samples, the stats, the step size
+    adaptation, the metric adaptation and the state of the random generator,
+    is pickled as `chain-{i}.pkl`. The in-memory buffers of the samples and
+    the stats are stored separately as raw `chain-{i}-*.dat` files, and only
+    the new iterations are appended to them at each save, assuming that the
+    iterations do not change once added. With `MemmapStorage`, the buffers are
+    already on disk, and only their metadata is pickled. When resuming, the
+    chains continue from the saved states, so that the results are identical
+    to those without interruption, as long as `n_run` is `None`. The chains
+    without checkpoint files will start from the beginning.
+    """
+    def __init__(self, path, save_every=100, resume=True):
+        try:
+            path = os.fspath(path)
+            os.makedirs(path, exist_ok=True)
+        except Exception:
+            raise ValueError('invalid value for path.')
+        self._path = path
+        self.save_every = save_every
+        self.resume = resume
+        self._written = {}
+
+    def __getstate__(self):
+        """The written buffers are only meaningful in the chain's process."""
+        self_dict = self.__dict__.copy()
+        self_dict['_written'] = {}
+        return self_dict
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def save_every(self):
+        return self._save_every
+
+    @save_every.setter
+    def save_every(self, se):
+        try:
+            se = int(se)
+            assert se > 0
+        except Exception:
+            raise ValueError('save_every should be a positive int.')
+        self._save_every = se
+
+    @property
+    def resume(self):
+        return self._resume
+
+    @resume.setter
+    def resume(self, r):
+        self._resume = bool(r)
+
+    def _filename(self, chain_id):
+        return os.path.join(self._path, 'chain-{}.pkl'.format(chain_id))
+
+    def _save(self, sample_trace):
+        """Pickle the trace to a temporary file first, so that it's atomic."""
+        chain_id = sample_trace.chain_id
+        filename = self._filename(chain_id)
+        with open(filename + '.tmp', 'wb') as f:
+            pickler = _Pickler(f, self, chain_id)
+            pickler.dump(sample_trace)
+        os.replace(filename + '.tmp', filename)
+        prefix = 'chain-{}-'.format(chain_id)
+        for name in os.listdir(self._path):
+            if (name.startswith(prefix) and name.endswith('.dat') and
+                name not in pickler.names):
+                os.remove(os.path.join(self._path, name))
+
+    def _write_buffer(self, buffer, chain_id):
+        """
+        Append the new elements of the buffer to its file, and return the
+        information needed to read it back.
+        """
+        written = self._written.setdefault(chain_id, {})
+        if id(buffer) not in written or written[id(buffer)][2] > buffer._n:
+            # a new file is used after truncation, so that the last
+            # checkpoint remains valid until it is replaced
+            written[id(buffer)] = [buffer, 'chain-{}-{}.dat'.format(
+                chain_id, uuid.uuid4().hex), 0]
+        _, name, n_written = written[id(buffer)]
+        with open(os.path.join(self._path, name),
+                  'r+b' if n_written else 'wb') as f:
+            data = buffer._data
+            f.seek(n_written * data[:1].nbytes)
+            f.write(np.ascontiguousarray(data[n_written:buffer._n]).tobytes())
+            f.truncate()
+        written[id(buffer)][2] = buffer._n
+        state = buffer.__dict__.copy()
+        state['_data'] = (data.dtype.str, data.shape[1:])
+        return name, state
+
+    def _read_buffer(self, pid):
+        name, state = pid
+        dtype, shape = state['_data']
+        n = state['_n']
+        data = np.fromfile(os.path.join(self._path, name), dtype=dtype,
+                           count=n * int(np.prod(shape)))
+        buffer = ArrayBuffer.__new__(ArrayBuffer)
+        buffer.__dict__.update(state)
+        buffer._data = data.reshape((n,) + tuple(shape))
+        return buffer
+
+    def _load(self, n_chain):
+        """Return a dict of the saved traces, with chain_id as the keys."""
+        sample_traces = {}
+        if self.resume:
+            for i in range(n_chain):
+                if os.path.isfile(self._filename(i)):
+                    with open(self._filename(i), 'rb') as f:
+                        sample_traces[i] = _Unpickler(f, self).load()
+        return sample_traces
+
+
+class _Pickler(dill.Pickler):
+    """Storing the in-memory ArrayBuffers outside the pickle."""
+    def __init__(self, file, checkpoint, chain_id):
+        super().__init__(file)
+        self.checkpoint = checkpoint
+        self.chain_id = chain_id
+        self.names = set()
+
+    def persistent_id(self, obj):
+        # the subclasses like MemmapBuffer have their own pickling
+        if type(obj) is ArrayBuffer and obj._data is not None:
+            pid = self.checkpoint._write_buffer(obj, self.chain_id)
+            self.names.add(pid[0])
+            return pid
+        return None
+
+
+class _Unpickler(dill.Unpickler):
+    def __init__(self, file, checkpoint):
+        super().__init__(file)
+        self.checkpoint = checkpoint
+
+        self.buffers = {}
+
+    def persistent_load(self, pid):
+        # the persistent ids bypass the memo of the unpickler
+        if pid[0] not in self.buffers:
+            self.buffers[pid[0]] = self.checkpoint._read_buffer(pid)
+        return self.buffers[pid[0]]
@@ -0,0 +1,170 @@
+import numpy as np
+
+__all__ = ['DelayedAcceptance']
+
+# References: Christen & Fox 2005, https://doi.org/10.1198/106186005X76983
+#             Liu 2001, Monte Carlo Strategies in Scientific Computing, 5.6
+
+
+class DelayedAcceptance:
+    """
+    Delayed-acceptance MCMC with the surrogate as the first stage.
+
+    Parameters
+    ----------
+    n_sub : positive int, optional
+        The number of HMC/NUTS transitions on the surrogate density for each
+        proposal. Set to `1` by default.
+
+    Notes
+    -----
+    In each iteration, the chain first runs `n_sub` HMC/NUTS transitions on
+    the surrogate density `q`, using the cheap surrogate gradients. Since these
+    transitions leave `q` invariant, the end point `y` can be used as a
+    proposal for the true density `p`, which is accepted with probability
+    `min(1, p(y) q(x) / (p(x) q(y)))`. Only the true logp is needed, without
+    the gradient, and nothing is evaluated if the surrogate rejects the move.
+    The recorded logp are those of the true density. If `n_sub > 1`, the step
+    size is adapted after each transition, while the other recorded stats,
+    e.g. the tree depth and the acceptance statistic, are those of the last
+    one. The numbers of true evaluations are summarized in `n_true`, `n_saved`
+    etc. after sampling, where `n_true` includes the evaluation at the starting
+    point of each chain. Currently, only `NUTS` and `HMC` are supported.
+    """
+    def __init__(self, n_sub=1):
+        self.n_sub = n_sub
+        self._logp = None
+        self._reset()
+
+    def _reset(self):
+        self._counts = np.zeros(5, dtype=np.int)
+        self._n_start = 0
+
+    @property
+    def n_sub(self):
+        return self._n_sub
+
+    @n_sub.setter
+    def n_sub(self, ns):
+        try:
+            ns = int(ns)
+            assert ns > 0
+        except Exception:
+            raise ValueError('n_sub should be a positive int.')
+        self._n_sub = ns
+
+    # the counts below are summed over all the chains
+
+    @property
+    def n_iter(self):
+        """The total number of iterations."""
+        return int(self._counts[0])
+
+    @property
+    def n_true(self):
+        """The number of true logp evaluations, including the initial ones."""
+        return int(self._counts[1])
+
+    @property
+    def n_screened(self):
+        """The number of proposals rejected by the surrogate."""
+        return int(self._counts[2])
+
+    @property
+    def n_accepted(self):
+        """The number of proposals accepted by the true density."""
+        return int(self._counts[3])
+
+    @property
+    def n_surrogate(self):
+        """The number of surrogate logp_and_grad evaluations."""
+        return int(self._counts[4])
+
+    @property
+    def n_saved(self):
+        """
+        The number of true evaluations saved, compared with running the same
+        trajectories on the true density.
+        """
+        return self.n_surrogate - self.n_true
+
+    @property
+    def acceptance_rate(self):
+        """The acceptance rate of the second stage."""
+        return self.n_accepted / max(self.n_true - self._n_start, 1)
+
+    # the methods below are used by the parent process
+
+    def _activate(self, logp):
+        self._reset()
+        self._logp = logp
+
+    def _deactivate(self, sample_traces):
+        self._logp = None
+        for t in sample_traces:
+            self._counts += t._da_counts
+            self._n_start += int(t._da_start)
+
+    # the methods below are used by the chains
+
+    def _astep(self, sampler):
+        """
+        Perform a single iteration of delayed acceptance. Only the stats of the
+        last of the `n_sub` transitions are recorded.
+        """
+        t = sampler.sample_trace
+        if not hasattr(t, '_da_counts'):
+            t._da_counts = np.zeros(5, dtype=np.int)
+            t._da_start = False
+        counts = t._da_counts
+        if t.i_iter > 0:
+            q_0 = t._samples[-1]
+            logp_0 = t.stats._logp[-1]
+        else:
+            q_0 = t.x_0
+            assert q_0.ndim == 1
+            logp_0 = self._logp(q_0)
+            counts[1] += 1
+            t._da_start = True
+
+        q = q_0
+        logq_0 = None
+        for _ in range(self.n_sub):
+            p = t.metric.random(t._rng)
+            start = sampler.integrator.compute_state(q, p)
+            if not np.isfinite(start.energy):
+                t.metric.raise_ok()
+                raise RuntimeError(
+                    "Bad initial energy, please check the Hamiltonian at p = "
+                    "{}, q = {}.".format(p, q))
+            if logq_0 is None:
+                logq_0 = start.logp
+            step_size = t.step_size.current(sampler.warmup)
+            hmc_step = sampler._hamiltonian_step(start, p, step_size)
+            t.step_size.update(hmc_step.accept_stat, sampler.warmup)
+            q = hmc_step.end.q
+            stats = dict(hmc_step.stats)
+            counts[4] += stats.get('tree_size',
+                                   stats.get('n_int_step', 0)) + 1
+
+        counts[0] += 1
+        if np.array_equal(q, q_0):
+            counts[2] += 1
+            q_new, logp_new = q_0, logp_0
+        else:
+            logp = self._logp(q)
+            counts[1] += 1
+            log_alpha = (logp - logp_0) - (hmc_step.end.logp - logq_0)
+            if (np.isfinite(log_alpha) and
+                np.log(t._rng.uniform()) < log_alpha):
+                counts[3] += 1
+                q_new, logp_new = q, logp
+            else:
+                q_new, logp_new = q_0, logp_0
+
+        t.metric.update(q_new, sampler.warmup)
+        stats['logp'] = logp_new
+        step_stats = sampler._expected_stats(
+            **stats, **t.step_size.sizes(), warmup=sampler.warmup,
+            diverging=bool(hmc_step.divergence_info))
+        t.update(q_new, step_stats)
@@ -1,15 +1,152 @@
 import numpy as np
-HAS_EMCEE = True
-try:
-    import emcee
-except Exception:
-    HAS_EMCEE = False
+from .sample_trace import ETrace
+import warnings
+import time
 
 __all__ = ['EnsembleSampler']
 
-# TODO: implement the wrapper of emcee sampler
+# References: Goodman & Weare 2010, https://doi.org/10.2140/camcos.2010.5.65
+#             ter Braak 2006, https://doi.org/10.1007/s11222-006-8769-1
+#             https://github.com/dfm/emcee
 
 
 class EnsembleSampler:
-    def __init__(*args, **kwargs):
-        raise NotImplementedError
+    """
+    Affine-invariant ensemble sampler with stretch and differential evolution
+    moves.
+
+    Parameters
+    ----------
+    logp : callable
+        Callable returning the logp of an array of points with shape
+        `(m, input_size)`, as a 1-d array with shape `(m,)`. All the proposals
+        of each half-ensemble are evaluated with a single call.
+    sample_trace : ETrace
+        The trace to store the walkers.
+    checkpoint : None or Checkpoint, optional
+        If not `None`, the trace will be saved periodically. Set to `None` by
+        default.
+
+    Notes
+    -----
+    In each iteration, the ensemble is split into two halves, and the walkers
+    in one half are updated in parallel using the walkers in the other half.
+    No gradient is needed.
+    """
+    def __init__(self, logp, sample_trace, checkpoint=None):
+        if not callable(logp):
+            raise ValueError('logp should be callable.')
+        self._logp = logp
+        if isinstance(sample_trace, ETrace):
+            self._sample_trace = sample_trace
+        else:
+            raise ValueError('invalid type for sample_trace.')
+        if not (checkpoint is None or hasattr(checkpoint, '_save')):
+            raise ValueError('invalid value for checkpoint.')
+        self._checkpoint = checkpoint
+        self._prefix = ' ENSEMBLE : '
+
+    @property
+    def sample_trace(self):
+        return self._sample_trace
+
+    def _batch_logp(self, x):
+        logp = np.asarray(self._logp(x), dtype=np.float).reshape(-1)
+        if logp.shape != (x.shape[0],):
+            raise RuntimeError('logp should return an array with shape '
+                               '({},).'.format(x.shape[0]))
+        return np.where(np.isfinite(logp), logp, -np.inf)
+
+    def _propose_stretch(self, x_s, x_c):
+        rg = self.sample_trace.random_generator
+        n_s, dim = x_s.shape
+        a = self.sample_trace.a
+        z = ((a - 1.) * rg.random(n_s) + 1.)**2 / a
+        x_j = x_c[rg.integers(0, x_c.shape[0], n_s)]
+        return x_j + z[:, np.newaxis] * (x_s - x_j), (dim - 1.) * np.log(z)
+
+    def _propose_de(self, x_s, x_c):
+        rg = self.sample_trace.random_generator
+        n_s, dim = x_s.shape
+        n_c = x_c.shape[0]
+        gamma = self.sample_trace.gamma
+        if gamma is None:
+            gamma = 2.38 / (2. * dim)**0.5
+        j_1 = rg.integers(0, n_c, n_s)
+        j_2 = (j_1 + rg.integers(1, n_c, n_s)) % n_c
+        g = gamma * (1. + 1e-5 * rg.normal(size=(n_s, 1)))
+        return x_s + g * (x_c[j_1] - x_c[j_2]), np.zeros(n_s)
+
+    def astep(self, x, logp):
+        """Perform a single iteration, updating the two halves in turn."""
+        rg = self.sample_trace.random_generator
+        moves = self.sample_trace.moves
+        move = rg.choice(list(moves.keys()), p=list(moves.values()))
+        propose = self._propose_stretch if move == 'stretch' else (
+            self._propose_de)
+        n = x.shape[0]
+        accepted = np.zeros(n, dtype=np.bool_)
+        halves = (np.arange(n // 2), np.arange(n // 2, n))
+        for s, c in (halves, halves[::-1]):
+            y, log_ratio = propose(x[s], x[c])
+            logp_y = self._batch_logp(y)
+            log_ratio += logp_y - logp[s]
+            acc = np.log(rg.random(s.shape[0])) < log_ratio
+            x[s[acc]] = y[acc]
+            logp[s[acc]] = logp_y[acc]
+            accepted[s] = acc
+        return accepted
+
+    def run(self, n_run=None, verbose=True, n_update=None):
+        t = self._sample_trace
+        i_iter = t.i_iter
+        n_iter = t.n_iter
+        if n_run is None:
+            n_run = n_iter - i_iter
+        else:
+            try:
+                n_run = int(n_run)
+                assert n_run > 0
+            except Exception:
+                raise ValueError(self._prefix + 'invalid value for n_run.')
+            if n_run > n_iter - i_iter:
+                t.n_iter = i_iter + n_run
+                n_iter = t.n_iter
+        if i_iter > 0:
+            x = t.samples[-1].copy()
+            logp = t.logp[-1].copy()
+        else:
+            x = t.x_0.copy()
+            logp = self._batch_logp(x)
+            if not np.any(np.isfinite(logp)):
+                raise ValueError('failed to get finite logp at x_0.')
+        if x.shape[0] < 2 * x.shape[1]:
+            warnings.warn('the number of walkers is smaller than twice the '
+                          'number of dimensions, so the ensemble may not '
+                          'explore the full space.', RuntimeWarning)
+        if verbose:
+            if n_update is None:
+                n_update = max(n_run // 5, 1)
+            t_s = time.time()
+            t_i = time.time()
+        for i in range(i_iter, i_iter + n_run):
+            if verbose and i > i_iter and not i % n_update:
+                t_d = time.time() - t_i
+                t_i = time.time()
+                f_acc = np.mean(t.accepted[-n_update:])
+                print(self._prefix + 'sampling proceeding [ {} / {} ], last {} '
+                      'iterations used {:.2f} seconds, with acceptance fraction'
+                      ' {:.3f}{}.'.format(i, n_iter, n_update, t_d, f_acc,
+                      ' (warmup)' if i < t.n_warmup else ''))
+            accepted = self.astep(x, logp)
+            t.update(x, logp, accepted)
+            if self._checkpoint is not None:
+                if not (i + 1) % self._checkpoint.save_every:
+                    self._checkpoint._save(t)
+        if self._checkpoint is not None:
+            self._checkpoint._save(t)
+        if verbose:
+            print(self._prefix + 'sampling finished [ {} / {} ], obtained {} '
+                  'iterations of {} walkers in {:.2f} seconds.'.format(
+                  n_iter, n_iter, n_run, t.n_chain, time.time() - t_s))
+        return t
@@ -38,7 +38,7 @@ class HMC(BaseHMC):
         accept_stat = min(1, np.exp(energy_change))
 
         if (divergence_info is not None or
-            self.sample_trace.random_generator.uniform() >= accept_stat):
+            self.sample_trace._rng.uniform() >= accept_stat):
             end = start
             accepted = False
         else:
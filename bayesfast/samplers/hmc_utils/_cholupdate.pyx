@@ -0,0 +1,25 @@
+cimport cython
+from libc.math cimport sqrt
+
+__all__ = ['_chol_update']
+
+
+@cython.wraparound(False)
+@cython.boundscheck(False)
+@cython.cdivision(True)
+def _chol_update(double[:, :] l, double[::1] x):
+    """
+    In-place rank-1 update of the lower Cholesky factor, such that l @ l.T
+    becomes l @ l.T + x @ x.T. x will be overwritten.
+    """
+    cdef size_t n = l.shape[0]
+    cdef size_t i, k
+    cdef double r, c, s
+    for k in range(n):
+        r = sqrt(l[k, k] * l[k, k] + x[k] * x[k])
+        c = r / l[k, k]
+        s = x[k] / l[k, k]
+        l[k, k] = r
+        for i in range(k + 1, n):
+            l[i, k] = (l[i, k] + s * x[i]) / c
+            x[i] = c * x[i] - s * l[i, k]
@@ -27,10 +27,18 @@ DivergenceInfo = namedtuple("DivergenceInfo", "message, exec_info, state")
 class BaseHMC:
     """Base class to implement Hamiltonian Monte Carlo."""
     def __init__(self, logp_and_grad, sample_trace, dask_key=None,
-                 process_lock=None):
+                 process_lock=None, monitor=None, checkpoint=None,
+                 tempering=None, pooled_warmup=None,
+                 delayed_acceptance=None, profiler=None):
         self._logp_and_grad = logp_and_grad
         self.dask_key = dask_key
         self.process_lock = process_lock
+        self.monitor = monitor
+        self.checkpoint = checkpoint
+        self.tempering = tempering
+        self.pooled_warmup = pooled_warmup
+        self.delayed_acceptance = delayed_acceptance
+        self.profiler = profiler
         if isinstance(sample_trace, self._expected_trace):
             self._sample_trace = sample_trace
         else:
@@ -61,12 +69,14 @@ class BaseHMC:
 
     def astep(self):
         """Perform a single HMC iteration."""
+        if self.has_delayed_acceptance:
+            return self.delayed_acceptance._astep(self)
         try:
             q0 = self._sample_trace._samples[-1]
         except Exception:
             q0 = self._sample_trace.x_0
             assert q0.ndim == 1
-        p0 = self.sample_trace.metric.random(self.sample_trace.random_generator)
+        p0 = self.sample_trace.metric.random(self.sample_trace._rng)
         start = self.integrator.compute_state(q0, p0)
 
         if not np.isfinite(start.energy):
@@ -123,6 +133,7 @@ class BaseHMC:
                         n_update = n_run // 5
                 t_s = time.time()
                 t_i = time.time()
+            i_report = n_warmup
             for i in range(i_iter, i_iter + n_run):
                 if verbose:
                     if i > i_iter and not i % n_update:
@@ -153,7 +164,39 @@ class BaseHMC:
                             pub.put(
                                 ['SamplingProceeding', msg_0 + msg_1 + msg_2])
                 self.warmup = bool(i < n_warmup)
+                if self.has_profiler:
+                    t_0 = time.time()
+                    n_0 = getattr(self._sample_trace, '_n_speculative', 0)
                 self.astep()
+                if self.has_profiler:
+                    self.profiler._record(
+                        self._sample_trace, time.time() - t_0,
+                        getattr(self._sample_trace, '_n_speculative', 0) - n_0)
+                if self.has_pooled_warmup and self.warmup:
+                    if not (i + 1) % self.pooled_warmup.share_every:
+                        self.pooled_warmup._share(self._sample_trace)
+                if self.has_tempering:
+                    if not (i + 1) % self.tempering.swap_every:
+                        self.tempering._exchange(self._sample_trace)
+                if self.has_monitor:
+                    j = i + 1 - n_warmup
+                    if j > 0 and not j % self.monitor.check_every:
+                        if self.monitor._report(
+                            self._chain_id, n_warmup, i + 1,
+                            self._sample_trace._samples[i_report:],
+                            self._sample_trace.stats._logp[i_report:]):
+                            n_run = i + 1 - i_iter
+                            n_iter = i + 1
+                            self._sample_trace.n_iter = n_iter
+                            break
+                        i_report = i + 1
+                if self.has_checkpoint:
+                    if not (i + 1) % self.checkpoint.save_every:
+                        self.checkpoint._save(self._sample_trace)
+            if self.has_profiler:
+                self.profiler._send(self._sample_trace)
+            if self.has_checkpoint:
+                self.checkpoint._save(self._sample_trace)
             if verbose:
                 t_f = time.time()
                 msg = (self._prefix + 'sampling finished [ {} / {} ], '
@@ -169,8 +212,13 @@ class BaseHMC:
                     pub.put(['SamplingFinished', msg])
             return self._sample_trace
         finally:
+            self._close()
             warnings.showwarning = warnings._showwarning_orig
 
+    def _close(self):
+        """Release the resources held during `run`."""
+        pass
+
     @property
     def sample_trace(self):
         return self._sample_trace
@@ -212,6 +260,96 @@ class BaseHMC:
     def has_lock(self):
         return (self.process_lock is not None)
 
+    @property
+    def monitor(self):
+        return self._monitor
+
+    @monitor.setter
+    def monitor(self, m):
+        if m is None or hasattr(m, '_report'):
+            self._monitor = m
+        else:
+            raise ValueError('invalid value for monitor.')
+
+    @property
+    def has_monitor(self):
+        return (self.monitor is not None)
+
+    @property
+    def checkpoint(self):
+        return self._checkpoint
+
+    @checkpoint.setter
+    def checkpoint(self, c):
+        if c is None or hasattr(c, '_save'):
+            self._checkpoint = c
+        else:
+            raise ValueError('invalid value for checkpoint.')
+
+    @property
+    def has_checkpoint(self):
+        return (self.checkpoint is not None)
+
+    @property
+    def tempering(self):
+        return self._tempering
+
+    @tempering.setter
+    def tempering(self, t):
+        if t is None or hasattr(t, '_exchange'):
+            self._tempering = t
+        else:
+            raise ValueError('invalid value for tempering.')
+
+    @property
+    def has_tempering(self):
+        return (self.tempering is not None)
+
+    @property
+    def pooled_warmup(self):
+        return self._pooled_warmup
+
+    @pooled_warmup.setter
+    def pooled_warmup(self, pw):
+        if pw is None or hasattr(pw, '_share'):
+            self._pooled_warmup = pw
+        else:
+            raise ValueError('invalid value for pooled_warmup.')
+
+    @property
+    def has_pooled_warmup(self):
+        return (self.pooled_warmup is not None)
+
+    @property
+    def delayed_acceptance(self):
+        return self._delayed_acceptance
+
+    @delayed_acceptance.setter
+    def delayed_acceptance(self, da):
+        if da is None or hasattr(da, '_astep'):
+            self._delayed_acceptance = da
+        else:
+            raise ValueError('invalid value for delayed_acceptance.')
+
+    @property
+    def has_delayed_acceptance(self):
+        return (self.delayed_acceptance is not None)
+
+    @property
+    def profiler(self):
+        return self._profiler
+
+    @profiler.setter
+    def profiler(self, p):
+        if p is None or hasattr(p, '_record'):
+            self._profiler = p
+        else:
+            raise ValueError('invalid value for profiler.')
+
+    @property
+    def has_profiler(self):
+        return (self.profiler is not None)
+
     @property
     def chain_id(self):
         return self._chain_id
@@ -220,8 +358,15 @@ class BaseHMC:
 class BaseTHMC(BaseHMC):
     """Base class to implement Tempered HMC."""
     def __init__(self, logp_and_grad, sample_trace, dask_key=None,
-                 process_lock=None):
-        super().__init__(logp_and_grad, sample_trace, dask_key, process_lock)
+                 process_lock=None, monitor=None, checkpoint=None,
+                 tempering=None, pooled_warmup=None,
+                 delayed_acceptance=None, profiler=None):
+        if delayed_acceptance is not None:
+            raise NotImplementedError('delayed_acceptance is not supported by '
+                                      'the tempered samplers.')
+        super().__init__(logp_and_grad, sample_trace, dask_key, process_lock,
+                         monitor, checkpoint, tempering, pooled_warmup, None,
+                         profiler)
         self.integrator = TCpuLeapfrogIntegrator(
             self.sample_trace.metric, logp_and_grad, self._logp_and_grad_base)
 
@@ -239,10 +384,10 @@ class BaseTHMC(BaseHMC):
         except Exception:
             q0 = self.sample_trace.x_0
             assert q0.ndim == 1
-            u0 = np.random.normal(0,1)
+            u0 = self.sample_trace._rng.normal()
             Q0 = np.append(u0, q0)
-        p0 = self.sample_trace.metric.random(self.sample_trace.random_generator)
-        v0 = self.sample_trace.random_generator.normal(0, 1)
+        p0 = self.sample_trace.metric.random(self.sample_trace._rng)
+        v0 = self.sample_trace._rng.normal()
         P0 = np.append(v0, p0)
         start = self.integrator.compute_state(Q0, P0)
 
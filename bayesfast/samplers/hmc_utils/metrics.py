@@ -1,17 +1,22 @@
 import numpy as np
 import scipy.linalg
 import warnings
+from ._cholupdate import _chol_update
+from ...utils.random import RandomBuffer
 
 __all__ = ['QuadMetric', 'QuadMetricDiag', 'QuadMetricFull',
-           'QuadMetricDiagAdapt', 'QuadMetricFullAdapt']
+           'QuadMetricDiagAdapt', 'QuadMetricFullAdapt',
+           'QuadMetricLowRankAdapt']
 
 # TODO: finish docstring of QuadMetricDiag and QuadMetricFull
-# TODO: implement low-rank adaptive metric?
-#       https://github.com/pymc-devs/pymc3/pull/3596
 
 
 class QuadMetric:
     """Base class for implementing quadratic metrics."""
+
+    # increased whenever the metric may change, see RandomBuffer
+    _version = 0
+
     def velocity(self, x, out=None):
         raise NotImplementedError('Abstract method')
 
@@ -21,6 +26,10 @@ class QuadMetric:
     def random(self, x):
         raise NotImplementedError('Abstract method')
 
+    def _random_block(self, vals):
+        """Transform a block of standard normal draws into momenta."""
+        raise NotImplementedError('Abstract method')
+
     def velocity_energy(self, x, v_out):
         raise NotImplementedError('Abstract method')
 
@@ -82,9 +91,14 @@ class QuadMetricDiag(QuadMetric):
 
     def random(self, random_generator):
         """Draw a random value for the momentum."""
+        if isinstance(random_generator, RandomBuffer):
+            return random_generator.momentum(self)
         vals = random_generator.normal(size=self._n)
         return self._inv_std * vals
 
+    def _random_block(self, vals):
+        return self._inv_std * vals
+
     def velocity_energy(self, x, v_out):
         """Compute velocity and return kinetic energy at the given momentum."""
         self.velocity(x, out=v_out)
@@ -122,10 +136,16 @@ class QuadMetricFull(QuadMetric):
 
     def random(self, random_generator):
         """Draw a random value for the momentum."""
+        if isinstance(random_generator, RandomBuffer):
+            return random_generator.momentum(self)
         vals = random_generator.normal(size=self._n)
         return scipy.linalg.solve_triangular(self._chol.T, vals,
                                              overwrite_b=True)
 
+    def _random_block(self, vals):
+        # one triangular solve for the whole block
+        return scipy.linalg.solve_triangular(self._chol.T, vals.T).T
+
     def velocity_energy(self, x, v_out):
         """Compute velocity and return kinetic energy at the given momentum."""
         self.velocity(x, out=v_out)
@@ -148,7 +168,8 @@ class QuadMetricDiagAdapt(QuadMetricDiag):
     def __init__(self, n, initial_mean, initial_var=None, initial_weight=10.,
                  adapt_window=60, update_window=1, doubling=True):
         initial_mean = np.asarray(initial_mean)
-        initial_var = np.asarray(initial_var)
+        if initial_var is not None:
+            initial_var = np.asarray(initial_var)
         if initial_var is not None and initial_var.ndim != 1:
             raise ValueError('Initial variance must be one-dimensional.')
         if initial_mean.ndim != 1:
@@ -171,6 +192,8 @@ class QuadMetricDiagAdapt(QuadMetricDiag):
         self._foreground_var = _WeightedVariance(
             self._n, initial_mean, initial_var, initial_weight)
         self._background_var = _WeightedVariance(self._n)
+        # the foreground variances of the other chains, see PooledWarmup
+        self._pooled_var = None
         self._n_samples = 0
 
         self._doubling = doubling
@@ -179,14 +202,33 @@ class QuadMetricDiagAdapt(QuadMetricDiag):
         self._previous_update = 0
 
     def _update_from_weightvar(self, weightvar):
+        if self._pooled_var is not None:
+            weightvar = weightvar.merged(self._pooled_var)
         weightvar.current_variance(out=self._var)
         np.sqrt(self._var, out=self._std)
         np.divide(1., self._std, out=self._inv_std)
 
+    def _pooled_state(self):
+        """The foreground accumulator, to be shared with the other chains."""
+        fv = self._foreground_var
+        return (self._previous_update, fv.n_samples, fv.mean.copy(),
+                fv.raw_var.copy())
+
+    def _set_pooled(self, states):
+        """Pool the accumulators of the other chains in the same window."""
+        pooled = _WeightedVariance(self._n, initial_weight=0.)
+        for s in states:
+            if s[0] == self._previous_update:
+                pooled.merge(*s[1:])
+        self._pooled_var = pooled if pooled.n_samples > 0 else None
+        self._update_from_weightvar(self._foreground_var)
+        self._version += 1
+
     def update(self, sample, warmup):
         """Use a new sample during tuning to update."""
         if not warmup:
             return
+        self._version += 1
 
         # Steps since previous update
         delta = self._n_samples - self._previous_update
@@ -203,6 +245,7 @@ class QuadMetricDiagAdapt(QuadMetricDiag):
         if delta >= self._adapt_window:
             self._foreground_var = self._background_var
             self._background_var = _WeightedVariance(self._n)
+            self._pooled_var = None
 
             self._previous_update = self._n_samples
             if self._doubling:
@@ -250,6 +293,15 @@ class QuadMetricFullAdapt(QuadMetricFull):
     initial_cov: 2-d array_like or None, optional
         Initial guess of the sample covariance. Set to identity by default.
     
+    rank_one_update : bool, optional
+        If `True`, instead of recomputing the Cholesky factorization every
+        `update_window` steps, the Cholesky factor will be updated with each
+        new sample by a rank-1 update, which costs O(n^2) instead of O(n^3).
+        The full factorization is only computed at the boundaries of the
+        adaptation windows and when the covariances of the other chains are
+        pooled, and `update_window` will be ignored. Set to `False` by
+        default.
+
     Notes
     -----
     If the parameter `doubling` is `True`, the adaptation window is doubled
@@ -257,10 +309,12 @@ class QuadMetricFullAdapt(QuadMetricFull):
     matrix estimation.
     """
     def __init__(self, n, initial_mean, initial_cov=None, initial_weight=10.,
-                 adapt_window=60, update_window=1, doubling=True):
+                 adapt_window=60, update_window=1, doubling=True,
+                 rank_one_update=False):
         # warnings.warn("QuadPotentialFullAdapt is an experimental feature")
         initial_mean = np.asarray(initial_mean)
-        initial_cov = np.asarray(initial_cov)
+        if initial_cov is not None:
+            initial_cov = np.asarray(initial_cov)
         if initial_cov is not None and initial_cov.ndim != 2:
             raise ValueError("Initial covariance must be two-dimensional.")
         if initial_mean.ndim != 1:
@@ -283,41 +337,103 @@ class QuadMetricFullAdapt(QuadMetricFull):
         self._foreground_cov = _WeightedCovariance(
             self._n, initial_mean, initial_cov, initial_weight)
         self._background_cov = _WeightedCovariance(self._n)
+        # the foreground covariances of the other chains, see PooledWarmup
+        self._pooled_cov = None
+        # the foreground covariance merged with _pooled_cov
+        self._merged_cov = None
         self._n_samples = 0
 
         self._doubling = doubling
         self._adapt_window = int(adapt_window)
         self._update_window = int(update_window)
         self._previous_update = 0
+        self._rank_one_update = bool(rank_one_update)
+        # whether self._chol is the factor of the foreground covariance
+        self._chol_synced = True
 
     def _update_from_weightvar(self, weightvar):
+        if self._pooled_cov is not None:
+            weightvar = weightvar.merged(self._pooled_cov)
+            self._merged_cov = weightvar
+        else:
+            self._merged_cov = None
         weightvar.current_covariance(out=self._cov)
         try:
             self._chol = scipy.linalg.cholesky(self._cov, lower=True)
+            self._chol_synced = True
         except (scipy.linalg.LinAlgError, ValueError) as error:
             self._chol_error = error
+            self._chol_synced = False
+
+    def _pooled_state(self):
+        """The foreground accumulator, to be shared with the other chains."""
+        fc = self._foreground_cov
+        return (self._previous_update, fc.n_samples, fc.mean.copy(),
+                fc.raw_cov.copy())
+
+    def _set_pooled(self, states):
+        """Pool the accumulators of the other chains in the same window."""
+        pooled = _WeightedCovariance(self._n, initial_weight=0.)
+        for s in states:
+            if s[0] == self._previous_update:
+                pooled.merge(*s[1:])
+        self._pooled_cov = pooled if pooled.n_samples > 0 else None
+        self._update_from_weightvar(self._foreground_cov)
+        self._version += 1
+
+    def _update_rank_one(self, sample):
+        # cov_new = a * cov_old + b * u @ u.T, with u = sample - mean_old
+        # when pooled, adding the sample to the foreground covariance adds it
+        # to the merged one as well, which self._chol is the factor of
+        if self._merged_cov is None:
+            cov = self._foreground_cov
+        else:
+            cov = self._merged_cov
+            self._foreground_cov.add_sample(sample, weight=1)
+        n_old = cov.n_samples
+        u = np.asarray(sample, dtype=np.float) - cov.mean
+        cov.add_sample(sample, weight=1)
+        n_new = cov.n_samples
+        cov.current_covariance(out=self._cov)
+        self._chol *= (n_old / n_new)**0.5
+        _chol_update(self._chol, u * (n_new - 1.)**0.5 / n_new)
 
     def update(self, sample, warmup):
         """Use a new sample during tuning to update."""
         if not warmup:
             return
+        self._version += 1
 
         # Steps since previous update
         delta = self._n_samples - self._previous_update
 
-        self._foreground_cov.add_sample(sample, weight=1)
-        self._background_cov.add_sample(sample, weight=1)
+        if self._rank_one_update:
+            # Update the Cholesky factor with the new sample, unless the
+            # foreground covariance has just been replaced
+            if self._chol_synced:
+                self._update_rank_one(sample)
+            else:
+                self._foreground_cov.add_sample(sample, weight=1)
+                self._update_from_weightvar(self._foreground_cov)
+            self._background_cov.add_sample(sample, weight=1)
 
-        # Update the covariance matrix and recompute the Cholesky factorization
-        # every "update_window" steps
-        if (delta + 1) % self._update_window == 0:
-            self._update_from_weightvar(self._foreground_cov)
+        else:
+            self._foreground_cov.add_sample(sample, weight=1)
+            self._background_cov.add_sample(sample, weight=1)
+
+            # Update the covariance matrix and recompute the Cholesky
+            # factorization every "update_window" steps
+            if (delta + 1) % self._update_window == 0:
+                self._update_from_weightvar(self._foreground_cov)
 
         # Reset the background covariance
         # if we are at the end of the adaptation window
         if delta >= self._adapt_window:
             self._foreground_cov = self._background_cov
             self._background_cov = _WeightedCovariance(self._n)
+            self._pooled_cov = None
+            self._merged_cov = None
+            self._chol_synced = False
 
             self._previous_update = self._n_samples
             if self._doubling:
@@ -325,11 +441,185 @@ class QuadMetricFullAdapt(QuadMetricFull):
 
         self._n_samples += 1
 
-    def raise_ok(self, vmap):
+    def raise_ok(self, vmap=None):
         if self._chol_error is not None:
             raise ValueError("{0}".format(self._chol_error))
 
 
+class QuadMetricLowRankAdapt(QuadMetric):
+    """
+    Adapt a low-rank-plus-diagonal mass matrix.
+
+    The covariance is approximated as ``S @ (I + U @ diag(lam - 1) @ U.T) @ S``,
+    where ``S`` is the diagonal matrix of the sample standard deviations, and
+    the columns of ``U`` are the leading eigenvectors of the covariance of the
+    standardized samples, with eigenvalues ``lam``.
+
+    Parameters
+    ----------
+    n : positive int
+        The dimensionality of the problem.
+    initial_mean : 1-d array_like
+        Initial guess of the sample mean.
+    initial_var: 1-d array_like or None, optional
+        Initial guess of the sample variance. Set to ones by default.
+    max_rank : non-negative int, optional
+        The max number of eigenvectors to use. Set to `10` by default.
+    shrinkage : non-negative float, optional
+        The eigenvalues estimated from ``m`` samples are regularized as
+        ``(m * lam + shrinkage) / (m + shrinkage)``, and only the ones that
+        deviate the most from 1 are kept. Set to `5.` by default.
+
+    Notes
+    -----
+    The diagonal part is updated every `update_window` steps, while the
+    low-rank part is only computed at the end of each adaptation window, from
+    the samples in that window. Therefore, the cost of each step is O(n * k)
+    instead of O(n^2), where k is the rank.
+    """
+    def __init__(self, n, initial_mean, initial_var=None, initial_weight=10.,
+                 adapt_window=60, update_window=1, doubling=True,
+                 max_rank=10, shrinkage=5.):
+        initial_mean = np.asarray(initial_mean)
+        if initial_mean.ndim != 1 or len(initial_mean) != n:
+            raise ValueError('Wrong shape for initial_mean: expected %s got %s'
+                             % ((n,), initial_mean.shape))
+        if initial_var is None:
+            initial_var = np.ones(n)
+            initial_weight = 1.
+        initial_var = np.asarray(initial_var)
+        if initial_var.ndim != 1 or len(initial_var) != n:
+            raise ValueError('Wrong shape for initial_var: expected %s got %s'
+                             % ((n,), initial_var.shape))
+        try:
+            max_rank = int(max_rank)
+            assert max_rank >= 0
+        except Exception:
+            raise ValueError('max_rank should be a non-negative int.')
+        try:
+            shrinkage = float(shrinkage)
+            assert shrinkage >= 0.
+        except Exception:
+            raise ValueError('shrinkage should be a non-negative float.')
+
+        self._n = n
+        self._max_rank = max_rank
+        self._shrinkage = shrinkage
+        self._var = np.array(initial_var, copy=True, dtype=np.float)
+        self._std = np.sqrt(self._var)
+        self._inv_std = 1. / self._std
+        self._u = np.zeros((n, 0))
+        self._lam = np.ones(0)
+        self._foreground_var = _WeightedVariance(
+            self._n, initial_mean, initial_var, initial_weight)
+        self._background_var = _WeightedVariance(self._n)
+        self._background_samples = []
+        self._n_samples = 0
+
+        self._doubling = doubling
+        self._adapt_window = int(adapt_window)
+        self._update_window = int(update_window)
+        self._previous_update = 0
+
+    @property
+    def rank(self):
+        return self._lam.shape[0]
+
+    def velocity(self, x, out=None):
+        """Compute the velocity at the given momentum."""
+        y = self._std * x
+        y += self._u @ ((self._lam - 1.) * (self._u.T @ y))
+        return np.multiply(self._std, y, out=out)
+
+    def energy(self, x, velocity=None):
+        """Compute the kinetic energy at the given momentum."""
+        if velocity is None:
+            velocity = self.velocity(x)
+        return 0.5 * x.dot(velocity)
+
+    def random(self, random_generator):
+        """Draw a random value for the momentum."""
+        if isinstance(random_generator, RandomBuffer):
+            return random_generator.momentum(self)
+        vals = random_generator.normal(size=self._n)
+        vals += self._u @ ((self._lam**-0.5 - 1.) * (self._u.T @ vals))
+        return self._inv_std * vals
+
+    def _random_block(self, vals):
+        vals = vals + ((vals @ self._u) * (self._lam**-0.5 - 1.)) @ self._u.T
+        return self._inv_std * vals
+
+    def velocity_energy(self, x, v_out):
+        """Compute velocity and return kinetic energy at the given momentum."""
+        self.velocity(x, out=v_out)
+        return 0.5 * np.dot(x, v_out)
+
+    def _covariance(self):
+        """The dense covariance matrix. Only used for diagnostics."""
+        cov = np.eye(self._n) + (self._u * (self._lam - 1.)) @ self._u.T
+        return self._std[:, None] * cov * self._std
+
+    def _update_from_weightvar(self, weightvar):
+        weightvar.current_variance(out=self._var)
+        np.sqrt(self._var, out=self._std)
+        np.divide(1., self._std, out=self._inv_std)
+
+    def _update_low_rank(self, weightvar, samples):
+        m = len(samples)
+        if m < 2 or self._max_rank == 0:
+            return
+        self._update_from_weightvar(weightvar)
+        samples = np.asarray(samples)
+        z = (samples - np.mean(samples, axis=0)) * self._inv_std
+        try:
+            _, s, vt = scipy.linalg.svd(z / m**0.5, full_matrices=False)
+        except (scipy.linalg.LinAlgError, ValueError):
+            return
+        # the centered samples span at most m - 1 directions
+        s, vt = s[:m - 1], vt[:m - 1]
+        lam = (m * s**2 + self._shrinkage) / (m + self._shrinkage)
+        i_keep = np.argsort(-np.abs(np.log(lam)))[:self._max_rank]
+        self._u = vt[i_keep].T.copy()
+        self._lam = lam[i_keep]
+
+    def update(self, sample, warmup):
+        """Use a new sample during tuning to update."""
+        if not warmup:
+            return
+        self._version += 1
+
+        # Steps since previous update
+        delta = self._n_samples - self._previous_update
+
+        self._foreground_var.add_sample(sample, weight=1)
+        self._background_var.add_sample(sample, weight=1)
+        self._background_samples.append(np.array(sample, copy=True))
+
+        # Update the diagonal part every "update_window" steps
+        if (delta + 1) % self._update_window == 0:
+            self._update_from_weightvar(self._foreground_var)
+
+        # Update the low-rank part and reset the background variance
+        # if we are at the end of the adaptation window
+        if delta >= self._adapt_window:
+            self._update_low_rank(self._background_var,
+                                  self._background_samples)
+            self._foreground_var = self._background_var
+            self._background_var = _WeightedVariance(self._n)
+            self._background_samples = []
+
+            self._previous_update = self._n_samples
+            if self._doubling:
+                self._adapt_window *= 2
+
+        self._n_samples += 1
+
+    def raise_ok(self):
+        if not np.all(np.isfinite(self._std) & (self._std > 0)):
+            raise ValueError('Mass matrix contains zero or non-finite values '
+                             'on the diagonal.')
+
+
 class _WeightedVariance:
     """Online algorithm for computing mean and variance."""
     def __init__(self, nelem, initial_mean=None, initial_variance=None,
@@ -359,6 +649,21 @@ class _WeightedVariance:
         new_diff = x - self.mean
         self.raw_var[:] +=  weight * old_diff * new_diff
 
+    def merge(self, n_samples, mean, raw_var):
+        """Merge the accumulator of another set of samples, in place."""
+        n = self.n_samples + n_samples
+        delta = mean - self.mean
+        self.raw_var[:] += raw_var + delta**2 * self.n_samples * n_samples / n
+        self.mean[:] += delta * n_samples / n
+        self.n_samples = n
+
+    def merged(self, other):
+        """Return a new accumulator combining self and other."""
+        result = _WeightedVariance(self.mean.shape[0], initial_weight=0.)
+        result.merge(self.n_samples, self.mean, self.raw_var)
+        result.merge(other.n_samples, other.mean, other.raw_var)
+        return result
+
     def current_variance(self, out=None):
         if self.n_samples == 0.:
             raise ValueError('Can not compute variance without samples.')
@@ -405,6 +710,22 @@ class _WeightedCovariance:
         new_diff = x - self.mean
         self.raw_cov[:] += weight * new_diff[:, None] * old_diff[None, :]
 
+    def merge(self, n_samples, mean, raw_cov):
+        """Merge the accumulator of another set of samples, in place."""
+        n = self.n_samples + n_samples
+        delta = mean - self.mean
+        self.raw_cov[:] += raw_cov + (delta[:, None] * delta[None, :] *
+                                      self.n_samples * n_samples / n)
+        self.mean[:] += delta * n_samples / n
+        self.n_samples = n
+
+    def merged(self, other):
+        """Return a new accumulator combining self and other."""
+        result = _WeightedCovariance(self.mean.shape[0], initial_weight=0.)
+        result.merge(self.n_samples, self.mean, self.raw_cov)
+        result.merge(other.n_samples, other.mean, other.raw_cov)
+        return result
+
     def current_covariance(self, out=None):
         if self.n_samples == 0.:
             raise ValueError("Can not compute covariance without samples.")
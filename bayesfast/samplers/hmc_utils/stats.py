@@ -1,4 +1,6 @@
+import numpy as np
 from collections import namedtuple, OrderedDict
+from ...utils.storage import MemoryStorage
 
 __all__ = ['HStepStats', 'NStepStats', 'THStepStats', 'TNStepStats',
            'HStats', 'NStats', 'THStats', 'TNStats']
@@ -24,6 +26,12 @@ tnstats_items = ('u', 'weight', 'logp', 'energy', 'tree_depth', 'tree_size',
                  'energy_change', 'max_energy_change', 'diverging')
 
 
+int_items = ('tree_depth', 'tree_size', 'n_int_step')
+
+
+bool_items = ('warmup', 'diverging', 'accepted')
+
+
 HStepStats = namedtuple('HStepStats', hstats_items)
 
 
@@ -36,17 +44,69 @@ THStepStats = namedtuple('THStepStats', thstats_items)
 TNStepStats = namedtuple('TNStepStats', tnstats_items)
 
 
+def _stats_item(name):
+    """Property for the filled part of the buffer of a stats item."""
+    def fget(self):
+        try:
+            return self._buffers[name].view
+        except KeyError:
+            raise AttributeError("'{}' object has no attribute '_{}'".format(
+                type(self).__name__, name))
+    return property(fget)
+
+
 class _HStats:
     """Utilities shared by HStats and NStats."""
-    def __init__(self):
+    def __init__(self, size=0):
+        self._init_storage(MemoryStorage(), '', size)
+
+    def _init_storage(self, storage, prefix='', size=0):
+        self._buffers = OrderedDict()
         for si in self.stats_items:
-            setattr(self, '_' + si, [])
+            if si in int_items:
+                dtype = np.int
+            elif si in bool_items:
+                dtype = np.bool_
+            else:
+                dtype = np.float
+            self._buffers[si] = storage.buffer(prefix + si, size, dtype)
+
+    # the views of the stats items, which are only defined for the items
+    # in stats_items
+    _u = _stats_item('u')
+    _weight = _stats_item('weight')
+    _logp = _stats_item('logp')
+    _energy = _stats_item('energy')
+    _n_int_step = _stats_item('n_int_step')
+    _tree_depth = _stats_item('tree_depth')
+    _tree_size = _stats_item('tree_size')
+    _accept_stat = _stats_item('accept_stat')
+    _mean_tree_accept = _stats_item('mean_tree_accept')
+    _accepted = _stats_item('accepted')
+    _step_size = _stats_item('step_size')
+    _step_size_bar = _stats_item('step_size_bar')
+    _warmup = _stats_item('warmup')
+    _energy_change = _stats_item('energy_change')
+    _max_energy_change = _stats_item('max_energy_change')
+    _diverging = _stats_item('diverging')
+
+    def _readonly(self, name):
+        """The read-only view of the stats item."""
+        return self._buffers[name].readonly_view
+
+    def _reserve(self, size):
+        for b in self._buffers.values():
+            b.size = size
 
     def update(self, step_stats):
         if not isinstance(step_stats, self._step_stats):
             raise ValueError('invalid value for step_stats.')
         for si in self.stats_items:
-            getattr(self, '_' + si).append(getattr(step_stats, si))
+            self._buffers[si].append(getattr(step_stats, si))
+
+    def _truncate(self, n_iter):
+        for b in self._buffers.values():
+            b.truncate(n_iter)
 
     def get(self, since_iter=None, include_warmup=False):
         if since_iter is None:
@@ -57,8 +117,8 @@ class _HStats:
             except Exception:
                 raise ValueError('invalid value for since_iter.')
         return OrderedDict(
-            zip(self.stats_items, [getattr(self, '_' + si)[since_iter:] for si
-            in self.stats_items]))
+            zip(self.stats_items, [self._readonly(si)[since_iter:] for si in
+            self.stats_items]))
 
     __call__ = get
 
@@ -72,7 +132,10 @@ class _HStats:
 
     @property
     def n_warmup(self):
-        return self._warmup.index(False)
+        i = np.flatnonzero(~self._warmup)
+        if i.size == 0:
+            raise ValueError('all the iterations are in the warmup phase.')
+        return int(i[0])
 
 
 class HStats(_HStats):
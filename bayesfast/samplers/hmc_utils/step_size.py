@@ -44,6 +44,26 @@ class DualAverageAdaptation:
         self._log_bar = mk * self._log_step + (1. - mk) * self._log_bar
         self._count += 1
 
+    def _get_tuned(self):
+        """The internal state of the adaptation, see _HTrace.save_tuned."""
+        return {'log_step': self._log_step, 'log_bar': self._log_bar,
+                'hbar': self._hbar, 'mu': self._mu, 'count': self._count}
+
+    def _set_tuned(self, log_step, log_bar, hbar, mu, count):
+        self._log_step = float(log_step)
+        self._log_bar = float(log_bar)
+        self._hbar = float(hbar)
+        self._mu = float(mu)
+        self._count = int(count)
+
+    def _set_pooled(self, hbars):
+        """Replace hbar by its average over the chains, see PooledWarmup."""
+        if not self._adapt:
+            return
+        self._hbar = np.mean(hbars)
+        self._log_step = (self._mu - self._hbar *
+                          np.sqrt(max(self._count - 1, 1)) / self._gamma)
+
     def sizes(self):
         return {
             'step_size': np.exp(self._log_step),
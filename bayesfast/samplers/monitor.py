@@ -0,0 +1,256 @@
+import numpy as np
+from ..utils.diagnostics import split_rhat, ess_bulk, ess_tail
+from ..utils.collections import ArrayBuffer
+from collections import namedtuple
+try:
+    from distributed import Pub, Event
+    HAS_DASK = True
+except Exception:
+    HAS_DASK = False
+
+__all__ = ['ConvergenceMonitor']
+
+
+MonitorRecord = namedtuple('MonitorRecord', 'i_iter, rhat, ess_bulk, ess_tail')
+
+
+class ConvergenceMonitor:
+    """
+    Monitoring the convergence of multiple chains during sampling.
+
+    Parameters
+    ----------
+    check_every : positive int, optional
+        The chains report their new samples after warmup every `check_every`
+        iterations, and the diagnostics will be computed each time all the
+        chains have reported. Set to `100` by default.
+    rhat_max : positive float or None, optional
+        The upper bound of the rank-normalized split R-hat. Set to `1.01` by
+        default. If `None`, will not be used as a stopping criterion.
+    ess_bulk_min : positive float or None, optional
+        The lower bound of the bulk effective sample size. Set to `400.` by
+        default. If `None`, will not be used as a stopping criterion.
+    ess_tail_min : positive float or None, optional
+        The lower bound of the tail effective sample size. Set to `400.` by
+        default. If `None`, will not be used as a stopping criterion.
+    min_sample : positive int, optional
+        The minimum number of samples after warmup in each chain, before which
+        the sampling will not be stopped. Set to `100` by default.
+    include_logp : bool, optional
+        Whether to also monitor the convergence of logp. Set to `True` by
+        default.
+    check_growth : float, optional
+        After each check, the diagnostics will not be computed again until the
+        number of samples in each chain has grown by this factor. Should be no
+        smaller than `1`. Set to `1.2` by default.
+
+    Notes
+    -----
+    All the chains stop once all the criteria are satisfied. Since the chains
+    run asynchronously, they stop at their next check after the decision, and
+    are then truncated to the same length. Currently, only the `multiprocess`
+    and `dask` backends are supported.
+
+    The rank normalization of R-hat and the tail ESS depend on the quantiles
+    of the draws pooled over all the chains, which cannot be recovered from
+    per-chain summaries. Therefore, every `check_every` iterations, each chain
+    sends its new draws after warmup (and logp if `include_logp`) to the
+    parent, i.e. the traffic grows with the number of draws, with each draw
+    sent once, rather than with the number of checks.
+
+    The reported samples are kept in growable buffers. Since the diagnostics
+    are computed with all the samples after warmup, checking them at every
+    report would cost quadratic time in the number of samples; with the
+    geometric schedule set by `check_growth`, the total cost stays within a
+    constant factor of the last check, at the price of stopping up to
+    `check_growth` times later than necessary.
+    """
+    def __init__(self, check_every=100, rhat_max=1.01, ess_bulk_min=400.,
+                 ess_tail_min=400., min_sample=100, include_logp=True,
+                 check_growth=1.2):
+        self.check_every = check_every
+        self.rhat_max = rhat_max
+        self.ess_bulk_min = ess_bulk_min
+        self.ess_tail_min = ess_tail_min
+        self.min_sample = min_sample
+        self.include_logp = include_logp
+        self.check_growth = check_growth
+        self._queue = None
+        self._dask_key = None
+        self._reset()
+
+    def __getstate__(self):
+        """Only the communication handles are needed by the workers."""
+        self_dict = self.__dict__.copy()
+        self_dict['_buffers'] = None
+        self_dict['_records'] = []
+        self_dict['_pub'] = None
+        self_dict['_event'] = None if self._dask_key else self._event
+        return self_dict
+
+    def _reset(self):
+        self._buffers = None
+        self._records = []
+        self._pub = None
+        self._event = None
+        self._n_stop = None
+
+    @property
+    def check_every(self):
+        return self._check_every
+
+    @check_every.setter
+    def check_every(self, ce):
+        try:
+            ce = int(ce)
+            assert ce > 1
+        except Exception:
+            raise ValueError('check_every should be an int larger than 1.')
+        self._check_every = ce
+
+    def _positive_or_none(self, value, name):
+        if value is None:
+            return None
+        try:
+            value = float(value)
+            assert value > 0
+        except Exception:
+            raise ValueError('{} should be a positive float or None.'.format(
+                name))
+        return value
+
+    @property
+    def rhat_max(self):
+        return self._rhat_max
+
+    @rhat_max.setter
+    def rhat_max(self, rm):
+        self._rhat_max = self._positive_or_none(rm, 'rhat_max')
+
+    @property
+    def ess_bulk_min(self):
+        return self._ess_bulk_min
+
+    @ess_bulk_min.setter
+    def ess_bulk_min(self, ebm):
+        self._ess_bulk_min = self._positive_or_none(ebm, 'ess_bulk_min')
+
+    @property
+    def ess_tail_min(self):
+        return self._ess_tail_min
+
+    @ess_tail_min.setter
+    def ess_tail_min(self, etm):
+        self._ess_tail_min = self._positive_or_none(etm, 'ess_tail_min')
+
+    @property
+    def min_sample(self):
+        return self._min_sample
+
+    @min_sample.setter
+    def min_sample(self, ms):
+        try:
+            ms = int(ms)
+            assert ms > 0
+        except Exception:
+            raise ValueError('min_sample should be a positive int.')
+        self._min_sample = ms
+
+    @property
+    def include_logp(self):
+        return self._include_logp
+
+    @include_logp.setter
+    def include_logp(self, il):
+        self._include_logp = bool(il)
+
+    @property
+    def check_growth(self):
+        return self._check_growth
+
+    @check_growth.setter
+    def check_growth(self, cg):
+        try:
+            cg = float(cg)
+            assert cg >= 1.
+        except Exception:
+            raise ValueError('check_growth should be a float no smaller than '
+                             '1.')
+        self._check_growth = cg
+
+    @property
+    def records(self):
+        """The diagnostics computed at each check, as a list."""
+        return list(self._records)
+
+    @property
+    def n_stop(self):
+        """The number of iterations at which the convergence was reached."""
+        return self._n_stop
+
+    # the methods below are used by the parent process
+
+    def _activate(self, n_chain, queue=None, event=None, dask_key=None):
+        self._reset()
+        self._buffers = [ArrayBuffer() for _ in range(n_chain)]
+        self._queue = queue
+        self._dask_key = dask_key
+        if dask_key is None:
+            self._event = event
+        else:
+            if not HAS_DASK:
+                raise RuntimeError('you want me to use dask but have not '
+                                   'installed it.')
+            self._event = Event(self._event_name)
+            self._event.clear()
+
+    def _deactivate(self):
+        if self._dask_key is not None:
+            self._event.clear()
+        self._queue = None
+        self._dask_key = None
+        self._event = None
+
+    @property
+    def _event_name(self):
+        return str(self._dask_key) + '-ConvergenceMonitor'
+
+    def _collect(self, chain_id, n_warmup, i_iter, chunk):
+        """Receive a chunk of samples and check the convergence if possible."""
+        self._buffers[chain_id].extend(chunk)
+        n_min = min(len(b) for b in self._buffers)
+        if n_min < self.min_sample or self._n_stop is not None:
+            return False
+        if self._records:
+            n_last = self._records[-1].i_iter - n_warmup
+            if n_min <= n_last or n_min < self.check_growth * n_last:
+                return False
+        x = np.array([b.view[:n_min] for b in self._buffers])
+        rhat = np.max(split_rhat(x))
+        eb = np.min(ess_bulk(x))
+        et = np.min(ess_tail(x))
+        self._records.append(MonitorRecord(n_warmup + n_min, rhat, eb, et))
+        if ((self.rhat_max is None or rhat <= self.rhat_max) and
+            (self.ess_bulk_min is None or eb >= self.ess_bulk_min) and
+            (self.ess_tail_min is None or et >= self.ess_tail_min)):
+            self._n_stop = n_warmup + n_min
+            self._event.set()
+            return True
+        return False
+
+    # the methods below are used by the chains
+
+    def _report(self, chain_id, n_warmup, i_iter, samples, logp):
+        """Send the new samples to the parent, and return whether to stop."""
+        chunk = np.asarray(samples)
+        if self.include_logp:
+            chunk = np.concatenate((chunk, np.asarray(logp)[:, None]), axis=-1)
+        msg = ['SamplingDraws', chain_id, n_warmup, i_iter, chunk]
+        if self._dask_key is None:
+            self._queue.put(msg)
+        else:
+            if self._pub is None:
+                self._pub = Pub(self._dask_key)
+                self._event = Event(self._event_name)
+            self._pub.put(msg)
+        return self._event.is_set()
@@ -1,5 +1,6 @@
 import numpy as np
-from collections import namedtuple
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
 from .hmc_utils.base_hmc import BaseHMC, HMCStepData, DivergenceInfo
 from .hmc_utils.integration import IntegrationError
 from .hmc_utils.stats import NStepStats
@@ -19,12 +20,57 @@ Subtree = namedtuple("Subtree", "left, right, p_sum, proposal, log_size, "
                      "accept_sum, n_proposals")
 
 
+class _Speculation:
+    """Leapfrog steps computed in the background from one end of the tree."""
+    def __init__(self, integrator, start, epsilon, start_energy, max_change):
+        self.integrator = integrator
+        self.start = start
+        self.epsilon = epsilon
+        self.start_energy = start_energy
+        self.max_change = max_change
+        self.states = []
+        self.error = None
+        self.n_target = 0
+        self.stop = False
+        self.future = None
+
+    def _run(self):
+        while (not self.stop and self.error is None and
+               len(self.states) < self.n_target):
+            state = self.states[-1] if self.states else self.start
+            try:
+                state = self.integrator.step(self.epsilon, state)
+            except Exception as err:
+                self.error = err
+                break
+            self.states.append(state)
+            # the tree will diverge here, so the following steps are useless
+            if not np.abs(state.energy - self.start_energy) < self.max_change:
+                self.stop = True
+
+    def extend_to(self, n, executor):
+        self.n_target = max(self.n_target, n)
+        if self.future is None or self.future.done():
+            self.future = executor.submit(self._run)
+
+    def claim(self):
+        """Stop the background work and return the computed steps."""
+        self.stop = True
+        if self.future is not None:
+            self.future.result()
+        feed = deque(self.states)
+        if self.error is not None:
+            feed.append(self.error)
+        return feed
+
+
 class Tree:
 
     def _get_proposal(self, point, p_accept):
         return Proposal(point.q, point.energy, point.logp, p_accept)
 
-    def __init__(self, ndim, integrator, start, step_size, max_change, logbern):
+    def __init__(self, ndim, integrator, start, step_size, max_change, logbern,
+                 executor=None):
         self.ndim = ndim
         self.integrator = integrator
         self.start = start
@@ -42,6 +88,11 @@ class Tree:
         self.max_energy_change = 0
         self.logbern = logbern
 
+        self.executor = executor
+        self.n_speculative = 0
+        self._speculations = {}
+        self._feed = deque()
+
     def extend(self, direction):
         """Double the treesize by extending the tree in the given direction.
 
@@ -54,6 +105,8 @@ class Tree:
         the tree extension was stopped because the termination criterior
         was reached (the trajectory is turning back).
         """
+        if self.executor is not None:
+            self._speculate(direction)
         if direction > 0:
             tree, diverging, turning = self._build_subtree(
                 self.right, self.depth, np.asarray(self.step_size))
@@ -102,10 +155,53 @@ class Tree:
 
         return diverging, turning
 
+    def _speculate(self, direction):
+        """
+        Let the executor expand the opposite end, which will be needed by the
+        next extension with probability 1/2, and take over the steps already
+        expanded in this direction.
+        """
+        self.n_speculative += len(self._feed)
+        opposite = -direction
+        if opposite not in self._speculations:
+            start = self.right if opposite > 0 else self.left
+            self._speculations[opposite] = _Speculation(
+                self.integrator, start, np.asarray(opposite * self.step_size),
+                self.start_energy, self.max_change)
+        self._speculations[opposite].extend_to(2**(self.depth + 1),
+                                               self.executor)
+        speculation = self._speculations.pop(direction, None)
+        if speculation is None:
+            self._feed = deque()
+        else:
+            self._feed = speculation.claim()
+
+    def close(self):
+        """Stop the background work, and count the unused steps."""
+        self.n_speculative += len(self._feed)
+        self._feed = deque()
+        for speculation in self._speculations.values():
+            speculation.stop = True
+            # wait for the step in progress, which should not run together
+            # with the next trajectory since the integrator is not thread-safe
+            if speculation.future is not None:
+                speculation.future.result()
+            self.n_speculative += len(speculation.states)
+        self._speculations = {}
+
+    def _leapfrog(self, epsilon, left):
+        """Use the speculative steps if available, which are identical."""
+        if self._feed:
+            right = self._feed.popleft()
+            if isinstance(right, Exception):
+                raise right
+            return right
+        return self.integrator.step(epsilon, left)
+
     def _single_step(self, left, epsilon):
         """Perform a leapfrog step and handle error cases."""
         try:
-            right = self.integrator.step(epsilon, left)
+            right = self._leapfrog(epsilon, left)
         except IntegrationError as err:
             error_msg = str(err)
             error = err
@@ -197,21 +293,41 @@ class NUTS(BaseHMC):
 
     _expected_tree = Tree
 
+    # the thread for the speculative steps, shared by all the iterations
+    _executor = None
+
     def logbern(self, logp):
         if np.isnan(logp):
             raise FloatingPointError("logp can't be nan.")
-        return np.log(self.sample_trace.random_generator.uniform()) < logp
+        return np.log(self.sample_trace._rng.uniform()) < logp
 
     def _hamiltonian_step(self, start, p0, step_size):
+        if self.sample_trace.speculative:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1)
+            executor = self._executor
+        else:
+            executor = None
         tree = self._expected_tree(len(p0), self.integrator, start, step_size,
-                                   self.sample_trace.max_change, self.logbern)
+                                   self.sample_trace.max_change, self.logbern,
+                                   executor)
 
-        for _ in range(self.sample_trace.max_treedepth):
-            direction = self.logbern(np.log(0.5)) * 2 - 1
-            divergence_info, turning = tree.extend(direction)
-            if divergence_info or turning:
-                break
+        try:
+            for _ in range(self.sample_trace.max_treedepth):
+                direction = self.logbern(np.log(0.5)) * 2 - 1
+                divergence_info, turning = tree.extend(direction)
+                if divergence_info or turning:
+                    break
+        finally:
+            if executor is not None:
+                tree.close()
+                self.sample_trace._n_speculative += tree.n_speculative
 
         stats = tree.stats()
         accept_stat = stats['mean_tree_accept']
         return HMCStepData(tree.proposal, accept_stat, divergence_info, stats)
+
+    def _close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,138 @@
+import numpy as np
+try:
+    from distributed import Pub, Sub
+    HAS_DASK = True
+except Exception:
+    HAS_DASK = False
+
+__all__ = ['PooledWarmup']
+
+
+class PooledWarmup:
+    """
+    Pooling the warmup adaptation of multiple chains.
+
+    Parameters
+    ----------
+    share_every : positive int, optional
+        During warmup, each chain shares its adaptation statistics every
+        `share_every` iterations, and then adapts from the pooled estimate.
+        Set to `20` by default.
+    pool_metric : bool, optional
+        Whether to pool the sample mean and (co)variance used by the metric
+        adaptation. Only works for the `diag` and `full` metrics. Set to `True`
+        by default.
+    pool_step_size : bool, optional
+        Whether to pool the dual averaging statistics of the step size
+        adaptation. Set to `True` by default.
+
+    Notes
+    -----
+    Each chain publishes the online accumulator of the current adaptation
+    window, together with the running average of the acceptance statistics,
+    and combines the latest ones from the other chains in the same window.
+    Therefore, the metric is estimated from about `n_chain` times more
+    samples, which makes it possible to use a shorter warmup. The chains do
+    not wait for each other, so the results depend on the timing of the
+    chains, and are not exactly reproducible. Currently, only the
+    `multiprocess` and `dask` backends are supported.
+    """
+    def __init__(self, share_every=20, pool_metric=True, pool_step_size=True):
+        self.share_every = share_every
+        self.pool_metric = pool_metric
+        self.pool_step_size = pool_step_size
+        self._shared = None
+        self._dask_key = None
+        self._reset()
+
+    def __getstate__(self):
+        """Only the communication handles are needed by the workers."""
+        self_dict = self.__dict__.copy()
+        self_dict['_pub'] = None
+        self_dict['_sub'] = None
+        self_dict['_reports'] = {}
+        return self_dict
+
+    def _reset(self):
+        self._pub = None
+        self._sub = None
+        self._reports = {}
+
+    @property
+    def share_every(self):
+        return self._share_every
+
+    @share_every.setter
+    def share_every(self, se):
+        try:
+            se = int(se)
+            assert se > 0
+        except Exception:
+            raise ValueError('share_every should be a positive int.')
+        self._share_every = se
+
+    @property
+    def pool_metric(self):
+        return self._pool_metric
+
+    @pool_metric.setter
+    def pool_metric(self, pm):
+        self._pool_metric = bool(pm)
+
+    @property
+    def pool_step_size(self):
+        return self._pool_step_size
+
+    @pool_step_size.setter
+    def pool_step_size(self, pss):
+        self._pool_step_size = bool(pss)
+
+    # the methods below are used by the parent process
+
+    def _activate(self, shared=None, dask_key=None):
+        self._reset()
+        self._shared = shared
+        self._dask_key = dask_key
+        if dask_key is not None and not HAS_DASK:
+            raise RuntimeError('you want me to use dask but have not installed '
+                               'it.')
+
+    def _deactivate(self):
+        self._shared = None
+        self._dask_key = None
+
+    @property
+    def _topic(self):
+        return str(self._dask_key) + '-PooledWarmup'
+
+    # the methods below are used by the chains
+
+    def _share(self, sample_trace):
+        """Publish the statistics of this chain, and adapt from the pool."""
+        chain_id = sample_trace.chain_id
+        metric = sample_trace.metric
+        step_size = sample_trace.step_size
+        use_metric = self.pool_metric and hasattr(metric, '_set_pooled')
+        report = (metric._pooled_state() if use_metric else None,
+                  step_size._hbar)
+        if self._dask_key is None:
+            self._shared[chain_id] = report
+            self._reports = dict(self._shared)
+        else:
+            if self._pub is None:
+                self._pub = Pub(self._topic)
+                self._sub = Sub(self._topic)
+            self._pub.put([chain_id, report])
+            while True:
+                try:
+                    i, r = self._sub.get(timeout=0)
+                    self._reports[i] = r
+                except Exception:
+                    break
+            self._reports[chain_id] = report
+        if use_metric:
+            metric._set_pooled([r[0] for i, r in self._reports.items() if
+                                i != chain_id and r[0] is not None])
+        if self.pool_step_size:
+            step_size._set_pooled(np.array([r[1] for r in
+                                            self._reports.values()]))
@@ -0,0 +1,174 @@
+import numpy as np
+try:
+    from distributed import Pub
+    HAS_DASK = True
+except Exception:
+    HAS_DASK = False
+
+__all__ = ['SamplerProfiler']
+
+
+profile_dtype = np.dtype([
+    ('chain_id', np.int), ('i_iter', np.int), ('wall_time', np.float),
+    ('n_grad', np.int), ('tree_depth', np.int), ('step_size', np.float),
+    ('accept_stat', np.float), ('diverging', np.bool_), ('warmup', np.bool_)])
+
+
+class SamplerProfiler:
+    """
+    Collecting structured per-iteration metrics from the chains.
+
+    Parameters
+    ----------
+    callback : None or callable, optional
+        If not `None`, will be called in the parent process with each batch of
+        new records, as a structured array described below. Set to `None` by
+        default.
+    report_every : positive int, optional
+        The chains send their records to the parent every `report_every`
+        iterations, and when they finish. Set to `10` by default.
+
+    Notes
+    -----
+    For each iteration, the record has the fields `chain_id`, `i_iter`,
+    `wall_time` (the seconds used by the iteration), `n_grad` (the number of
+    logp_and_grad evaluations), `tree_depth` (`0` for HMC), `step_size`,
+    `accept_stat`, `diverging` and `warmup`. The records are sent to the
+    parent as they come with the `multiprocess` and `dask` backends, while
+    for the other backends, they are collected after the chains finish, so
+    `callback` will only be called at the end. Currently, only `NUTS`, `HMC`,
+    `TNUTS` and `THMC` are supported.
+    """
+    def __init__(self, callback=None, report_every=10):
+        self.callback = callback
+        self.report_every = report_every
+        self._queue = None
+        self._dask_key = None
+        self._reset()
+
+    def __getstate__(self):
+        """Only the communication handles are needed by the workers."""
+        self_dict = self.__dict__.copy()
+        self_dict['_records'] = []
+        self_dict['_pub'] = None
+        self_dict['_callback'] = None
+        return self_dict
+
+    def _reset(self):
+        self._records = []
+        self._pub = None
+
+    @property
+    def callback(self):
+        return self._callback
+
+    @callback.setter
+    def callback(self, cb):
+        if cb is None or callable(cb):
+            self._callback = cb
+        else:
+            raise ValueError('callback should be callable or None.')
+
+    @property
+    def report_every(self):
+        return self._report_every
+
+    @report_every.setter
+    def report_every(self, re):
+        try:
+            re = int(re)
+            assert re > 0
+        except Exception:
+            raise ValueError('report_every should be a positive int.')
+        self._report_every = re
+
+    @property
+    def records(self):
+        """All the records received so far, sorted by chain_id and i_iter."""
+        if not self._records:
+            return np.empty(0, dtype=profile_dtype)
+        records = np.concatenate(self._records)
+        return records[np.lexsort((records['i_iter'], records['chain_id']))]
+
+    def get(self, name):
+        """Return a field of the records, as a list of arrays for each chain."""
+        if name not in profile_dtype.names:
+            raise ValueError('invalid value for name.')
+        records = self.records
+        return [records[name][records['chain_id'] == i] for i in
+                np.unique(records['chain_id'])]
+
+    @property
+    def n_grad(self):
+        """The total number of logp_and_grad evaluations."""
+        return int(np.sum(self.records['n_grad']))
+
+    @property
+    def wall_time(self):
+        """The total wall time of the iterations, summed over the chains."""
+        return float(np.sum(self.records['wall_time']))
+
+    # the methods below are used by the parent process
+
+    def _activate(self, queue=None, dask_key=None):
+        self._reset()
+        self._queue = queue
+        self._dask_key = dask_key
+        if dask_key is not None and not HAS_DASK:
+            raise RuntimeError('you want me to use dask but have not installed '
+                               'it.')
+
+    def _deactivate(self, sample_traces):
+        """Collect the records that have not been sent by the chains."""
+        for t in sample_traces:
+            records = getattr(t, '_profile_records', None)
+            if records:
+                self._collect(t.chain_id, np.array(records,
+                                                   dtype=profile_dtype))
+            t._profile_records = []
+        self._queue = None
+        self._dask_key = None
+
+    def _collect(self, chain_id, records):
+        self._records.append(records)
+        if self.callback is not None:
+            self.callback(records)
+
+    # the methods below are used by the chains
+
+    def _record(self, sample_trace, wall_time, n_extra=0):
+        """Append the record of the last iteration to the trace."""
+        if not hasattr(sample_trace, '_profile_records'):
+            sample_trace._profile_records = []
+        stats = sample_trace.stats
+        if 'tree_size' in stats.stats_items:
+            n_grad = stats._tree_size[-1] + 1
+            tree_depth = stats._tree_depth[-1]
+            accept_stat = stats._mean_tree_accept[-1]
+        else:
+            n_grad = stats._n_int_step[-1] + 1
+            tree_depth = 0
+            accept_stat = stats._accept_stat[-1]
+        sample_trace._profile_records.append((
+            sample_trace.chain_id, sample_trace.i_iter - 1, wall_time,
+            n_grad + n_extra, tree_depth, stats._step_size[-1], accept_stat,
+            stats._diverging[-1], stats._warmup[-1]))
+        if len(sample_trace._profile_records) >= self.report_every:
+            self._send(sample_trace)
+
+    def _send(self, sample_trace):
+        """Send the buffered records to the parent, if there is a channel."""
+        records = getattr(sample_trace, '_profile_records', None)
+        if not records:
+            return
+        if self._dask_key is None and self._queue is None:
+            return
+        msg = ['SamplerEvents', sample_trace.chain_id,
+               np.array(records, dtype=profile_dtype)]
+        if self._dask_key is None:
+            self._queue.put(msg)
+        else:
+            if self._pub is None:
+                self._pub = Pub(self._dask_key)
+            self._pub.put(msg)
+        sample_trace._profile_records = []
@@ -2,15 +2,19 @@ import numpy as np
 from .hmc_utils.step_size import DualAverageAdaptation
 from .hmc_utils.metrics import QuadMetric, QuadMetricDiag, QuadMetricFull
 from .hmc_utils.metrics import QuadMetricDiagAdapt, QuadMetricFullAdapt
+from .hmc_utils.metrics import QuadMetricLowRankAdapt
 from .hmc_utils.stats import HStepStats, NStepStats, THStepStats, TNStepStats
 from .hmc_utils.stats import HStats, NStats, THStats, TNStats
-from ..utils.random import get_generator, spawn_generator
+from ..utils.random import get_generator, spawn_generator, RandomBuffer
 from ..core import Density, DensityLite
+from ..utils.collections import ArrayBuffer
+from ..utils.storage import get_storage
 from copy import deepcopy
 import warnings
+import os
 
 __all__ = ['SampleTrace', '_HTrace', 'NTrace', 'HTrace', 'TNTrace', 'THTrace',
-           'ETrace', 'TraceTuple', '_get_step_size', '_get_metric']
+           'ETrace', 'STrace', 'TraceTuple', '_get_step_size', '_get_metric']
 
 # TODO: StatsTuple?
 
@@ -87,10 +91,10 @@ class SampleTrace:
     def n_warmup(self, n):
         try:
             n = int(n)
-            assert n > 0
+            assert n >= 0
         except Exception:
-            raise ValueError('n_warmup should be a positive int, instead of '
-                             '{}.'.format(n))
+            raise ValueError('n_warmup should be a non-negative int, instead '
+                             'of {}.'.format(n))
         self._warmup_check(n)
         if n >= self.n_iter:
             raise ValueError('n_iter is {}, so n_warmup should be smaller than '
@@ -161,20 +165,93 @@ class _HTrace(SampleTrace):
                  metric='diag', adapt_metric=True, max_change=1000.,
                  target_accept=0.8, gamma=0.05, k=0.75, t_0=10.,
                  initial_mean=None, initial_weight=10., adapt_window=60,
-                 update_window=1, doubling=True):
+                 update_window=1, doubling=True, storage=None,
+                 rank_one_update=False, max_rank=10, tuned=None, rng_buffer=0):
         super().__init__(n_chain, n_iter, n_warmup, x_0, random_generator)
-        self._samples = []
+        self.storage = storage
+        self._samples_buffer = ArrayBuffer(dtype=np.float)
         self._chain_id = None
         self.max_change = max_change
         self._set_step_size(step_size, adapt_step_size, target_accept, gamma, k,
                             t_0)
         self._set_metric(metric, adapt_metric, initial_mean, initial_weight,
-                         adapt_window, update_window, doubling)
+                         adapt_window, update_window, doubling,
+                         rank_one_update, max_rank)
+        self.tuned = tuned
+        self.rng_buffer = rng_buffer
+        self._random_buffer = None
 
     @property
     def chain_id(self):
         return self._chain_id
 
+    @property
+    def rng_buffer(self):
+        """
+        If positive, the momenta and the uniform numbers used by the sampler
+        will be drawn in blocks of this size, see `RandomBuffer`. This changes
+        the samples, which are still reproducible given the seed.
+        """
+        return self._rng_buffer
+
+    @rng_buffer.setter
+    def rng_buffer(self, rb):
+        if self._chain_initialized:
+            raise RuntimeError('you should not change rng_buffer once the '
+                               'chain is initialized.')
+        try:
+            rb = int(rb)
+            assert rb >= 0
+        except Exception:
+            raise ValueError('rng_buffer should be a non-negative int.')
+        self._rng_buffer = rb
+
+    @property
+    def _rng(self):
+        """The source of the momenta and uniform numbers for the sampler."""
+        if self._random_buffer is not None:
+            return self._random_buffer
+        return self.random_generator
+
+    @property
+    def tuned(self):
+        """
+        The tuned state loaded from `save_tuned`, as a dict of arrays.
+
+        When set, chain `i` starts from the `i % n_saved`-th saved chain: its
+        last position is used as `x_0` (unless `x_0` is given), its dual
+        averaging state replaces `step_size`, and its metric is used as the
+        initial metric, unless `metric` is given as an array or QuadMetric.
+        """
+        return self._tuned
+
+    @tuned.setter
+    def tuned(self, t):
+        if self._chain_initialized:
+            raise RuntimeError('you should not change tuned once the chain '
+                               'is initialized.')
+        self._tuned = _load_tuned(t)
+        if self._tuned is not None and self._x_0 is None:
+            self._x_0 = self._tuned['x'].copy()
+            self._x_0_transformed = True
+
+    @property
+    def _i_tuned(self):
+        return self._chain_id % self._tuned['x'].shape[0]
+
+    def save_tuned(self, filename):
+        """
+        Save the tuned state of this chain to a `.npz` file.
+
+        Parameters
+        ----------
+        filename : str
+            The file to save the state, which can be loaded with the `tuned`
+            argument of `NTrace` / `HTrace`. The positions are saved in the
+            transformed space, so the same `Density` should be used.
+        """
+        _save_tuned([self], filename)
+
     def _init_chain(self, i):
         if self._x_0 is None:
             raise RuntimeError('no valid x_0 is given.')
@@ -197,10 +274,31 @@ class _HTrace(SampleTrace):
         else:
             self._x_0 = self._x_0[
                 self.random_generator.integers(0, self._x_0.shape[0])]
+        if self._rng_buffer > 0:
+            self._random_buffer = RandomBuffer(self.random_generator,
+                                               self._rng_buffer)
         self._set_step_size_2()
         self._set_metric_2()
+        self._init_storage()
         self._chain_initialized = True
 
+    def _init_storage(self):
+        prefix = 'chain-{}-'.format(self._chain_id)
+        self._samples_buffer = self.storage.buffer(prefix + 'samples',
+                                                   self.n_iter, np.float)
+        self._stats._init_storage(self.storage, prefix, self.n_iter)
+
+    @property
+    def storage(self):
+        return self._storage
+
+    @storage.setter
+    def storage(self, s):
+        if self._chain_initialized:
+            raise RuntimeError('you should not change storage once the chain '
+                               'is initialized.')
+        self._storage = get_storage(s)
+
     @property
     def step_size(self):
         return self._step_size
@@ -223,18 +321,26 @@ class _HTrace(SampleTrace):
                              'of {}.'.format(max_change))
         self._max_change = max_change
 
+    @property
+    def _samples(self):
+        return self._samples_buffer.view
+
     @property
     def samples(self):
-        return np.asarray(self._samples)
+        return self._samples_buffer.readonly_view
+
+    @property
+    def _samples_original(self):
+        return self._samples_original_buffer.view
 
     @property
     def samples_original(self):
-        return np.asarray(self._samples_original)
+        return self._samples_original_buffer.readonly_view
 
     @property
     def i_iter(self):
         try:
-            return len(self._samples)
+            return len(self._samples_buffer)
         except Exception:
             return 0
 
@@ -250,11 +356,31 @@ class _HTrace(SampleTrace):
 
     @property
     def logp(self):
-        return np.asarray(self.stats._logp)
+        return self.stats._readonly('logp')
+
+    @property
+    def _logp_original(self):
+        return self._logp_original_buffer.view
 
     @property
     def logp_original(self):
-        return np.asarray(self._logp_original)
+        return self._logp_original_buffer.readonly_view
+
+    def _set_original(self, density, chunk_size=10000):
+        """Transform the samples and logp to the original space in chunks."""
+        if not hasattr(self, '_samples_original_buffer'):
+            prefix = 'chain-{}-'.format(self._chain_id)
+            self._samples_original_buffer = self.storage.buffer(
+                prefix + 'samples_original', self.i_iter, np.float)
+            self._logp_original_buffer = self.storage.buffer(
+                prefix + 'logp_original', self.i_iter, np.float)
+        self._samples_original_buffer.truncate(0)
+        self._logp_original_buffer.truncate(0)
+        for i in range(0, self.i_iter, chunk_size):
+            x = self.samples[i:(i + chunk_size)]
+            self._samples_original_buffer.extend(density.to_original(x))
+            self._logp_original_buffer.extend(density.to_original_density(
+                self.logp[i:(i + chunk_size)], x_trans=x))
 
     @property
     def stats(self):
@@ -269,9 +395,24 @@ class _HTrace(SampleTrace):
         raise NotImplementedError('abstract property.')
 
     def update(self, point, stats):
-        self._samples.append(point)
+        if self._samples_buffer.size < self.n_iter:
+            self._samples_buffer.size = self.n_iter
+            self._stats._reserve(self.n_iter)
+        self._samples_buffer.append(point)
         self._stats.update(stats)
 
+    def _truncate(self, n_iter):
+        """Discard all the iterations after the first n_iter ones."""
+        if not self.n_warmup < n_iter <= self.i_iter:
+            raise ValueError('n_iter should satisfy n_warmup < n_iter <= '
+                             'i_iter.')
+        self._samples_buffer.truncate(n_iter)
+        self._stats._truncate(n_iter)
+        if hasattr(self, '_samples_original_buffer'):
+            self._samples_original_buffer.truncate(n_iter)
+            self._logp_original_buffer.truncate(n_iter)
+        self._n_iter = n_iter
+
     _all_return = ['samples', 'logp']
 
     def get(self, since_iter=None, include_warmup=False, original_space=True,
@@ -309,8 +450,9 @@ class _HTrace(SampleTrace):
 
     def _warmup_check(self, n):
         if self.i_iter > 0:
-            _adapt_metric = isinstance(self.metric, (QuadMetricDiagAdapt,
-                                                     QuadMetricFullAdapt))
+            _adapt_metric = isinstance(self.metric, (
+                QuadMetricDiagAdapt, QuadMetricFullAdapt,
+                QuadMetricLowRankAdapt))
             _adapt_step_size = self._step_size._adapt
             if _adapt_metric or _adapt_step_size:
                 if self.n_warmup < self.i_iter or n < self.i_iter:
@@ -365,6 +507,12 @@ class _HTrace(SampleTrace):
     def _set_step_size_2(self):
         if isinstance(self.step_size, DualAverageAdaptation):
             pass
+        elif self._tuned is not None:
+            self._step_size = DualAverageAdaptation(
+                1., self._target_accept, self._gamma, self._k, self._t_0,
+                self._adapt_step_size)
+            self._step_size._set_tuned(*[self._tuned[_][self._i_tuned] for _
+                                         in _tuned_step_items])
         else:
             if self._step_size is None:
                 self._step_size = 1.
@@ -373,12 +521,17 @@ class _HTrace(SampleTrace):
                 self._gamma, self._k, self._t_0, self._adapt_step_size)
 
     def _set_metric(self, metric, adapt_metric, initial_mean, initial_weight,
-                    adapt_window, update_window, doubling):
+                    adapt_window, update_window, doubling, rank_one_update,
+                    max_rank):
         if isinstance(metric, QuadMetric):
             self._metric = metric
         else:
             if metric == 'diag' or metric == 'full':
                 pass
+            elif metric == 'lowrank':
+                if not adapt_metric:
+                    raise ValueError('the lowrank metric should be used with '
+                                     'adapt_metric=True.')
             else:
                 try:
                     metric = np.asarray(metric)
@@ -420,15 +573,42 @@ class _HTrace(SampleTrace):
                 raise ValueError('invalid value for update_window.')
             self._update_window = update_window
             self._doubling = bool(doubling)
+            self._rank_one_update = bool(rank_one_update)
+
+            try:
+                max_rank = int(max_rank)
+                assert max_rank >= 0
+            except Exception:
+                raise ValueError('invalid value for max_rank.')
+            self._max_rank = max_rank
 
     def _set_metric_2(self):
         if isinstance(self.metric, QuadMetric):
             pass
         else:
+            lowrank_var = None
+            if self._tuned is not None and isinstance(self._metric, str):
+                j = self._i_tuned
+                if self._initial_mean is None:
+                    self._initial_mean = self._tuned['mean'][j].copy()
+                if (self._metric == 'lowrank' and
+                    str(self._tuned['metric']) == 'lowrank'):
+                    lowrank_var = self._tuned['var'][j].copy()
+                else:
+                    cov = _tuned_cov(self._tuned, j)
+                    if self._metric == 'diag':
+                        self._metric = np.diag(cov).copy()
+                    elif self._metric == 'full':
+                        self._metric = cov
+                    else:
+                        lowrank_var = np.diag(cov).copy()
+
             if isinstance(self._metric, str) and self._metric == 'diag':
                 self._metric = np.ones(self.input_size)
             elif isinstance(self._metric, str) and self._metric == 'full':
                 self._metric = np.eye(self.input_size)
+            elif isinstance(self._metric, str) and self._metric == 'lowrank':
+                pass
             elif isinstance(self._metric, np.ndarray):
                 pass
             else:
@@ -437,7 +617,19 @@ class _HTrace(SampleTrace):
             if self._initial_mean is None:
                 self._initial_mean = self.x_0.copy()
 
-            if self._metric.ndim == 1 and self._adapt_metric:
+            if isinstance(self._metric, str):
+                self._metric = QuadMetricLowRankAdapt(
+                    self.input_size, self._initial_mean, lowrank_var,
+                    self._initial_weight, self._adapt_window,
+                    self._update_window, self._doubling, self._max_rank)
+                if (self._tuned is not None and
+                    str(self._tuned['metric']) == 'lowrank'):
+                    lam = self._tuned['lam'][self._i_tuned]
+                    i_keep = np.flatnonzero(lam != 1.)[:self._max_rank]
+                    self._metric._u = self._tuned['u'][self._i_tuned][
+                        :, i_keep].copy()
+                    self._metric._lam = lam[i_keep].copy()
+            elif self._metric.ndim == 1 and self._adapt_metric:
                 self._metric = QuadMetricDiagAdapt(
                     self.input_size, self._initial_mean, self._metric,
                     self._initial_weight, self._adapt_window,
@@ -446,7 +638,7 @@ class _HTrace(SampleTrace):
                 self._metric = QuadMetricFullAdapt(
                     self.input_size, self._initial_mean, self._metric,
                     self._initial_weight, self._adapt_window,
-                    self._update_window, self._doubling)
+                    self._update_window, self._doubling, self._rank_one_update)
             elif self._metric.ndim == 1 and not self._adapt_metric:
                 self._metric = QuadMetricDiag(self._metric)
             elif self._metric.ndim == 2 and not self._adapt_metric:
@@ -462,11 +654,14 @@ class HTrace(_HTrace):
                  adapt_step_size=True, metric='diag', adapt_metric=True,
                  max_change=1000., target_accept=0.8, gamma=0.05, k=0.75,
                  t_0=10., initial_mean=None, initial_weight=10.,
-                 adapt_window=60, update_window=1, doubling=True):
+                 adapt_window=60, update_window=1, doubling=True,
+                 storage=None, rank_one_update=False, max_rank=10,
+                 tuned=None, rng_buffer=0):
         super().__init__(n_chain, n_iter, n_warmup, x_0, random_generator,
                          step_size, adapt_step_size, metric, adapt_metric,
                          max_change, target_accept, gamma, k, t_0, initial_mean,
-                         initial_weight, adapt_window, update_window, doubling)
+                         initial_weight, adapt_window, update_window, doubling,
+                         storage, rank_one_update, max_rank, tuned, rng_buffer)
         self.n_int_step = n_int_step
         self._stats = HStats()
 
@@ -497,18 +692,33 @@ class HTrace(_HTrace):
 
 
 class NTrace(_HTrace):
-    """Trace class for the NUTS sampler."""
+    """
+    Trace class for the NUTS sampler.
+
+    If `speculative` is `True`, while the tree is extended in one direction, a
+    background thread will expand the trajectory at the other end, which is
+    used if the next extension goes in that direction, and discarded
+    otherwise. This does not change the samples, but reduces the latency of
+    each iteration if the density releases the GIL (e.g. numpy or external
+    codes) and there are spare cores. The discarded evaluations are included
+    in `n_call`, approximately.
+    """
     def __init__(self, n_chain=4, n_iter=1500, n_warmup=500, x_0=None,
                  random_generator=None, step_size=1., adapt_step_size=True,
                  metric='diag', adapt_metric=True, max_change=1000.,
                  max_treedepth=10, target_accept=0.8, gamma=0.05, k=0.75,
                  t_0=10., initial_mean=None, initial_weight=10.,
-                 adapt_window=60, update_window=1, doubling=True):
+                 adapt_window=60, update_window=1, doubling=True,
+                 storage=None, rank_one_update=False, max_rank=10,
+                 tuned=None, speculative=False, rng_buffer=0):
         super().__init__(n_chain, n_iter, n_warmup, x_0, random_generator,
                          step_size, adapt_step_size, metric, adapt_metric,
                          max_change, target_accept, gamma, k, t_0, initial_mean,
-                         initial_weight, adapt_window, update_window, doubling)
+                         initial_weight, adapt_window, update_window, doubling,
+                         storage, rank_one_update, max_rank, tuned, rng_buffer)
         self.max_treedepth = max_treedepth
+        self.speculative = speculative
+        self._n_speculative = 0
         self._stats = NStats()
 
     @property
@@ -525,9 +735,18 @@ class NTrace(_HTrace):
                              'of {}.'.format(mt))
         self._max_treedepth = mt
 
+    @property
+    def speculative(self):
+        return self._speculative
+
+    @speculative.setter
+    def speculative(self, s):
+        self._speculative = bool(s)
+
     @property
     def n_call(self):
-        return sum(self._stats._tree_size[1:]) + self.n_iter + 1
+        return (int(np.sum(self._stats._tree_size[1:])) + self.n_iter + 1 +
+                self._n_speculative)
         """
         Here we add n_iter because at the beginning of each iteration, 
         We recompute logp_and_grad at the starting point.
@@ -568,11 +787,11 @@ class _TTrace:
 
     @property
     def u(self):
-        return np.array(self.stats._u)
+        return self.stats._readonly('u')
 
     @property
     def weights(self):
-        return np.array(self.stats._weights)
+        return self.stats._readonly('weight')
 
     _all_return = ['samples', 'u', 'weights', 'logp']
 
@@ -595,13 +814,16 @@ class THTrace(_TTrace, HTrace):
                  adapt_metric=True, max_change=1000., target_accept=0.8,
                  gamma=0.05, k=0.75, t_0=10., initial_mean=None,
                  initial_weight=10., adapt_window=60, update_window=1,
-                 doubling=True):
+                 doubling=True, storage=None, rank_one_update=False,
+                 max_rank=10, tuned=None, rng_buffer=0):
         _TTrace.__init__(self, density_base, logxi)
-        HTrace.__init__(n_chain, n_iter, n_warmup, n_int_step, x_0,
+        HTrace.__init__(self, n_chain, n_iter, n_warmup, n_int_step, x_0,
                         random_generator, step_size, adapt_step_size, metric,
                         adapt_metric, max_change, target_accept, gamma, k, t_0,
                         initial_mean, initial_weight, adapt_window,
-                        update_window, doubling)
+                        update_window, doubling, storage, rank_one_update,
+                        max_rank, tuned, rng_buffer)
+        self._stats = THStats()
 
 
 class TNTrace(_TTrace, NTrace):
@@ -612,20 +834,532 @@ class TNTrace(_TTrace, NTrace):
                  max_change=1000., max_treedepth=10, target_accept=0.8,
                  gamma=0.05, k=0.75, t_0=10., initial_mean=None,
                  initial_weight=10., adapt_window=60, update_window=1,
-                 doubling=True):
+                 doubling=True, storage=None, rank_one_update=False,
+                 max_rank=10, tuned=None, speculative=False, rng_buffer=0):
         _TTrace.__init__(self, density_base, logxi)
         NTrace.__init__(self, n_chain, n_iter, n_warmup, x_0, random_generator,
                         step_size, adapt_step_size, metric, adapt_metric,
                         max_change, max_treedepth, target_accept, gamma, k, t_0,
                         initial_mean, initial_weight, adapt_window,
-                        update_window, doubling)
+                        update_window, doubling, storage, rank_one_update,
+                        max_rank, tuned, speculative, rng_buffer)
         self._stats = TNStats()
 
 
 class ETrace(SampleTrace):
-    """Trace class for the ensemble sampler from emcee."""
-    def __init__(*args, **kwargs):
-        raise NotImplementedError
+    """
+    Trace class for the affine-invariant ensemble sampler.
+
+    Parameters
+    ----------
+    n_chain : int, optional
+        The number of walkers in the ensemble, which should be no smaller than
+        4. Set to `32` by default.
+    n_iter : positive int, optional
+        The total number of iterations. Set to `3000` by default.
+    n_warmup : positive int, optional
+        The number of burn-in iterations, which are discarded by `get` by
+        default. Set to `1000` by default.
+    x_0 : None or array_like, optional
+        The starting points. If the number of points is not `n_chain`, the
+        walkers will be initialized around randomly chosen points in `x_0`.
+    random_generator : None or np.random.Generator, optional
+        The random number generator. If `None`, will use the global generator.
+    moves : str or dict, optional
+        The proposal moves, `'stretch'`, `'de'` (differential evolution), or
+        a dict like `{'stretch': 0.8, 'de': 0.2}` giving the probability to use
+        each move in an iteration. Set to `'stretch'` by default.
+    a : float, optional
+        The scale parameter of the stretch move, larger than 1. Set to `2.` by
+        default.
+    gamma : None or positive float, optional
+        The scale of the differential evolution move. If `None`, will use
+        `2.38 / (2 * input_size)**0.5`. Set to `None` by default.
+    use_map : bool, optional
+        If `True`, the proposals of each half-ensemble will be evaluated with
+        one `ParallelBackend.map`. Otherwise, they will be evaluated with one
+        vectorized call of `density.logp`. Set to `False` by default.
+    storage : None, str, dict, MemoryStorage or MemmapStorage, optional
+        Where to store the walkers. Set to `None` by default.
+
+    Notes
+    -----
+    The walkers of each iteration are stored together, so `samples` and `logp`
+    have shapes `(i_iter, n_chain, input_size)` and `(i_iter, n_chain)`, while
+    `get` returns the same shapes as `TraceTuple.get`, i.e., with the walkers
+    as the first axis if `flatten` is `False`.
+    """
+    def __init__(self, n_chain=32, n_iter=3000, n_warmup=1000, x_0=None,
+                 random_generator=None, moves='stretch', a=2., gamma=None,
+                 use_map=False, storage=None):
+        super().__init__(n_chain, n_iter, n_warmup, x_0, random_generator)
+        if self.n_chain < 4:
+            raise ValueError('n_chain (the number of walkers) should be no '
+                             'smaller than 4 for ETrace.')
+        self.storage = storage
+        self._samples_buffer = ArrayBuffer(dtype=np.float)
+        self._logp_buffer = ArrayBuffer(dtype=np.float)
+        self._accepted_buffer = ArrayBuffer(dtype=np.bool_)
+        self._chain_id = None
+        self.moves = moves
+        self.a = a
+        self.gamma = gamma
+        self.use_map = use_map
+
+    @property
+    def chain_id(self):
+        return self._chain_id
+
+    def _init_chain(self, i=0):
+        if self._x_0 is None:
+            raise RuntimeError('no valid x_0 is given.')
+        self._chain_id = int(i)
+        self.random_generator = spawn_generator(self.random_generator, 1)[0]
+        x_0 = self._x_0.reshape((-1, self._x_0.shape[-1]))
+        if x_0.shape[0] != self.n_chain:
+            # a small ball around the randomly chosen points
+            x_0 = x_0[self.random_generator.integers(0, x_0.shape[0],
+                                                     self.n_chain)]
+            x_0 = x_0 + 1e-3 * self.random_generator.normal(size=x_0.shape)
+        self._x_0 = x_0
+        self._samples_buffer = self.storage.buffer('ensemble-samples',
+                                                   self.n_iter, np.float)
+        self._logp_buffer = self.storage.buffer('ensemble-logp', self.n_iter,
+                                                np.float)
+        self._accepted_buffer = self.storage.buffer('ensemble-accepted',
+                                                    self.n_iter, np.bool_)
+        self._chain_initialized = True
+
+    @property
+    def storage(self):
+        return self._storage
+
+    @storage.setter
+    def storage(self, s):
+        if self._chain_initialized:
+            raise RuntimeError('you should not change storage once the chain '
+                               'is initialized.')
+        self._storage = get_storage(s)
+
+    @property
+    def moves(self):
+        return self._moves
+
+    @moves.setter
+    def moves(self, m):
+        if m == 'stretch' or m == 'de':
+            m = {m: 1.}
+        try:
+            m = {str(k): float(v) for k, v in m.items()}
+            assert len(m) > 0
+            assert all(k == 'stretch' or k == 'de' for k in m)
+            assert all(v >= 0 for v in m.values())
+            total = sum(m.values())
+            assert total > 0
+        except Exception:
+            raise ValueError('moves should be "stretch", "de", or a dict of '
+                             'their probabilities.')
+        self._moves = {k: v / total for k, v in m.items()}
+
+    @property
+    def a(self):
+        return self._a
+
+    @a.setter
+    def a(self, a):
+        try:
+            a = float(a)
+            assert a > 1.
+        except Exception:
+            raise ValueError('a should be a float larger than 1.')
+        self._a = a
+
+    @property
+    def gamma(self):
+        return self._gamma
+
+    @gamma.setter
+    def gamma(self, g):
+        if g is not None:
+            try:
+                g = float(g)
+                assert g > 0.
+            except Exception:
+                raise ValueError('gamma should be a positive float or None.')
+        self._gamma = g
+
+    @property
+    def use_map(self):
+        return self._use_map
+
+    @use_map.setter
+    def use_map(self, um):
+        self._use_map = bool(um)
+
+    @property
+    def samples(self):
+        return self._samples_buffer.readonly_view
+
+    @property
+    def logp(self):
+        return self._logp_buffer.readonly_view
+
+    @property
+    def accepted(self):
+        return self._accepted_buffer.readonly_view
+
+    @property
+    def acceptance_fraction(self):
+        """The acceptance fraction of each walker after warmup."""
+        return np.mean(self.accepted[self.n_warmup:], axis=0)
+
+    @property
+    def samples_original(self):
+        return self._samples_original_buffer.readonly_view
+
+    @property
+    def logp_original(self):
+        return self._logp_original_buffer.readonly_view
+
+    @property
+    def i_iter(self):
+        try:
+            return len(self._samples_buffer)
+        except Exception:
+            return 0
+
+    @property
+    def finished(self):
+        return self.i_iter >= self.n_iter
+
+    @property
+    def n_call(self):
+        return self.n_chain * (self.i_iter + 1)
+
+    def update(self, points, logp, accepted):
+        if self._samples_buffer.size < self.n_iter:
+            self._samples_buffer.size = self.n_iter
+            self._logp_buffer.size = self.n_iter
+            self._accepted_buffer.size = self.n_iter
+        self._samples_buffer.append(points)
+        self._logp_buffer.append(logp)
+        self._accepted_buffer.append(accepted)
+
+    def _truncate(self, n_iter):
+        """Discard all the iterations after the first n_iter ones."""
+        if not self.n_warmup < n_iter <= self.i_iter:
+            raise ValueError('n_iter should satisfy n_warmup < n_iter <= '
+                             'i_iter.')
+        for b in (self._samples_buffer, self._logp_buffer,
+                  self._accepted_buffer):
+            b.truncate(n_iter)
+        if hasattr(self, '_samples_original_buffer'):
+            self._samples_original_buffer.truncate(n_iter)
+            self._logp_original_buffer.truncate(n_iter)
+        self._n_iter = n_iter
+
+    def _set_original(self, density, chunk_size=10000):
+        """Transform the walkers and logp to the original space in chunks."""
+        if not hasattr(self, '_samples_original_buffer'):
+            self._samples_original_buffer = self.storage.buffer(
+                'ensemble-samples_original', self.i_iter, np.float)
+            self._logp_original_buffer = self.storage.buffer(
+                'ensemble-logp_original', self.i_iter, np.float)
+        self._samples_original_buffer.truncate(0)
+        self._logp_original_buffer.truncate(0)
+        chunk_size = max(chunk_size // self.n_chain, 1)
+        for i in range(0, self.i_iter, chunk_size):
+            x = self.samples[i:(i + chunk_size)]
+            x_flat = x.reshape((-1, x.shape[-1]))
+            self._samples_original_buffer.extend(
+                density.to_original(x_flat).reshape(x.shape))
+            self._logp_original_buffer.extend(density.to_original_density(
+                self.logp[i:(i + chunk_size)].reshape(-1),
+                x_trans=x_flat).reshape(x.shape[:-1]))
+
+    _all_return = ['samples', 'logp']
+
+    def get(self, since_iter=None, include_warmup=False, original_space=True,
+            return_type='samples', flatten=True):
+        if return_type == 'all':
+            return [self.get(since_iter, include_warmup, original_space, _,
+                    flatten) for _ in self._all_return]
+        if since_iter is None:
+            since_iter = 0 if include_warmup else self.n_warmup
+        else:
+            try:
+                since_iter = int(since_iter)
+            except Exception:
+                raise ValueError('invalid value for since_iter.')
+        if since_iter >= self.i_iter - 1:
+            raise ValueError('since_iter is too large. Nothing to return.')
+        if return_type == 'samples':
+            x = self.samples_original if original_space else self.samples
+        elif return_type == 'logp':
+            x = self.logp_original if original_space else self.logp
+        else:
+            raise ValueError('invalid value for return_type.')
+        x = np.swapaxes(x[since_iter:], 0, 1)
+        if flatten:
+            return x.reshape((-1,) + x.shape[2:])
+        else:
+            return x
+
+    __call__ = get
+
+
+class STrace(SampleTrace):
+    """
+    Trace class for the sequential Monte Carlo sampler.
+
+    Parameters
+    ----------
+    n_chain : int, optional
+        The number of particles, which should be no smaller than 4. Set to
+        `1000` by default.
+    n_iter : positive int, optional
+        The maximum number of generations, i.e. tempering steps. Set to `100`
+        by default.
+    x_0 : None or array_like, optional
+        Only used to define the reference distribution if `reference` is
+        `None`, see below.
+    random_generator : None or np.random.Generator, optional
+        The random number generator. If `None`, will use the global generator.
+    reference : None, LaplaceResult, SIT or dict, optional
+        The distribution to temper from, in the transformed space. Can be the
+        result of `Laplace.run`, a fitted `SIT`, or a dict with the keys
+        `'mean'` and `'cov'` of a Gaussian. If `None`, will use a Gaussian with
+        the mean and covariance of `x_0`, or with unit covariance if there
+        are too few points in `x_0`. Set to `None` by default.
+    ess_target : float, optional
+        The next inverse temperature is chosen such that the effective sample
+        size of the incremental weights is `ess_target * n_chain`. Should be
+        between 0 and 1. Set to `0.5` by default.
+    n_mcmc : positive int, optional
+        The number of random walk Metropolis steps to move the particles after
+        each resampling. Set to `5` by default.
+    proposal_scale : None or positive float, optional
+        The initial scale of the random walk proposal, relative to the
+        covariance of the particles, which will be adapted towards an
+        acceptance rate of about `0.25`. If `None`, will use
+        `2.38 / input_size**0.5`. Set to `None` by default.
+
+    Notes
+    -----
+    Only the latest generation of the particles is stored, so `get` returns
+    the final particles, with shape `(n_chain, input_size)` or
+    `(n_chain, 1, input_size)` depending on `flatten`, i.e., each particle is
+    treated as a chain with one sample, similar to `ETrace`. The tempering
+    schedule and the evidence estimate are stored in `betas`, `logz` and
+    `logz_err`.
+    """
+    def __init__(self, n_chain=1000, n_iter=100, x_0=None,
+                 random_generator=None, reference=None, ess_target=0.5,
+                 n_mcmc=5, proposal_scale=None):
+        self._chain_id = None
+        self._particles = None
+        self._logp = None
+        self._logq = None
+        self._betas = [0.]
+        self._logz_incs = []
+        self._logz_vars = []
+        self._ess = []
+        self._acceptance = []
+        self._n_call = 0
+        super().__init__(n_chain, n_iter, 0, x_0, random_generator)
+        if self.n_chain < 4:
+            raise ValueError('n_chain (the number of particles) should be no '
+                             'smaller than 4 for STrace.')
+        self.reference = reference
+        self.ess_target = ess_target
+        self.n_mcmc = n_mcmc
+        self.proposal_scale = proposal_scale
+
+    @property
+    def chain_id(self):
+        return self._chain_id
+
+    def _init_chain(self, i=0):
+        if self._x_0 is None and self._reference is None:
+            raise RuntimeError('neither x_0 nor reference is given.')
+        self._chain_id = int(i)
+        self.random_generator = spawn_generator(self.random_generator, 1)[0]
+        self._chain_initialized = True
+
+    @property
+    def reference(self):
+        return self._reference
+
+    @reference.setter
+    def reference(self, ref):
+        if self._chain_initialized:
+            raise RuntimeError('you should not change reference once the '
+                               'chain is initialized.')
+        if isinstance(ref, dict):
+            try:
+                ref = {'mean': np.asarray(ref['mean'], dtype=np.float),
+                       'cov': np.asarray(ref['cov'], dtype=np.float)}
+                assert ref['mean'].ndim == 1
+                assert ref['cov'].shape == 2 * ref['mean'].shape
+            except Exception:
+                raise ValueError('invalid value for reference.')
+        elif ref is None or hasattr(ref, 'logq') or (
+            hasattr(ref, 'x_max') and hasattr(ref, 'cov')):
+            pass
+        else:
+            raise ValueError('invalid value for reference.')
+        self._reference = ref
+
+    @property
+    def ess_target(self):
+        return self._ess_target
+
+    @ess_target.setter
+    def ess_target(self, et):
+        try:
+            et = float(et)
+            assert 0. < et < 1.
+        except Exception:
+            raise ValueError('ess_target should be a float between 0 and 1.')
+        self._ess_target = et
+
+    @property
+    def n_mcmc(self):
+        return self._n_mcmc
+
+    @n_mcmc.setter
+    def n_mcmc(self, nm):
+        try:
+            nm = int(nm)
+            assert nm > 0
+        except Exception:
+            raise ValueError('n_mcmc should be a positive int.')
+        self._n_mcmc = nm
+
+    @property
+    def proposal_scale(self):
+        return self._proposal_scale
+
+    @proposal_scale.setter
+    def proposal_scale(self, ps):
+        if ps is not None:
+            try:
+                ps = float(ps)
+                assert ps > 0.
+            except Exception:
+                raise ValueError('proposal_scale should be a positive float '
+                                 'or None.')
+        self._proposal_scale = ps
+
+    @property
+    def input_size(self):
+        if self._particles is not None:
+            return self._particles.shape[-1]
+        return super().input_size
+
+    @property
+    def samples(self):
+        return self._particles
+
+    @property
+    def logp(self):
+        return self._logp
+
+    @property
+    def logq(self):
+        """The logp of the final particles under the reference."""
+        return self._logq
+
+    @property
+    def samples_original(self):
+        return self._samples_original
+
+    @property
+    def logp_original(self):
+        return self._logp_original
+
+    @property
+    def betas(self):
+        """The tempering schedule, starting from 0."""
+        return np.array(self._betas)
+
+    @property
+    def ess(self):
+        """The relative ESS of the incremental weights in each generation."""
+        return np.array(self._ess)
+
+    @property
+    def acceptance(self):
+        """The mean acceptance rate of the moves in each generation."""
+        return np.array(self._acceptance)
+
+    @property
+    def logz(self):
+        """The log evidence estimated from the incremental weights."""
+        return float(np.sum(self._logz_incs)) if self.finished else None
+
+    @property
+    def logz_err(self):
+        """
+        The delta-method estimate of the standard error of `logz`, which
+        ignores the correlations introduced by resampling, so it tends to
+        underestimate the actual error.
+        """
+        return float(np.sum(self._logz_vars)**0.5) if self.finished else None
+
+    @property
+    def i_iter(self):
+        return len(self._betas) - 1
+
+    @property
+    def finished(self):
+        return self._betas[-1] == 1.
+
+    @property
+    def n_call(self):
+        return self._n_call
+
+    def update(self, beta, particles, logp, logq, logz_inc, logz_var, ess,
+               acceptance):
+        self._betas.append(beta)
+        self._particles = particles
+        self._logp = logp
+        self._logq = logq
+        self._logz_incs.append(logz_inc)
+        self._logz_vars.append(logz_var)
+        self._ess.append(ess)
+        self._acceptance.append(acceptance)
+
+    def _set_original(self, density):
+        self._samples_original = density.to_original(self.samples)
+        self._logp_original = density.to_original_density(
+            self.logp, x_trans=self.samples)
+
+    _all_return = ['samples', 'logp']
+
+    def get(self, since_iter=None, include_warmup=False, original_space=True,
+            return_type='samples', flatten=True):
+        """
+        Get the final particles. `since_iter` and `include_warmup` are only
+        accepted for compatibility with the other traces.
+        """
+        if return_type == 'all':
+            return [self.get(since_iter, include_warmup, original_space, _,
+                    flatten) for _ in self._all_return]
+        if not self.finished:
+            raise RuntimeError('the particles have not reached beta = 1 yet.')
+        if return_type == 'samples':
+            x = self.samples_original if original_space else self.samples
+        elif return_type == 'logp':
+            x = self.logp_original if original_space else self.logp
+        else:
+            raise ValueError('invalid value for return_type.')
+        if flatten:
+            return x.copy()
+        else:
+            return x[:, np.newaxis].copy()
+
+    __call__ = get
 
 
 class TraceTuple:
@@ -655,6 +1389,10 @@ class TraceTuple:
     def sample_traces(self):
         return self._sample_traces
 
+    def save_tuned(self, filename):
+        """Save the tuned states of all the chains to a `.npz` file."""
+        _save_tuned(self.sample_traces, filename)
+
     @property
     def sampler(self):
         return self._sampler
@@ -739,7 +1477,7 @@ class TraceTuple:
 
     @property
     def input_size(self):
-        return self.samples.shape[-1]
+        return self.sample_traces[0].samples.shape[-1]
 
     @property
     def finished(self):
@@ -764,27 +1502,22 @@ class TraceTuple:
         if return_type == 'all':
             return [self.get(since_iter, include_warmup, original_space, _,
                     flatten) for _ in self._all_return]
-        tget = [t.get(since_iter, include_warmup, original_space, return_type)
-                for t in self.sample_traces]
-        if return_type == 'samples':
-            samples = np.asarray(tget)
-            if flatten:
-                samples = samples.reshape((-1, self.input_size))
-            return samples
-        elif return_type == 'logp':
-            logp = np.asarray(tget)
-            if flatten:
-                logp = logp.flatten()
-            return logp
-        elif return_type == 'u' or return_type == 'weights':
+        if return_type == 'u' or return_type == 'weights':
             if not (self.sampler == 'TNUTS' or self.sampler == 'THMC'):
                 raise RuntimeError('invalid value for return_type.')
-            res = np.asarray(tget)
-            if flatten:
-                res = res.flatten()
-            return res
-        else:
+        elif not (return_type == 'samples' or return_type == 'logp'):
             raise ValueError('invalid value for return_type.')
+        tget = [t.get(since_iter, include_warmup, original_space, return_type)
+                for t in self.sample_traces]
+        if any(tg.shape != tget[0].shape for tg in tget):
+            raise RuntimeError('the chains have different shapes for {}, '
+                               'presumably because they have run for '
+                               'different lengths.'.format(return_type))
+        # each chain is copied only once into the output array
+        if flatten:
+            return np.concatenate(tget, axis=0)
+        else:
+            return np.stack(tget, axis=0)
 
     __call__ = get
 
@@ -819,7 +1552,7 @@ def _get_step_size(sample_trace):
 
 def _get_metric(sample_trace, target, from_samples=True):
     if from_samples:
-        if isinstance(sample_trace, (_HTrace, TraceTuple)):
+        if isinstance(sample_trace, (_HTrace, ETrace, TraceTuple)):
             samples = sample_trace.get(original_space=False, flatten=True)
             cov = np.cov(samples, rowvar=False)
         else:
@@ -831,6 +1564,8 @@ def _get_metric(sample_trace, target, from_samples=True):
                 cov = np.diag(metric._var)
             elif isinstance(metric, QuadMetricFull):
                 cov = np.copy(metric._cov)
+            elif isinstance(metric, QuadMetricLowRankAdapt):
+                cov = metric._covariance()
             else:
                 raise RuntimeError('sample_trace.metric is not a QuadMetric.')
         elif isinstance(sample_trace, TraceTuple):
@@ -845,3 +1580,99 @@ def _get_metric(sample_trace, target, from_samples=True):
         return cov
     else:
         raise ValueError('unexpected value for target.')
+
+
+_tuned_step_items = ('log_step', 'log_bar', 'hbar', 'mu', 'count')
+
+
+def _tuned_state(sample_trace):
+    """Collect the tuned state of one chain as a dict of arrays."""
+    t = sample_trace
+    if not isinstance(t, _HTrace) or not t.chain_initialized:
+        raise ValueError('sample_trace should be an initialized NTrace or '
+                         'HTrace.')
+    state = t.step_size._get_tuned()
+    state['x'] = np.copy(t._samples[-1] if t.i_iter > 0 else t.x_0)
+    metric = t.metric
+    if isinstance(metric, (QuadMetricDiagAdapt, QuadMetricLowRankAdapt)):
+        state['mean'] = metric._foreground_var.current_mean()
+    elif isinstance(metric, QuadMetricFullAdapt):
+        state['mean'] = metric._foreground_cov.current_mean()
+    else:
+        state['mean'] = (np.mean(t._samples, axis=0) if t.i_iter > 0 else
+                         np.copy(t.x_0))
+    if isinstance(metric, QuadMetricDiag):
+        state['metric'] = 'diag'
+        state['var'] = np.copy(metric._var)
+    elif isinstance(metric, QuadMetricFull):
+        state['metric'] = 'full'
+        state['var'] = np.diag(metric._cov).copy()
+        state['cov'] = np.copy(metric._cov)
+    elif isinstance(metric, QuadMetricLowRankAdapt):
+        state['metric'] = 'lowrank'
+        state['var'] = np.copy(metric._var)
+        state['u'] = np.copy(metric._u)
+        state['lam'] = np.copy(metric._lam)
+    else:
+        raise RuntimeError('sample_trace.metric is not a QuadMetric.')
+    return state
+
+
+def _save_tuned(sample_traces, filename):
+    states = [_tuned_state(t) for t in sample_traces]
+    kinds = set(s['metric'] for s in states)
+    if len(kinds) > 1:
+        raise RuntimeError('all the chains should use the same kind of '
+                           'metric.')
+    tuned = {'metric': np.array(kinds.pop())}
+    for key in ('x', 'mean', 'var', 'cov') + _tuned_step_items:
+        if key in states[0]:
+            tuned[key] = np.array([s[key] for s in states])
+    if tuned['metric'] == 'lowrank':
+        # pad with lam = 1, which does not change the metric
+        rank = max(s['lam'].shape[0] for s in states)
+        dim = tuned['x'].shape[-1]
+        tuned['u'] = np.zeros((len(states), dim, rank))
+        tuned['lam'] = np.ones((len(states), rank))
+        for i, s in enumerate(states):
+            r = s['lam'].shape[0]
+            tuned['u'][i, :, :r] = s['u']
+            tuned['lam'][i, :r] = s['lam']
+    np.savez(filename, **tuned)
+
+
+def _load_tuned(tuned):
+    if tuned is None:
+        return None
+    try:
+        if isinstance(tuned, (str, os.PathLike)):
+            with np.load(tuned) as f:
+                tuned = dict(f)
+        tuned = {k: np.asarray(v) for k, v in tuned.items()}
+        kind = str(tuned['metric'])
+        keys = ['x', 'mean', 'var'] + list(_tuned_step_items)
+        if kind == 'full':
+            keys.append('cov')
+        elif kind == 'lowrank':
+            keys += ['u', 'lam']
+        else:
+            assert kind == 'diag'
+        assert tuned['x'].ndim == 2
+        assert all(tuned[k].shape[0] == tuned['x'].shape[0] for k in keys)
+    except Exception:
+        raise ValueError('invalid value for tuned.')
+    return tuned
+
+
+def _tuned_cov(tuned, i):
+    """The dense covariance of the i-th saved metric."""
+    kind = str(tuned['metric'])
+    if kind == 'diag':
+        return np.diag(tuned['var'][i])
+    elif kind == 'full':
+        return tuned['cov'][i].copy()
+    else:
+        std = tuned['var'][i]**0.5
+        u, lam = tuned['u'][i], tuned['lam'][i]
+        cov = np.eye(std.shape[0]) + (u * (lam - 1.)) @ u.T
+        return std[:, None] * cov * std
@@ -0,0 +1,225 @@
+import numpy as np
+from scipy.linalg import cholesky, solve_triangular
+from scipy.special import logsumexp
+from .sample_trace import STrace
+import warnings
+import time
+
+__all__ = ['SMC']
+
+# References: Del Moral et al. 2006, https://doi.org/10.1111/j.1467-9868.2006.00553.x
+#             Jasra et al. 2011, https://doi.org/10.1111/j.1467-9469.2010.00723.x
+#             https://github.com/pymc-devs/pymc/blob/main/pymc/smc
+
+
+def _systematic_resample(weights, random_generator):
+    """Systematic resampling, returning the indices of the new particles."""
+    n = weights.shape[0]
+    u = (random_generator.random() + np.arange(n)) / n
+    cdf = np.cumsum(weights)
+    cdf /= cdf[-1]
+    return np.minimum(np.searchsorted(cdf, u), n - 1)
+
+
+def _relative_ess(log_w):
+    w = np.exp(log_w - np.max(log_w))
+    return np.sum(w)**2 / np.sum(w**2) / w.shape[0]
+
+
+class _Gaussian:
+    """Gaussian reference distribution."""
+    def __init__(self, mean, cov):
+        self._mean = np.asarray(mean, dtype=np.float)
+        self._chol = cholesky(np.asarray(cov, dtype=np.float), lower=True)
+        self._log_norm = (-0.5 * self._mean.shape[0] * np.log(2 * np.pi) -
+                          np.sum(np.log(np.diag(self._chol))))
+
+    def sample(self, n, random_generator):
+        z = random_generator.normal(size=(n, self._mean.shape[0]))
+        return self._mean + z @ self._chol.T
+
+    def logq(self, x):
+        z = solve_triangular(self._chol, (x - self._mean).T, lower=True)
+        return self._log_norm - 0.5 * np.sum(z**2, axis=0)
+
+
+class _SITReference:
+    """Fitted SIT as the reference distribution."""
+    def __init__(self, sit):
+        self._sit = sit
+
+    def sample(self, n, random_generator):
+        # SIT.sample uses its own mvn_generator, so we draw the latent normal
+        # samples here to make them controlled by the SampleTrace
+        y = random_generator.normal(size=(n, self._sit.dim))
+        return self._sit.backward_transform(y)[0]
+
+    def logq(self, x):
+        return self._sit.logq(x)
+
+
+class SMC:
+    """
+    Sequential Monte Carlo sampler tempering from a reference distribution.
+
+    Parameters
+    ----------
+    logp : callable
+        Callable returning the logp of an array of points with shape
+        `(m, input_size)`, as a 1-d array with shape `(m,)`. All the particles
+        of each generation are evaluated with a single call.
+    sample_trace : STrace
+        The trace to store the particles.
+
+    Notes
+    -----
+    The particles are first drawn from the reference distribution `q`, and
+    then moved through a sequence of intermediate distributions
+    `q**(1 - beta) * p**beta`. In each generation, the next `beta` is chosen
+    by bisection such that the effective sample size of the incremental
+    weights is `ess_target * n_chain`, and then the particles are
+    systematically resampled, and moved by `n_mcmc` random walk Metropolis
+    steps, whose covariance is estimated from the particles. No gradient is
+    needed. The evidence is estimated from the incremental weights as a
+    by-product.
+    """
+    def __init__(self, logp, sample_trace):
+        if not callable(logp):
+            raise ValueError('logp should be callable.')
+        self._logp = logp
+        if isinstance(sample_trace, STrace):
+            self._sample_trace = sample_trace
+        else:
+            raise ValueError('invalid type for sample_trace.')
+        self._prefix = ' SMC : '
+
+    @property
+    def sample_trace(self):
+        return self._sample_trace
+
+    def _batch_logp(self, x):
+        logp = np.asarray(self._logp(x), dtype=np.float).reshape(-1)
+        if logp.shape != (x.shape[0],):
+            raise RuntimeError('logp should return an array with shape '
+                               '({},).'.format(x.shape[0]))
+        self._sample_trace._n_call += x.shape[0]
+        return np.where(np.isfinite(logp), logp, -np.inf)
+
+    def _get_reference(self):
+        ref = self._sample_trace.reference
+        if ref is None:
+            x_0 = self._sample_trace.x_0
+            x_0 = x_0.reshape((-1, x_0.shape[-1]))
+            if x_0.shape[0] > x_0.shape[1] + 1:
+                return _Gaussian(np.mean(x_0, axis=0), np.cov(x_0.T))
+            else:
+                return _Gaussian(np.mean(x_0, axis=0), np.eye(x_0.shape[1]))
+        elif isinstance(ref, dict):
+            return _Gaussian(ref['mean'], ref['cov'])
+        elif hasattr(ref, 'logq'):
+            return _SITReference(ref)
+        else:
+            return _Gaussian(ref.x_max, ref.cov)
+
+    def _next_beta(self, beta, delta):
+        """Find the next beta such that the relative ESS is ess_target."""
+        ess_target = self._sample_trace.ess_target
+        if _relative_ess((1. - beta) * delta) >= ess_target:
+            return 1.
+        a, b = beta, 1.
+        for _ in range(50):
+            c = 0.5 * (a + b)
+            if _relative_ess((c - beta) * delta) >= ess_target:
+                a = c
+            else:
+                b = c
+        return max(a, beta + 1e-10)
+
+    def _mutate(self, x, logp, logq, beta, reference):
+        """Move the particles with random walk Metropolis."""
+        t = self._sample_trace
+        rg = t.random_generator
+        n, dim = x.shape
+        cov = np.atleast_2d(np.cov(x.T)) + 1e-10 * np.eye(dim)
+        try:
+            chol = cholesky(cov, lower=True)
+        except Exception:
+            chol = np.diag(np.diag(cov)**0.5)
+        n_accepted = 0
+        for _ in range(t.n_mcmc):
+            y = x + t._scale * rg.normal(size=(n, dim)) @ chol.T
+            logp_y = self._batch_logp(y)
+            logq_y = reference.logq(y)
+            log_ratio = (beta * (logp_y - logp) +
+                         (1. - beta) * (logq_y - logq))
+            acc = np.log(rg.random(n)) < log_ratio
+            x[acc] = y[acc]
+            logp[acc] = logp_y[acc]
+            logq[acc] = logq_y[acc]
+            acc_rate = np.mean(acc)
+            t._scale *= np.exp(acc_rate - 0.25)
+            n_accepted += np.sum(acc)
+        return n_accepted / (n * t.n_mcmc)
+
+    def run(self, n_run=None, verbose=True):
+        t = self._sample_trace
+        if t.finished:
+            return t
+        if n_run is not None:
+            try:
+                n_run = int(n_run)
+                assert n_run > 0
+            except Exception:
+                raise ValueError(self._prefix + 'invalid value for n_run.')
+            if n_run > t.n_iter - t.i_iter:
+                t.n_iter = t.i_iter + n_run
+        rg = t.random_generator
+        reference = self._get_reference()
+        if t.i_iter > 0:
+            x = t.samples.copy()
+            logp = t.logp.copy()
+            logq = t.logq.copy()
+        else:
+            x = reference.sample(t.n_chain, rg)
+            logq = reference.logq(x)
+            logp = self._batch_logp(x)
+            if not np.any(np.isfinite(logp)):
+                raise ValueError('failed to get finite logp for the particles '
+                                 'drawn from the reference.')
+            if t.proposal_scale is None:
+                t._scale = 2.38 / x.shape[1]**0.5
+            else:
+                t._scale = t.proposal_scale
+        if verbose:
+            t_s = time.time()
+        while not t.finished:
+            if t.i_iter >= t.n_iter:
+                warnings.warn('the particles have not reached beta = 1 after '
+                              '{} generations. You may want to run it again '
+                              'with a larger n_iter.'.format(t.n_iter),
+                              RuntimeWarning)
+                break
+            beta = t.betas[-1]
+            delta = logp - logq
+            beta_new = self._next_beta(beta, delta)
+            log_w = (beta_new - beta) * delta
+            logz_inc = logsumexp(log_w) - np.log(t.n_chain)
+            w = np.exp(log_w - np.max(log_w))
+            w /= np.sum(w)
+            # delta method for the log of the mean of the weights
+            logz_var = np.var(w) * t.n_chain
+            ess = 1. / np.sum(w**2) / t.n_chain
+            i = _systematic_resample(w, rg)
+            x, logp, logq = x[i], logp[i], logq[i]
+            acceptance = self._mutate(x, logp, logq, beta_new, reference)
+            t.update(beta_new, x.copy(), logp.copy(), logq.copy(), logz_inc,
+                     logz_var, ess, acceptance)
+            if verbose:
+                print(self._prefix + 'generation #{} finished, beta = {:.4g}, '
+                      'ESS = {:.3f}, acceptance rate = {:.3f}.'.format(
+                      t.i_iter, beta_new, ess, acceptance))
+        if verbose and t.finished:
+            print(self._prefix + 'sampling finished after {} generations in '
+                  '{:.2f} seconds, with logz = {:.3f} +/- {:.3f}.'.format(
+                  t.i_iter, time.time() - t_s, t.logz, t.logz_err))
+        return t
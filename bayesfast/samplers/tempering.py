@@ -0,0 +1,210 @@
+import numpy as np
+from ..utils.random import spawn_generator
+try:
+    from distributed import Pub, Queue
+    HAS_DASK = True
+except Exception:
+    HAS_DASK = False
+
+__all__ = ['ReplicaExchange']
+
+# References: Earl & Deem 2005, https://doi.org/10.1039/B509983H
+#             Syed et al. 2021, https://arxiv.org/abs/1905.02939
+
+
+class ReplicaExchange:
+    """
+    Replica exchange (parallel tempering) across a ladder of chains.
+
+    Parameters
+    ----------
+    n_temp : int, optional
+        The number of temperatures in each ladder, including the untempered
+        one. Should be at least 2. Set to `4` by default.
+    beta_min : float, optional
+        The smallest inverse temperature, which should be between 0 and 1. The
+        inverse temperatures are spaced geometrically between `1` and
+        `beta_min`. Set to `0.1` by default.
+    betas : 1-d array_like or None, optional
+        The inverse temperatures. If not `None`, will override `n_temp` and
+        `beta_min`. Should be decreasing, with `betas[0] = 1`. Set to `None` by
+        default.
+    swap_every : positive int, optional
+        The chains propose to swap their states every `swap_every` iterations.
+        Set to `10` by default.
+
+    Notes
+    -----
+    For each of the `n_chain` chains in `sample`, `n_temp - 1` extra chains
+    are run on the tempered density `beta * logp`, so there are
+    `n_chain * n_temp` chains running in parallel, and the backend should have
+    at least as many workers. Every `swap_every` iterations, the chains in a
+    ladder send their current state and logp to the parent process, which
+    proposes to swap the states of adjacent temperatures, alternating between
+    the even and odd pairs, and sends the new states back. Only the chains with
+    `beta = 1` are returned. Currently, only `NUTS` and `HMC` with the
+    `multiprocess` and `dask` backends are supported, and it cannot be used
+    together with `monitor` or `checkpoint`.
+    """
+    def __init__(self, n_temp=4, beta_min=0.1, betas=None, swap_every=10):
+        if betas is None:
+            try:
+                n_temp = int(n_temp)
+                assert n_temp > 1
+            except Exception:
+                raise ValueError('n_temp should be an int larger than 1.')
+            try:
+                beta_min = float(beta_min)
+                assert 0. < beta_min < 1.
+            except Exception:
+                raise ValueError('beta_min should be a float between 0 and 1.')
+            betas = beta_min**(np.arange(n_temp) / (n_temp - 1.))
+        try:
+            betas = np.asarray(betas, dtype=np.float).copy()
+            assert betas.ndim == 1 and betas.size > 1
+            assert betas[0] == 1.
+            assert np.all(np.diff(betas) < 0.) and betas[-1] > 0.
+        except Exception:
+            raise ValueError('betas should be a decreasing 1-d array starting '
+                             'from 1.')
+        self._betas = betas
+        self.swap_every = swap_every
+        self._n_ladder = None
+        self._queue = None
+        self._reply_queues = None
+        self._dask_key = None
+        self._reset()
+
+    def __getstate__(self):
+        """Only the communication handles are needed by the workers."""
+        self_dict = self.__dict__.copy()
+        self_dict['_pending'] = None
+        self_dict['_generators'] = None
+        self_dict['_pub'] = None
+        return self_dict
+
+    def _reset(self):
+        self._pending = {}
+        self._generators = None
+        self._pub = None
+        self._n_proposed = np.zeros(self.n_temp - 1, dtype=np.int)
+        self._n_accepted = np.zeros(self.n_temp - 1, dtype=np.int)
+
+    @property
+    def betas(self):
+        return self._betas.copy()
+
+    @property
+    def n_temp(self):
+        return self._betas.size
+
+    @property
+    def swap_every(self):
+        return self._swap_every
+
+    @swap_every.setter
+    def swap_every(self, se):
+        try:
+            se = int(se)
+            assert se > 0
+        except Exception:
+            raise ValueError('swap_every should be a positive int.')
+        self._swap_every = se
+
+    @property
+    def n_proposed(self):
+        """The number of proposed swaps between each pair of adjacent betas."""
+        return self._n_proposed.copy()
+
+    @property
+    def n_accepted(self):
+        """The number of accepted swaps between each pair of adjacent betas."""
+        return self._n_accepted.copy()
+
+    @property
+    def swap_rate(self):
+        """The acceptance rate of swaps between each pair of adjacent betas."""
+        return self._n_accepted / np.fmax(self._n_proposed, 1)
+
+    def _beta(self, chain_id):
+        return self._betas[chain_id // self._n_ladder]
+
+    # the methods below are used by the parent process
+
+    def _activate(self, n_ladder, random_generator, queue=None,
+                  reply_queues=None, dask_key=None):
+        self._reset()
+        self._n_ladder = n_ladder
+        # one generator for each ladder, so that the results do not depend on
+        # the order in which the messages arrive
+        self._generators = spawn_generator(random_generator, n_ladder,
+                                           jump_current=False)
+        self._queue = queue
+        self._reply_queues = reply_queues
+        self._dask_key = dask_key
+        if dask_key is not None and not HAS_DASK:
+            raise RuntimeError('you want me to use dask but have not installed '
+                               'it.')
+
+    def _deactivate(self):
+        self._queue = None
+        self._reply_queues = None
+        self._dask_key = None
+
+    def _queue_name(self, chain_id):
+        return '{}-ReplicaExchange-{}'.format(self._dask_key, chain_id)
+
+    def _reply(self, chain_id, state):
+        if self._dask_key is None:
+            self._reply_queues[chain_id].put(state)
+        else:
+            if state is not None:
+                state = [np.asarray(state[0]).tolist(), float(state[1])]
+            Queue(self._queue_name(chain_id)).put(state)
+
+    def _collect(self, chain_id, i_iter, x, logp):
+        """Receive a state, and do the swaps once the whole ladder arrives."""
+        i_temp, i_ladder = divmod(chain_id, self._n_ladder)
+        states = self._pending.setdefault((i_ladder, i_iter), {})
+        states[i_temp] = [x, logp]
+        if len(states) < self.n_temp:
+            return
+        del self._pending[(i_ladder, i_iter)]
+        rg = self._generators[i_ladder]
+        for k in range((i_iter // self.swap_every) % 2, self.n_temp - 1, 2):
+            log_alpha = ((self._betas[k] - self._betas[k + 1]) *
+                         (states[k + 1][1] - states[k][1]))
+            self._n_proposed[k] += 1
+            if np.log(rg.random()) < log_alpha:
+                states[k], states[k + 1] = states[k + 1], states[k]
+                self._n_accepted[k] += 1
+        for k in range(self.n_temp):
+            self._reply(k * self._n_ladder + i_ladder, states[k])
+
+    def _abort(self):
+        """Release the chains that are still waiting for their partners."""
+        for i in range(self.n_temp * self._n_ladder):
+            self._reply(i, None)
+
+    # the methods below are used by the chains
+
+    def _exchange(self, sample_trace):
+        """Send the current state to the parent, and replace it by the reply."""
+        chain_id = sample_trace.chain_id
+        beta = self._beta(chain_id)
+        msg = ['ReplicaExchange', chain_id, sample_trace.i_iter,
+               sample_trace._samples[-1].copy(),
+               sample_trace.stats._logp[-1] / beta]
+        if self._dask_key is None:
+            self._queue.put(msg)
+            state = self._reply_queues[chain_id].get()
+        else:
+            if self._pub is None:
+                self._pub = Pub(self._dask_key)
+            self._pub.put(msg)
+            state = Queue(self._queue_name(chain_id)).get()
+        if state is None:
+            raise RuntimeError('replica exchange is aborted, presumably '
+                               'because another chain failed.')
+        sample_trace._samples[-1] = state[0]
+        sample_trace.stats._logp[-1] = beta * state[1]
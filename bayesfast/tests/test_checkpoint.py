@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import bayesfast as bf
+
+a = np.arange(1., 6.)
+n_call = [0, None]
+
+
+def logp_and_grad(x):
+    n_call[0] += 1
+    if n_call[1] is not None and n_call[0] >= n_call[1]:
+        raise KeyboardInterrupt
+    return -0.5 * np.sum(a * x**2), -a * x
+
+
+def run(checkpoint=None):
+    density = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=5)
+    return bf.sample(density, {'n_chain': 2, 'n_iter': 300, 'n_warmup': 100,
+                     'x_0': np.ones((2, 5)), 'random_generator': 0},
+                     parallel_backend='serial', verbose=False,
+                     checkpoint=checkpoint)
+
+
+def test_checkpoint_resume(tmp_path):
+    n_call[:] = [0, None]
+    t = run()
+    checkpoint = bf.samplers.Checkpoint(tmp_path, save_every=50)
+    n_call[:] = [0, 3000]
+    try:
+        run(checkpoint)
+        assert False
+    except KeyboardInterrupt:
+        pass
+    names = sorted(os.listdir(tmp_path))
+    assert 'chain-0.pkl' in names and len(names) > 2
+    n_call[:] = [0, None]
+    t_resumed = run(checkpoint)
+    assert np.array_equal(t.get(), t_resumed.get())
+    for s, s_resumed in zip(t, t_resumed):
+        assert np.array_equal(s.stats._logp, s_resumed.stats._logp)
+        assert np.array_equal(s.stats._step_size, s_resumed.stats._step_size)
+
+
+def test_checkpoint_append(tmp_path):
+    from bayesfast.utils.collections import ArrayBuffer
+
+    class Trace:
+        chain_id = 0
+
+    checkpoint = bf.samplers.Checkpoint(tmp_path)
+    t = Trace()
+    t.a = ArrayBuffer()
+    t.b = t.a
+    sizes = []
+    for i in range(3):
+        t.a.extend(np.ones((5, 3)) * i)
+        checkpoint._save(t)
+        names = [n for n in os.listdir(tmp_path) if n.endswith('.dat')]
+        assert len(names) == 1
+        sizes.append(os.path.getsize(os.path.join(tmp_path, names[0])))
+    assert sizes == [120, 240, 360]
+    t_loaded = checkpoint._load(1)[0]
+    assert np.array_equal(t_loaded.a.view, t.a.view)
+    assert t_loaded.a is t_loaded.b
+    t_loaded.a.append(np.ones(3))
+    assert len(t_loaded.a) == 16
@@ -0,0 +1,50 @@
+import numpy as np
+import bayesfast as bf
+
+sigma = np.array([1., 2.])
+
+
+def logp(x):
+    return -0.5 * np.sum((x / sigma)**2, axis=-1)
+
+
+def logp_biased(x):
+    return -0.5 * np.sum(((x - 0.5) / (1.5 * sigma))**2, axis=-1)
+
+
+def get_density(fun):
+    module = bf.Module(fun=fun, input_vars='x', output_vars='logp')
+    return bf.Density(module_list=[module], input_dims=[2], input_vars='x',
+                      density_name='logp')
+
+
+def test_delayed_biased():
+    density = get_density(logp)
+    surrogate = bf.modules.PolyModel('quadratic', input_size=2,
+                                     output_size=1, input_vars='x',
+                                     output_vars='logp')
+    surrogate.set_bound_options(use_bound=False)
+    density.surrogate_list = [surrogate]
+    x_fit = bf.utils.sobol.multivariate_normal(np.zeros(2), np.eye(2), 20)
+    density.fit(get_density(logp_biased).fun(x_fit))
+    density.use_surrogate = True
+
+    da = bf.samplers.DelayedAcceptance(n_sub=2)
+    t = bf.sample(density, {'n_chain': 2, 'n_iter': 1500, 'n_warmup': 500,
+                  'x_0': np.zeros((2, 2)), 'random_generator': 0},
+                  parallel_backend='serial', verbose=False,
+                  delayed_acceptance=da)
+    x = t.get(flatten=True)
+    assert np.allclose(x.mean(axis=0), 0., atol=0.2)
+    assert np.allclose(x.std(axis=0), sigma, rtol=0.15)
+    # one more true evaluation at the starting point of each chain
+    assert da.n_iter == 3000
+    assert da.n_true + da.n_screened == da.n_iter + 2
+    assert 0. < da.acceptance_rate < 1.
+    assert np.array_equal(np.concatenate([s.stats._logp for s in t]),
+                          logp(np.concatenate([s.samples for s in t])))
+
+    t = bf.sample(density, {'n_chain': 2, 'n_iter': 1500, 'n_warmup': 500,
+                  'x_0': np.zeros((2, 2)), 'random_generator': 0},
+                  parallel_backend='serial', verbose=False)
+    assert not np.allclose(t.get(flatten=True).mean(axis=0), 0., atol=0.2)
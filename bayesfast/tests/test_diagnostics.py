@@ -0,0 +1,17 @@
+import numpy as np
+import bayesfast as bf
+
+rng = np.random.default_rng(0)
+x = rng.normal(size=(4, 1000, 2))
+
+
+def test_diagnostics_iid():
+    assert np.all(np.abs(bf.utils.split_rhat(x) - 1) < 0.01)
+    assert np.all(bf.utils.ess_bulk(x) > 2000)
+    assert np.all(bf.utils.ess_tail(x) > 2000)
+
+
+def test_diagnostics_shifted():
+    y = x.copy()
+    y[0] += 2.
+    assert np.all(bf.utils.split_rhat(y) > 1.1)
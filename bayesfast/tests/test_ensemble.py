@@ -0,0 +1,16 @@
+import numpy as np
+from bayesfast.samplers import EnsembleSampler, ETrace
+
+
+def test_ensemble():
+    cov = np.array([[1., 0.8], [0.8, 2.]])
+    prec = np.linalg.inv(cov)
+    logp = lambda x: -0.5 * np.einsum('ij,jk,ik->i', x, prec, x)
+    t = ETrace(n_chain=20, n_iter=2000, n_warmup=500, x_0=np.zeros(2),
+               random_generator=0)
+    t._init_chain(0)
+    EnsembleSampler(logp, t).run(verbose=False)
+    samples = t.get(original_space=False)
+    assert samples.shape == (20 * 1500, 2)
+    assert np.allclose(np.cov(samples, rowvar=False), cov, atol=0.3)
+    assert 0.3 < np.mean(t.acceptance_fraction) < 0.9
@@ -0,0 +1,99 @@
+import numpy as np
+from bayesfast.samplers.hmc_utils.metrics import (QuadMetricFullAdapt,
+                                                  QuadMetricLowRankAdapt,
+                                                  _WeightedCovariance)
+from bayesfast.utils.random import RandomBuffer
+
+
+def test_metric_rank_one():
+    x = np.random.default_rng(0).normal(size=(100, 5))
+    m_0 = QuadMetricFullAdapt(5, np.zeros(5), adapt_window=40)
+    m_1 = QuadMetricFullAdapt(5, np.zeros(5), adapt_window=40,
+                              rank_one_update=True)
+    for x_i in x:
+        m_0.update(x_i, True)
+        m_1.update(x_i, True)
+    assert np.allclose(m_0._chol, m_1._chol)
+
+
+def test_metric_low_rank():
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=(200, 8)) @ rng.normal(size=(8, 8))
+    m = QuadMetricLowRankAdapt(8, np.zeros(8), max_rank=3, adapt_window=50)
+    for x_i in x:
+        m.update(x_i, True)
+    assert m.rank == 3
+    p = rng.normal(size=8)
+    assert np.allclose(m.velocity(p), m._covariance() @ p)
+
+
+def test_metric_merge():
+    x = np.random.default_rng(2).normal(size=(50, 3))
+    c_0 = _WeightedCovariance(3, initial_weight=0.)
+    c_1 = _WeightedCovariance(3, initial_weight=0.)
+    c_2 = _WeightedCovariance(3, initial_weight=0.)
+    for x_i in x[:20]:
+        c_0.add_sample(x_i, 1)
+    for x_i in x[20:]:
+        c_1.add_sample(x_i, 1)
+    for x_i in x:
+        c_2.add_sample(x_i, 1)
+    c_m = c_0.merged(c_1)
+    assert np.isclose(c_m.n_samples, 50)
+    assert np.allclose(c_m.current_mean(), c_2.current_mean())
+    assert np.allclose(c_m.current_covariance(), c_2.current_covariance())
+
+
+def test_random_buffer():
+    cov = np.array([[2., 0.5], [0.5, 1.]])
+    m = QuadMetricFullAdapt(2, np.zeros(2), cov)
+    b_0 = RandomBuffer(np.random.default_rng(2), 16)
+    b_1 = RandomBuffer(np.random.default_rng(2), 1000)
+    p_0 = [m.random(b_0) for _ in range(10)]
+    # the remaining momenta should be transformed with the new metric
+    m.update(np.ones(2), True)
+    p_0 += [m.random(b_0) for _ in range(90)]
+    p_1 = [m.random(b_1) for _ in range(100)]
+    assert np.allclose(p_0[10:], p_1[10:])
+    assert not np.allclose(p_0[:10], p_1[:10])
+    assert np.allclose([b_0.uniform() for _ in range(50)],
+                       [b_1.uniform() for _ in range(50)])
+    p = np.array([m.random(b_0) for _ in range(10000)])
+    assert np.allclose(np.cov(p.T), np.linalg.inv(m._cov), rtol=0.1)
+
+
+def test_metric_rank_one_pooled(monkeypatch):
+    import scipy.linalg
+    rng = np.random.default_rng(3)
+    x = rng.normal(size=(100, 5))
+    x_other = rng.normal(size=(30, 5)) * 2.
+    other = QuadMetricFullAdapt(5, np.zeros(5), adapt_window=80)
+    for x_i in x_other:
+        other.update(x_i, True)
+    m_0 = QuadMetricFullAdapt(5, np.zeros(5), adapt_window=80)
+    m_1 = QuadMetricFullAdapt(5, np.zeros(5), adapt_window=80,
+                              rank_one_update=True)
+    n_chol = [0]
+    cholesky = scipy.linalg.cholesky
+
+    def counted(*args, **kwargs):
+        n_chol[0] += 1
+        return cholesky(*args, **kwargs)
+
+    monkeypatch.setattr(scipy.linalg, 'cholesky', counted)
+    n_1 = 0
+    for i, x_i in enumerate(x):
+        if i == 10:
+            m_0._set_pooled([other._pooled_state()])
+            m_1._set_pooled([other._pooled_state()])
+        m_0.update(x_i, True)
+        n_0 = n_chol[0]
+        m_1.update(x_i, True)
+        n_1 += n_chol[0] - n_0
+        if i == 60:
+            # the factor is only updated by rank-1 updates while pooled
+            assert n_1 == 0
+            assert np.allclose(m_0._chol, m_1._chol)
+            assert np.allclose(m_1._chol @ m_1._chol.T, m_1._cov)
+            assert m_1._foreground_cov.n_samples == 62
+    assert np.allclose(m_0._chol, m_1._chol)
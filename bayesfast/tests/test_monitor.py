@@ -0,0 +1,56 @@
+import threading
+import numpy as np
+import bayesfast as bf
+from bayesfast.samplers import ConvergenceMonitor
+from bayesfast.utils.diagnostics import split_rhat
+
+a = np.arange(1., 6.)
+
+
+def logp_and_grad(x):
+    return -0.5 * np.sum(a * x**2), -a * x
+
+
+def test_monitor_collect():
+    monitor = ConvergenceMonitor(check_every=10, min_sample=50,
+                                 ess_bulk_min=2000., ess_tail_min=None,
+                                 include_logp=False, check_growth=1.5)
+    monitor._activate(2, event=threading.Event())
+    rng = np.random.default_rng(0)
+    x = rng.normal(size=(2, 5000, 3))
+    for i in range(500):
+        stop = [monitor._collect(j, 100, 100 + 10 * (i + 1),
+                                 x[j, (10 * i):(10 * (i + 1))]) for j in (0, 1)]
+        if stop[1]:
+            break
+    assert not stop[0] and monitor._event.is_set()
+    n = [r.i_iter - 100 for r in monitor.records]
+    assert n[0] == 50 and monitor.n_stop == n[-1] + 100
+    assert all(n_1 >= 1.5 * n_0 for n_0, n_1 in zip(n[:-1], n[1:]))
+    assert monitor.records[-1].ess_bulk >= 2000.
+    assert monitor.records[-2].ess_bulk < 2000.
+    assert np.isclose(monitor.records[-1].rhat,
+                      np.max(split_rhat(x[:, :n[-1]])))
+    # no more checks after the decision
+    assert not monitor._collect(0, 100, 100 + 10 * (i + 2), x[0, :10])
+    monitor._deactivate()
+
+    try:
+        ConvergenceMonitor(check_growth=0.5)
+        assert False
+    except ValueError:
+        pass
+
+
+def test_monitor_sample():
+    monitor = ConvergenceMonitor(check_every=50, ess_bulk_min=300.,
+                                 ess_tail_min=300.)
+    t = bf.sample(bf.DensityLite(logp_and_grad=logp_and_grad, input_size=5),
+                  {'n_chain': 2, 'n_iter': 10100, 'n_warmup': 100,
+                  'x_0': np.ones((2, 5)), 'random_generator': 0},
+                  parallel_backend=2, verbose=False, monitor=monitor)
+    assert monitor.n_stop is not None and monitor.n_stop < 10100
+    assert monitor.records[-1].i_iter == monitor.n_stop
+    assert t[0].i_iter == t[1].i_iter >= monitor.n_stop
+    assert t[0].i_iter < 10100 and t[0].n_iter == t[0].i_iter
+    assert t.get().shape == (2 * (t[0].i_iter - 100), 5)
@@ -0,0 +1,38 @@
+import numpy as np
+import bayesfast as bf
+
+a = np.arange(1., 6.)
+
+
+def logp_and_grad(x):
+    return -0.5 * np.sum(a * x**2), -a * x
+
+
+def test_speculative():
+    density = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=5)
+    x = []
+    for speculative in (False, True):
+        t = bf.sample(density, {'n_chain': 1, 'n_iter': 200, 'n_warmup': 100,
+                      'x_0': np.ones(5), 'random_generator': 0,
+                      'speculative': speculative}, parallel_backend=1,
+                      verbose=False)
+        x.append(t.get())
+    assert np.array_equal(x[0], x[1])
+
+
+def test_speculative_executor(monkeypatch):
+    from bayesfast.samplers import nuts
+    from concurrent.futures import ThreadPoolExecutor
+    executors = []
+
+    def executor(n):
+        executors.append(ThreadPoolExecutor(n))
+        return executors[-1]
+
+    monkeypatch.setattr(nuts, 'ThreadPoolExecutor', executor)
+    density = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=5)
+    bf.sample(density, {'n_chain': 2, 'n_iter': 200, 'n_warmup': 100,
+              'x_0': np.ones((2, 5)), 'random_generator': 0,
+              'speculative': True}, parallel_backend='serial', verbose=False)
+    assert len(executors) == 2
+    assert all(e._shutdown for e in executors)
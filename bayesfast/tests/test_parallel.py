@@ -28,3 +28,248 @@ def test_parallel_gma_1():
     with be as pool:
         res = pool.gather(pool.map_async(fun_1, range(4), range(4)))
         assert res == list(range(0, 8, 2))
+
+
+def test_parallel_persistent():
+    import os
+    import time
+    pb = bf.utils.parallel.ParallelBackend(2, idle_timeout=0.5)
+    with pb:
+        pool = pb.backend_activated
+        pids = set(p.pid for p in pool._pool)
+        with pb:
+            assert set(pb.map(lambda i: os.getpid(), range(8))) <= pids
+        assert pb.backend_activated is pool
+    with pb:
+        assert pb.backend_activated is pool
+        assert set(pb.map(lambda i: os.getpid(), range(8))) <= pids
+    time.sleep(1.)
+    assert pb.backend_activated is None
+    with pb:
+        assert pb.map(fun_0, range(4)) == list(range(4))
+    pb.shutdown()
+    assert pb.backend_activated is None
+
+
+def test_parallel_chunked():
+    import numpy as np
+    x = np.arange(100.).reshape((50, 2))
+    with be as pool:
+        res = pool.map(lambda a: a @ a, x, chunksize='auto')
+        assert np.allclose(res, np.sum(x**2, axis=1))
+        res = pool.map(fun_1, range(10), range(10), chunksize=3)
+        assert res == list(range(0, 20, 2))
+        res = pool.map(lambda a: np.sum(a**2, axis=1), x, vectorized=True)
+        assert np.allclose(res, np.sum(x**2, axis=1))
+
+
+class _Scale:
+    def __init__(self, a):
+        self.a = a
+
+    def __call__(self, x):
+        return self.a * x
+
+
+def test_parallel_broadcast():
+    s = _Scale(2)
+    with be as pool:
+        bs = pool.broadcast(s)
+        assert pool.broadcast(s) is bs
+        assert pool.map(bs, range(4)) == [0, 2, 4, 6]
+        s.a = 3
+        bs_new = pool.broadcast(s)
+        assert bs_new.key != bs.key
+        assert pool.map(bs_new, range(4), chunksize=2) == [0, 3, 6, 9]
+
+
+def test_parallel_shared_memory():
+    import numpy as np
+    x = np.arange(200.).reshape((100, 2))
+    with be as pool:
+        res = pool.map(lambda a: a @ a, x, shared_memory=True, out_shape=())
+        assert isinstance(res, np.ndarray) and res.shape == (100,)
+        assert np.allclose(res, np.sum(x**2, axis=1))
+        res = pool.map(lambda a, b: a + b, x, x[:, 0], shared_memory=True,
+                       chunksize=7)
+        assert np.allclose(res, x + x[:, :1])
+
+
+def test_parallel_serial_thread():
+    for backend in ('serial', 'thread'):
+        pb = bf.utils.parallel.ParallelBackend(backend)
+        assert pb.kind == backend
+        with pb as pool:
+            assert pool.map(fun_1, range(4), range(4)) == list(range(0, 8, 2))
+            res = pool.gather(pool.map_async(fun_0, range(4)))
+            assert res == list(range(4))
+            assert pool.map(fun_0, range(10), chunksize=3) == list(range(10))
+        pb.shutdown()
+
+
+def test_parallel_auto_serial():
+    pb = bf.utils.parallel.ParallelBackend(2)
+    with pb as pool:
+        assert pool.map(fun_0, [1], chunksize='auto') == [1]
+        assert pool._backend_activated is None
+
+
+def test_parallel_asyncio():
+    import asyncio
+    import time
+    import numpy as np
+
+    async def afun(a):
+        await asyncio.sleep(0.1)
+        return 2 * a
+
+    ex = bf.utils.parallel.AsyncioExecutor(max_concurrency=20)
+    pb = bf.utils.parallel.ParallelBackend(ex)
+    assert pb.kind == 'asyncio'
+    with pb as pool:
+        t_s = time.time()
+        assert pool.map(afun, range(20)) == list(range(0, 40, 2))
+        assert time.time() - t_s < 1.
+        assert pool.map(fun_1, range(4), range(4)) == list(range(0, 8, 2))
+    ex.batch_size = 3
+    ex.timeout = 0.05
+    with pb as pool:
+        res = pool.map(lambda a: [2 * _ for _ in a], range(10))
+        assert res == list(range(0, 20, 2))
+        try:
+            pool.map(afun, range(2))
+            assert False
+        except TimeoutError:
+            pass
+    ex.shutdown()
+
+    async def afun_2(x):
+        await asyncio.sleep(0.01)
+        return 2 * x
+
+    m = bf.Module(fun=afun_2, input_vars='x', output_vars='y')
+    assert m.is_async and np.array_equal(m.fun(np.ones(2))[0], [2., 2.])
+
+    async def call_sync():
+        return m.fun(np.ones(2))
+
+    loop = asyncio.new_event_loop()
+    assert np.array_equal(loop.run_until_complete(call_sync())[0], [2., 2.])
+    loop.close()
+
+
+def test_parallel_tolerant():
+    import time
+    import numpy as np
+
+    def fun(i):
+        if i == 1:
+            raise ValueError
+        time.sleep(3. if i == 2 else 0.02)
+        return i
+
+    policy = bf.utils.parallel.StragglerPolicy(timeout=0.5, min_finished=2)
+    for backend in (2, 'thread'):
+        pb = bf.utils.parallel.ParallelBackend(backend)
+        with pb as pool:
+            res, is_done = pool.map_tolerant(fun, range(8), policy=policy)
+            assert np.array_equal(np.where(~is_done)[0], [1, 2])
+            assert res[3:] == list(range(3, 8)) and res[1] is None
+            assert pool.map(fun_0, range(4)) == list(range(4))
+        pb.shutdown()
+
+
+def test_parallel_tolerant_hung():
+    import time
+    import numpy as np
+    from collections import Counter
+
+    def fun(i):
+        time.sleep(30. if i < 3 else 0.02)
+        return i
+
+    policy = bf.utils.parallel.StragglerPolicy(timeout=0.3, max_retry=0,
+                                               speculative=False)
+    pb = bf.utils.parallel.ParallelBackend(2)
+    with pb as pool:
+        t_0 = time.time()
+        res, is_done = pool.map_tolerant(fun, range(8), policy=policy)
+        assert time.time() - t_0 < 10.
+        assert np.array_equal(np.where(~is_done)[0], [0, 1, 2])
+        assert res[3:] == list(range(3, 8))
+    pb.shutdown()
+
+    count = Counter()
+
+    def fun_1(i):
+        count[i] += 1
+        time.sleep(3. if count[i] == 1 and i < 2 else 0.02)
+        return i
+
+    policy = bf.utils.parallel.StragglerPolicy(timeout=0.3, speculative=False)
+    pb = bf.utils.parallel.ParallelBackend('thread')
+    with pb as pool:
+        res, is_done = pool.map_tolerant(fun_1, range(4), policy=policy)
+        assert is_done.all() and res == list(range(4))
+    pb.shutdown()
+
+
+def test_parallel_n_thread():
+    from threadpoolctl import threadpool_info
+
+    def n_thread(i):
+        return max([d['num_threads'] for d in threadpool_info()] + [0])
+
+    pb = bf.utils.parallel.ParallelBackend(2, n_thread=3)
+    with pb as pool:
+        assert pool.n_thread_worker == 3
+        assert pool.map(n_thread, range(4)) == [3] * 4
+    pb.shutdown()
+    assert bf.utils.parallel.ParallelBackend('serial').n_thread_worker is None
+
+
+def test_parallel_tolerant_background():
+    import time
+
+    def fun(i):
+        time.sleep(0.05)
+        return i
+
+    pb = bf.utils.parallel.ParallelBackend(2)
+    with pb as pool:
+        tm = pool.map_tolerant(fun, range(20), background=True,
+                               max_in_flight=0)
+        time.sleep(0.2)
+        assert tm.n_done == 0
+        tm.max_in_flight = None
+        res, is_done = tm.wait(4)
+        assert is_done.sum() >= 4 and not tm.finished
+        tm.cancel()
+        res, is_done = tm.wait()
+        assert tm.finished and is_done.sum() < 20
+        assert all(res[i] == i for i in range(20) if is_done[i])
+    pb.shutdown()
+
+
+def test_parallel_exit_without_shutdown():
+    import os
+    import sys
+    import subprocess
+    code = '\n'.join([
+        'import bayesfast as bf',
+        'pbs = []',
+        'for backend in ("thread", "asyncio", 2):',
+        '    pbs.append(bf.utils.parallel.ParallelBackend(backend))',
+        '    with pbs[-1]:',
+        '        assert pbs[-1].map(abs, [-1, -2]) == [1, 2]',
+        '    assert pbs[-1].backend_activated is not None',
+    ])
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.dirname(bf.__file__)))] +
+        [p for p in [env.get('PYTHONPATH')] if p])
+    res = subprocess.run([sys.executable, '-c', code], env=env,
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                         timeout=120)
+    assert res.returncode == 0
+    assert b'Error' not in res.stderr and b'Traceback' not in res.stderr
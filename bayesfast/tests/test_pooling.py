@@ -0,0 +1,49 @@
+import numpy as np
+import bayesfast as bf
+from bayesfast.samplers import PooledWarmup
+
+a = np.arange(1., 4.)
+
+
+def logp_and_grad(x):
+    return -0.5 * np.sum(a * x**2), -a * x
+
+
+class _RecordedWarmup(PooledWarmup):
+    """Keeping the last reports of the chains after sampling."""
+    def _deactivate(self):
+        self.reports = dict(self._shared)
+        super()._deactivate()
+
+
+def test_pooled_warmup():
+    pw = _RecordedWarmup(share_every=10)
+    t = bf.sample(bf.DensityLite(logp_and_grad=logp_and_grad, input_size=3),
+                  {'n_chain': 2, 'n_iter': 1200, 'n_warmup': 200,
+                  'metric': 'full', 'x_0': np.ones((2, 3)),
+                  'random_generator': 0}, parallel_backend=2, verbose=False,
+                  pooled_warmup=pw)
+    assert sorted(pw.reports) == [0, 1]
+    n_pooled = 0
+    for i, s in enumerate(t):
+        # the last share is at the end of warmup, after which the adaptation
+        # stops, so the final states are the pooled ones
+        own_state, own_hbar = pw.reports[i]
+        other_state, other_hbar = pw.reports[1 - i]
+        metric = s.metric
+        assert np.isclose(metric._foreground_cov.n_samples, own_state[1])
+        if metric._pooled_cov is not None:
+            merged = metric._foreground_cov.merged(metric._pooled_cov)
+            assert np.allclose(metric._cov, merged.current_covariance())
+            assert np.allclose(metric._chol @ metric._chol.T, metric._cov)
+        # the chain sharing last sees the final report of the other chain
+        if (metric._pooled_cov is not None and
+            metric._pooled_cov.n_samples == other_state[1]):
+            assert np.allclose(metric._pooled_cov.mean, other_state[2])
+            assert np.isclose(s.step_size._hbar, (own_hbar + other_hbar) / 2.)
+            n_pooled += 1
+    assert n_pooled >= 1
+    x = t.get()
+    assert np.all(np.isfinite(x)) and x.shape == (2000, 3)
+    assert np.allclose(np.mean(x, axis=0), 0., atol=0.15)
+    assert np.allclose(np.var(x, axis=0) * a, 1., atol=0.25)
@@ -0,0 +1,25 @@
+import numpy as np
+import bayesfast as bf
+
+
+def logp_and_grad(x):
+    return -0.5 * np.sum(x**2), -x
+
+
+def test_profiler():
+    density = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=3)
+    batches = []
+    profiler = bf.samplers.SamplerProfiler(callback=batches.append,
+                                           report_every=30)
+    t = bf.sample(density, {'n_chain': 2, 'n_iter': 200, 'n_warmup': 100,
+                  'x_0': np.full(3, 0.5), 'random_generator': 0},
+                  parallel_backend=2, verbose=False, profiler=profiler)
+    records = profiler.records
+    assert records.shape == (400,)
+    assert sum(len(b) for b in batches) == 400
+    for i in range(2):
+        r = records[records['chain_id'] == i]
+        assert np.array_equal(r['i_iter'], np.arange(200))
+        assert np.array_equal(r['tree_depth'], t.stats[i]._tree_depth)
+        assert np.array_equal(r['diverging'], t.stats[i]._diverging)
+    assert np.all(records['wall_time'] > 0)
@@ -0,0 +1,198 @@
+import warnings
+import numpy as np
+import bayesfast as bf
+
+
+def logp(x):
+    return -0.5 * np.sum((x - 1.)**2, axis=-1)
+
+
+def grad(x):
+    return -(x - 1.)
+
+
+def get_recipe(n_sample=3, sample_kwargs={}, fun=logp, **kwargs):
+    module = bf.Module(fun=fun, jac=grad, input_vars='x',
+                       output_vars='logp')
+    density = bf.Density(module_list=[module], input_dims=[2],
+                         input_vars='x', density_name='logp')
+    surrogate = bf.modules.PolyModel('quadratic', input_size=2,
+                                     output_size=1, input_vars='x',
+                                     output_vars='logp')
+    surrogate.set_bound_options(use_bound=False)
+    sample_trace = {'n_chain': 2, 'n_iter': 200, 'n_warmup': 100}
+    x_0 = bf.utils.sobol.multivariate_normal(np.zeros(2), np.eye(2), 12)
+    opt = bf.recipe.OptimizeStep(surrogate_list=surrogate, x_0=x_0,
+                                 sample_trace=sample_trace,
+                                 run_sampling=False)
+    sample_kwargs = dict({'alpha_n': 2, 'reuse_samples': 0,
+                          'logp_cutoff': False, 'sample_trace': sample_trace},
+                         **sample_kwargs)
+    sam = bf.recipe.SampleStep(surrogate_list=surrogate, **sample_kwargs)
+    kwargs.setdefault('parallel_backend', 1)
+    return bf.recipe.Recipe(density=density, optimize=opt,
+                            sample=[sam] * n_sample, **kwargs)
+
+
+def test_recipe_kl_threshold():
+    bf.utils.random.set_generator(0)
+    recipe = get_recipe(sample_kl_threshold=0.5)
+    recipe.run()
+    trace = recipe.recipe_trace
+    assert trace._strategy.n_skipped == 1
+    assert trace.n_call_saved == trace._strategy.sample_steps[-1].n_eval > 0
+    assert trace.finished.sample and trace.finished.post
+    assert len(trace._r_sample) == 2 and trace._r_sample[-1].kl < 0.5
+    assert np.allclose(recipe.get().samples.mean(axis=0), 1., atol=0.2)
+
+    bf.utils.random.set_generator(0)
+    recipe = get_recipe()
+    recipe.run()
+    assert recipe.recipe_trace.n_call_saved == 0
+    assert len(recipe.recipe_trace._r_sample) == 3
+
+
+n_call = [0, None]
+
+
+def logp_interrupted(x):
+    n_call[0] += 1
+    if n_call[1] is not None and n_call[0] >= n_call[1]:
+        raise KeyboardInterrupt
+    return logp(x)
+
+
+def test_recipe_checkpoint(tmp_path):
+    n_call[:] = [0, None]
+    bf.utils.random.set_generator(0)
+    recipe = get_recipe(fun=logp_interrupted, parallel_backend='serial',
+                        verbose=False)
+    recipe.run()
+    samples = recipe.get().samples
+    n_interrupted = 0
+    # interrupted during the OptimizeStep and the second SampleStep
+    for n_fail in (20, 30, None):
+        bf.utils.random.set_generator(0)
+        n_call[:] = [0, n_fail]
+        recipe = get_recipe(fun=logp_interrupted, parallel_backend='serial',
+                            checkpoint=tmp_path, verbose=False)
+        try:
+            recipe.run()
+        except KeyboardInterrupt:
+            n_interrupted += 1
+    assert n_interrupted == 2
+    assert np.array_equal(recipe.get().samples, samples)
+
+    recipe = get_recipe(n_sample=2, fun=logp_interrupted,
+                        parallel_backend='serial', checkpoint=tmp_path)
+    try:
+        recipe.run()
+        assert False
+    except RuntimeError:
+        pass
+
+
+def test_recipe_pipelined(capsys):
+    import pytest
+
+    bf.utils.random.set_generator(0)
+    recipe = get_recipe(sample_kwargs={'logp_cutoff': True}, pipelined=True,
+                        pipeline_fraction=0.25, parallel_backend=4)
+    recipe.run()
+    out = capsys.readouterr().out
+    assert 'after 125 iterations, using 2 idle workers' in out
+    assert recipe.recipe_trace.finished.post
+    assert np.allclose(recipe.get().samples.mean(axis=0), 1., atol=0.2)
+    for r in recipe.recipe_trace._r_sample[1:]:
+        assert len(r.var_dicts) >= recipe.recipe_trace._strategy.sample_steps[
+            1].n_eval_min
+
+    recipe = get_recipe(pipelined=True, parallel_backend=2, verbose=False)
+    with pytest.warns(RuntimeWarning, match='pipelined mode'):
+        recipe.run()
+    assert 'idle workers' not in capsys.readouterr().out
+
+
+def test_recipe_delayed_acceptance():
+    bf.utils.random.set_generator(0)
+    da = bf.samplers.DelayedAcceptance()
+    post = bf.recipe.PostStep(delayed_acceptance=da)
+    recipe = get_recipe(n_sample=1, post=post, verbose=False)
+    recipe.run()
+    result = recipe.get()
+    da = recipe.recipe_trace._s_post.delayed_acceptance
+    assert da.n_iter == 400 and da.n_true + da.n_screened == da.n_iter + 2
+    assert np.array_equal(result.logp, logp(result.samples))
+    assert np.allclose(result.samples.mean(axis=0), 1., atol=0.3)
+
+    # each chain continues from the last draw of the corresponding chain
+    trace_q = recipe.recipe_trace._r_sample[-1].sample_trace
+    x_q = trace_q.get(original_space=False, flatten=False)
+    sample_trace = recipe._da_trace(bf.recipe.PostStep(), trace_q)
+    assert np.array_equal(sample_trace.x_0, x_q[:, -1])
+    assert not np.allclose(sample_trace.x_0[0], sample_trace.x_0[1])
+    with warnings.catch_warnings():
+        warnings.filterwarnings('error', category=FutureWarning,
+                                module='bayesfast.core.recipe')
+        sample_trace = recipe._da_trace(bf.recipe.PostStep(sample_trace={
+            'n_chain': 2, 'metric': np.array([1., 2.])}), trace_q)
+    assert np.array_equal(sample_trace._metric, [1., 2.])
+
+
+def test_recipe_warm_start(monkeypatch):
+    from copy import deepcopy
+    from bayesfast.core import recipe as _recipe
+    from bayesfast.utils.laplace import LaplaceResult
+    from bayesfast.utils import untemper_laplace_samples
+    warm_started = []
+
+    def laplace_warm_start(sample_trace, *args):
+        _laplace_warm_start(sample_trace, *args)
+        warm_started.append(deepcopy(sample_trace))
+
+    _laplace_warm_start = _recipe._laplace_warm_start
+    monkeypatch.setattr(_recipe, '_laplace_warm_start', laplace_warm_start)
+
+    def run(**kwargs):
+        bf.utils.random.set_generator(0)
+        warm_started.clear()
+        sample_trace = dict({'n_chain': 2, 'n_iter': 200, 'n_warmup': 100},
+                            **kwargs)
+        recipe = get_recipe(n_sample=1, verbose=False, sample_kwargs={
+            'warm_start': True, 'sample_trace': sample_trace})
+        recipe.run()
+        assert recipe.recipe_trace.finished.sample
+        laplace_result = recipe.recipe_trace._r_optimize[-1].laplace_result
+        chains = recipe.recipe_trace._r_sample[0].sample_trace
+        t = warm_started[0] if warm_started else None
+        return t, laplace_result, chains
+
+    t, laplace_result, chains = run(metric='full')
+    assert np.array_equal(t._metric, laplace_result.cov)
+    assert t._step_size == 1.
+    assert t.x_0.shape == (2, 2) and t.x_0_transformed
+    assert np.array_equal(t.x_0, untemper_laplace_samples(laplace_result)[:2])
+    # each chain starts from a different Laplace sample
+    assert np.array_equal(chains[0].x_0, t.x_0[0])
+    assert np.array_equal(chains[1].x_0, t.x_0[1])
+    assert not np.allclose(chains[0].x_0, chains[1].x_0)
+
+    # explicitly set metric or x_0 should be left unchanged
+    t, _, _ = run(metric=np.array([2., 3.]), step_size=0.5)
+    assert np.array_equal(t._metric, [2., 3.]) and t._step_size == 0.5
+    assert t.x_0.shape == (2, 2)
+    x_0 = np.array([[0.5, 1.5], [1.5, 0.5]])
+    t, _, chains = run(metric='full', x_0=x_0)
+    assert t is None
+    assert np.array_equal(chains[0].x_0, x_0[0])
+    assert np.array_equal(chains[1].x_0, x_0[1])
+
+    # with a diag metric, the step size is shrunk by sqrt(lambda_min)
+    cov = np.array([[4., 1.8], [1.8, 1.]])
+    laplace_result = LaplaceResult(np.zeros(2), 0., np.zeros((4, 2)), cov,
+                                   1., None)
+    t = bf.samplers.NTrace(n_chain=2, metric='diag', step_size=0.5)
+    _laplace_warm_start(t, laplace_result, np.arange(8.).reshape((4, 2)))
+    assert np.array_equal(t._metric, [4., 1.])
+    assert np.isclose(t._step_size, 0.5 * 0.1**0.5)
+    assert np.array_equal(t.x_0, [[0., 1.], [2., 3.]])
@@ -0,0 +1,81 @@
+import numpy as np
+from bayesfast.samplers import NTrace
+
+
+def test_save_tuned(tmp_path):
+    t = NTrace(n_chain=1, x_0=np.ones(3), metric='full')
+    t._init_chain(0)
+    t.step_size._set_tuned(-1., -1.2, 0.1, 0.5, 300)
+    t.metric._update_from_weightvar(t.metric._foreground_cov)
+    t.save_tuned(tmp_path / 'tuned.npz')
+    t_new = NTrace(n_chain=2, n_warmup=0, metric='full',
+                   tuned=tmp_path / 'tuned.npz')
+    assert np.array_equal(t_new.x_0, np.ones((1, 3)))
+    t_new._init_chain(1)
+    assert np.isclose(t_new.step_size.current(False), np.exp(-1.2))
+    assert t_new.step_size._count == 300
+    assert np.allclose(t_new.metric._cov, t.metric._cov)
+
+
+def _step_stats(i):
+    from bayesfast.samplers.hmc_utils.stats import NStepStats
+    return NStepStats(logp=-i, energy=i, tree_depth=i % 5, tree_size=i,
+                      mean_tree_accept=0.8, step_size=0.1, step_size_bar=0.1,
+                      warmup=(i < 3), energy_change=0.01 * i,
+                      max_energy_change=0.02 * i, diverging=(i % 7 == 0))
+
+
+def test_stats_growth():
+    import pickle
+    from bayesfast.samplers.hmc_utils.stats import NStats
+
+    stats = NStats()
+    for i in range(5):
+        stats.update(_step_stats(i))
+    before = stats.get()
+    # grow past the initial (empty) preallocation several times
+    for i in range(5, 100):
+        stats.update(_step_stats(i))
+    stats._reserve(200)
+    after = stats.get()
+    assert stats.n_iter == 100 and stats.n_warmup == 3
+    for k in before:
+        assert np.array_equal(before[k], after[k][:2])
+    assert np.array_equal(after['logp'], -np.arange(3, 100))
+    assert after['tree_size'].dtype.kind == 'i'
+    assert after['diverging'].dtype == np.bool_
+    assert not after['logp'].flags.writeable
+    try:
+        stats._n_int_step
+        assert False
+    except AttributeError:
+        pass
+
+    stats_new = pickle.loads(pickle.dumps(stats))
+    assert stats_new._buffers['logp']._data.shape[0] == 100
+    for k, v in stats_new.get(include_warmup=True).items():
+        assert np.array_equal(v, stats.get(include_warmup=True)[k])
+    stats_new.update(_step_stats(100))
+    assert stats_new.n_iter == 101 and stats.n_iter == 100
+
+
+def test_trace_readonly():
+    import pickle
+
+    t = NTrace(n_chain=1, n_iter=10, n_warmup=3, x_0=np.zeros(2))
+    t._init_chain(0)
+    for i in range(10):
+        t.update(np.full(2, i), _step_stats(i))
+    assert np.array_equal(t.samples[:, 0], np.arange(10))
+    assert not t.samples.flags.writeable and not t.logp.flags.writeable
+    try:
+        t.samples[0] = 1.
+        assert False
+    except ValueError:
+        pass
+    t._samples[-1] = -1.
+    assert t.samples[-1, 0] == -1.
+
+    t_new = pickle.loads(pickle.dumps(t))
+    assert np.array_equal(t_new.samples, t.samples)
+    assert np.array_equal(t_new.logp, t.logp)
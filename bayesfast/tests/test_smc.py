@@ -0,0 +1,50 @@
+import numpy as np
+from bayesfast.samplers import SMC, STrace
+
+mu = np.array([3., -1.])
+var = np.array([1., 4.])
+
+
+def logp(x):
+    return -0.5 * np.sum((x - mu)**2 / var, axis=-1)
+
+
+def test_smc():
+    t = STrace(n_chain=2000, reference={'mean': np.zeros(2), 'cov': np.eye(2)},
+               random_generator=0)
+    t._init_chain(0)
+    t = SMC(logp, t).run(verbose=False)
+    x = t.samples
+    assert t.finished and t.betas[-1] == 1.
+    assert x.shape == (2000, 2)
+    assert np.all(np.abs(np.mean(x, axis=0) - mu) < 0.2)
+    assert np.all(np.abs(np.var(x, axis=0) / var - 1.) < 0.2)
+    assert np.abs(t.logz - np.log(2 * np.pi * 2.)) < 0.3
+    assert t.n_call == 2000 * (1 + 5 * t.i_iter)
+
+
+class _AffineSIT:
+    """Minimal object with the interface of a fitted SIT."""
+    dim = 2
+
+    def backward_transform(self, y):
+        return mu + y * var**0.5, np.full(y.shape[0], 0.5 * np.log(var).sum())
+
+    def sample(self, n):
+        raise RuntimeError('the generator of the SIT should not be used.')
+
+    def logq(self, x):
+        return (-0.5 * np.sum((x - mu)**2 / var, axis=-1) -
+                np.log(2 * np.pi) - 0.5 * np.sum(np.log(var)))
+
+
+def test_smc_sit_reference():
+    x = []
+    for seed in (0, 0, 1):
+        t = STrace(n_chain=500, reference=_AffineSIT(), random_generator=seed)
+        t._init_chain(0)
+        t = SMC(logp, t).run(verbose=False)
+        assert t.finished
+        x.append(t.samples)
+    assert np.array_equal(x[0], x[1]) and not np.allclose(x[0], x[2])
+    assert np.all(np.abs(np.mean(x[0], axis=0) - mu) < 0.3)
@@ -0,0 +1,66 @@
+import os
+import pickle
+import numpy as np
+import bayesfast as bf
+from bayesfast.utils.storage import MemmapStorage, MemmapBuffer
+
+a = np.arange(1., 6.)
+
+
+def logp_and_grad(x):
+    return -0.5 * np.sum(a * x**2), -a * x
+
+
+def run(storage=None, parallel_backend='serial'):
+    density = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=5)
+    return bf.sample(density, {'n_chain': 2, 'n_iter': 300, 'n_warmup': 100,
+                     'x_0': np.ones((2, 5)), 'random_generator': 0,
+                     'storage': storage}, parallel_backend=parallel_backend,
+                     verbose=False)
+
+
+def check_equal(t, t_new):
+    assert np.array_equal(t.get(), t_new.get())
+    for s, s_new in zip(t, t_new):
+        for k, v in s.stats.get(include_warmup=True).items():
+            assert np.array_equal(v, s_new.stats.get(include_warmup=True)[k])
+
+
+def load(path, name):
+    return MemmapBuffer.load(os.path.join(path, name + '.dat'))
+
+
+def test_memmap_storage(tmp_path):
+    t = run()
+    storage = MemmapStorage(tmp_path, flush_every=7)
+    t_memmap = run(storage)
+    check_equal(t, t_memmap)
+    assert isinstance(t_memmap[0]._samples_buffer, MemmapBuffer)
+
+    # recover from the files on disk alone, as if the process had died
+    for i, s in enumerate(t):
+        buffer = load(tmp_path, 'chain-{}-samples'.format(i))
+        # only the elements up to the last flush are recorded
+        assert len(buffer) == 300 // 7 * 7
+        assert np.array_equal(buffer.view, s.samples[:len(buffer)])
+
+    # reopen from the pickle, which memory-maps the same files again
+    t_reopened = pickle.loads(pickle.dumps(t_memmap))
+    check_equal(t, t_reopened)
+    assert (t_reopened[1]._samples_buffer.filename ==
+            t_memmap[1]._samples_buffer.filename)
+    for i, s in enumerate(t):
+        buffer = load(tmp_path, 'chain-{}-samples'.format(i))
+        assert np.array_equal(buffer.view, s.samples)
+        assert np.array_equal(load(tmp_path, 'chain-{}-logp'.format(i)).view,
+                              s.stats.get(include_warmup=True)['logp'])
+        buffer.append(np.zeros(5))
+        assert len(buffer) == 301
+
+    path = tmp_path / 'process'
+    t_process = run({'path': path, 'prefix': 'run'}, 2)
+    check_equal(t, t_process)
+    for i, s in enumerate(t):
+        t_process[i]._samples_buffer.flush()
+        buffer = load(path, 'run-chain-{}-samples'.format(i))
+        assert np.array_equal(buffer.view, s.samples)
@@ -0,0 +1,81 @@
+import numpy as np
+import bayesfast as bf
+from scipy.special import logsumexp
+
+mu = np.array([[-5., -5.], [5., 5.]])
+
+
+def logp_and_grad(x):
+    d = x - mu
+    l = -0.5 * np.sum(d**2, axis=1)
+    w = np.exp(l - logsumexp(l))
+    return logsumexp(l), -np.sum(w[:, np.newaxis] * d, axis=0)
+
+
+def test_replica_exchange():
+    density = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=2)
+    re = bf.samplers.ReplicaExchange(n_temp=4, beta_min=0.02)
+    t = bf.sample(density, {'n_chain': 1, 'n_iter': 1000, 'n_warmup': 300,
+                  'x_0': [-5., -5.], 'random_generator': 0},
+                  parallel_backend=4, tempering=re, verbose=False)
+    assert t.n_chain == 1
+    assert 0.1 < np.mean(t.get()[:, 0] > 0) < 0.9
+    assert np.all(re.n_accepted > 0)
+
+
+def test_tempered_rng():
+    a = np.arange(1., 4.)
+
+    def logp_and_grad_base(x):
+        return -0.5 * np.sum(x**2), -x
+
+    def logp_and_grad_2(x):
+        return -0.5 * np.sum(a * x**2), -a * x
+
+    density_base = bf.DensityLite(logp_and_grad=logp_and_grad_base,
+                                  input_size=3)
+    for trace_class, sampler_class, kwargs in (
+        (bf.samplers.THTrace, bf.samplers.THMC, {}),
+        (bf.samplers.TNTrace, bf.samplers.TNUTS, {'speculative': False})):
+        for rng_buffer in (0, 16):
+            x = []
+            for seed in (0, 1):
+                # the global random state should not be used
+                np.random.seed(seed)
+                t = trace_class(density_base, n_chain=1, n_iter=10,
+                                n_warmup=5, x_0=np.ones(3),
+                                random_generator=0, rng_buffer=rng_buffer,
+                                **kwargs)
+                t._init_chain(0)
+                assert (t._rng is t.random_generator) == (rng_buffer == 0)
+                sampler = sampler_class(logp_and_grad=logp_and_grad_2,
+                                        sample_trace=t)
+                sampler.warmup = True
+                sampler.astep()
+                x.append(np.append(t.stats._u[-1], t._samples[-1]))
+            assert np.array_equal(x[0], x[1])
+
+
+def test_tempered_trace_readonly():
+    from bayesfast.samplers.hmc_utils.stats import THStepStats
+    density_base = bf.DensityLite(logp_and_grad=logp_and_grad, input_size=2)
+    t = bf.samplers.THTrace(density_base, n_chain=1, n_iter=10, n_warmup=3,
+                            x_0=np.zeros(2))
+    t._init_chain(0)
+    for i in range(10):
+        t.update(np.full(2, i), THStepStats(
+            u=0.1 * i, weight=0.5 * i, logp=-i, energy=i, n_int_step=4,
+            accept_stat=0.8, accepted=True, step_size=0.1, step_size_bar=0.1,
+            warmup=(i < 3), energy_change=0., diverging=False))
+    assert np.allclose(t.u, 0.1 * np.arange(10))
+    assert np.allclose(t.weights, 0.5 * np.arange(10))
+    assert np.allclose(t.get(return_type='weights'), 0.5 * np.arange(3, 10))
+    assert np.allclose(t.get(return_type='u'), 0.1 * np.arange(3, 10))
+    for a in (t.u, t.weights, t.get(return_type='weights')):
+        assert not a.flags.writeable
+        try:
+            a[0] = 1.
+            assert False
+        except ValueError:
+            pass
+    assert t.weights[0] == 0.
@@ -227,7 +227,8 @@ class SIT:
         return c
 
     def _gaussianize_nd(self, x):
-        map_result = self.parallel_backend.map(self._gaussianize_1d, x.T)
+        map_result = self.parallel_backend.map(self._gaussianize_1d, x.T,
+                                               shared_memory='auto')
         self._cubic.append(map_result)
         y = np.array([map_result[i](x[:, i]) for i in range(self.dim)]).T
         return y
@@ -1,9 +1,11 @@
 from .acor import integrated_time, AutocorrError
-from .collections import PropertyList, VariableDict
+from .diagnostics import split_rhat, ess_bulk, ess_tail
+from .collections import PropertyList, VariableDict, ArrayBuffer
 from .cubic import cubic_spline
 from .kde import kde
 from .laplace import Laplace, untemper_laplace_samples
 from . import random
 from . import parallel
 from . import sobol
+from . import storage
 from .misc import all_isinstance, make_positive, SystematicResampler
@@ -3,7 +3,7 @@ import numpy as np
 import copy
 import warnings
 
-__all__ = ['VariableDict', 'PropertyList']
+__all__ = ['VariableDict', 'PropertyList', 'ArrayBuffer']
 
 
 class VariableDict:
@@ -91,6 +91,17 @@ class PropertyList:
             self._list = list(self._list)
         else:
             raise ValueError('check should be callable or None.')
+        self._set_methods()
+
+    def __getstate__(self):
+        """The wrapped methods are closures, which cannot be pickled."""
+        return {'_list': self._list, '_check': self._check}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._set_methods()
+
+    def _set_methods(self):
         self.append = self._wrapper(self._list.append)
         self.extend = self._wrapper(self._list.extend)
         self.insert = self._wrapper(self._list.insert)
@@ -133,3 +144,109 @@ class PropertyList:
             self.check()
             return res
         return _wrapped
+
+
+class ArrayBuffer:
+    """
+    Growable buffer of arrays, preallocated along the first axis.
+
+    Parameters
+    ----------
+    size : non-negative int, optional
+        The number of elements to preallocate. The buffer will be doubled in
+        size when it is full. Set to `0` by default.
+    dtype : None or data-type, optional
+        The dtype of the buffer. If `None`, will be determined by the first
+        element appended to the buffer. Set to `None` by default.
+
+    Notes
+    -----
+    The shape of the elements is determined by the first element appended to
+    the buffer. `view` returns a zero-copy view of the filled part
+    of the buffer, which will not see the elements appended after the buffer
+    grows. `readonly_view` is the same view, but not writable.
+    """
+    def __init__(self, size=0, dtype=None):
+        self._data = None
+        self._n = 0
+        self._dtype = dtype
+        self.size = size
+
+    def __getstate__(self):
+        """Only the filled part of the buffer needs to be pickled."""
+        self_dict = self.__dict__.copy()
+        if self._data is not None:
+            self_dict['_data'] = self.view.copy()
+        return self_dict
+
+    @property
+    def size(self):
+        return self._size
+
+    @size.setter
+    def size(self, n):
+        try:
+            n = int(n)
+            assert n >= 0
+        except Exception:
+            raise ValueError('size should be a non-negative int.')
+        self._size = n
+        if self._data is not None and self._data.shape[0] < n:
+            self._resize(n)
+
+    def _allocate(self, n, shape, dtype):
+        return np.empty((n,) + shape, dtype=dtype)
+
+    def _resize(self, n):
+        data = self._allocate(n, self._data.shape[1:], self._data.dtype)
+        data[:self._n] = self._data[:self._n]
+        self._data = data
+
+    def _reserve(self, x, n_new):
+        """Make sure there is enough space for n_new more elements."""
+        if self._data is None:
+            x = np.asarray(x, dtype=self._dtype)
+            self._data = self._allocate(max(self._size, n_new, 1), x.shape,
+                                        x.dtype)
+        elif self._n + n_new > self._data.shape[0]:
+            self._resize(max(2 * self._n, self._n + n_new, self._size))
+
+    def append(self, x):
+        self._reserve(x, 1)
+        self._data[self._n] = x
+        self._n += 1
+
+    def extend(self, xs):
+        xs = np.asarray(xs, dtype=self._dtype)
+        if xs.shape[0] == 0:
+            return
+        self._reserve(xs[0], xs.shape[0])
+        self._data[self._n:(self._n + xs.shape[0])] = xs
+        self._n += xs.shape[0]
+
+    def truncate(self, n):
+        self._n = min(self._n, int(n))
+
+    @property
+    def view(self):
+        if self._data is None:
+            return np.empty(0, dtype=self._dtype)
+        return self._data[:self._n]
+
+    @property
+    def readonly_view(self):
+        view = self.view.view()
+        view.flags.writeable = False
+        return view
+
+    def __array__(self, dtype=None):
+        return np.asarray(self.view, dtype=dtype)
+
+    def __getitem__(self, key):
+        return self.view.__getitem__(key)
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        return self.view.__iter__()
@@ -0,0 +1,166 @@
+import numpy as np
+from scipy.special import ndtri
+from .acor import function_1d
+
+__all__ = ['split_rhat', 'ess_bulk', 'ess_tail']
+
+# References: Vehtari et al. 2021, https://arxiv.org/abs/1903.08008
+#             https://github.com/stan-dev/stan/blob/develop/src/stan/analyze/mcmc
+
+
+def _check_chains(x):
+    try:
+        x = np.asarray(x, dtype=np.float)
+        if x.ndim == 1:
+            x = x[np.newaxis, :, np.newaxis]
+        elif x.ndim == 2:
+            x = x[..., np.newaxis]
+        assert x.ndim == 3
+        assert x.shape[1] >= 4
+    except Exception:
+        raise ValueError('x should be an array with shape (n_chain, n_iter) or'
+                         ' (n_chain, n_iter, n_dim), and n_iter >= 4.')
+    return x
+
+
+def _split_chains(x):
+    n_half = x.shape[1] // 2
+    return np.concatenate((x[:, :n_half], x[:, -n_half:]), axis=0)
+
+
+def _rank_normalize(x):
+    # x has shape (n_chain, n_iter), and all the draws are ranked together
+    s = x.size
+    r = np.empty(s)
+    r[np.argsort(x, axis=None, kind='mergesort')] = np.arange(1, s + 1)
+    return ndtri((r.reshape(x.shape) - 0.375) / (s + 0.25))
+
+
+def _rhat_1d(x):
+    m, n = x.shape
+    chain_mean = np.mean(x, axis=1)
+    chain_var = np.var(x, axis=1, ddof=1)
+    b = n * np.var(chain_mean, ddof=1)
+    w = np.mean(chain_var)
+    if not w > 0:
+        return np.nan
+    return ((n - 1) / n * w + b / n)**0.5 / w**0.5
+
+
+def _ess_1d(x):
+    m, n = x.shape
+    chain_var = np.var(x, axis=1)
+    if not np.var(x) > 0:
+        return np.nan
+    # a chain stuck at a constant value contributes zero autocovariance
+    acov = np.mean([function_1d(x_i) * v_i if v_i > 0 else np.zeros(n) for
+                    x_i, v_i in zip(x, chain_var)], axis=0)
+    w = acov[0] * n / (n - 1.)
+    var_plus = w * (n - 1.) / n
+    if m > 1:
+        var_plus += np.var(np.mean(x, axis=1), ddof=1)
+
+    # Geyer's initial monotone sequence
+    rho = np.zeros(n)
+    rho[0] = rho_even = 1.
+    rho[1] = rho_odd = 1. - (w - acov[1]) / var_plus
+    t = 1
+    while t < n - 3 and rho_even + rho_odd > 0.:
+        rho_even = 1. - (w - acov[t + 1]) / var_plus
+        rho_odd = 1. - (w - acov[t + 2]) / var_plus
+        if rho_even + rho_odd >= 0.:
+            rho[t + 1] = rho_even
+            rho[t + 2] = rho_odd
+        t += 2
+    t_max = t
+    if rho_even > 0.:
+        rho[t_max + 1] = rho_even
+    t = 1
+    while t <= t_max - 2:
+        if rho[t + 1] + rho[t + 2] > rho[t - 1] + rho[t]:
+            rho[t + 1] = rho[t + 2] = (rho[t - 1] + rho[t]) / 2.
+        t += 2
+    tau = -1. + 2. * np.sum(rho[:t_max]) + rho[t_max + 1]
+    tau = max(tau, 1. / np.log10(m * n))
+    return m * n / tau
+
+
+def split_rhat(x):
+    """
+    Rank-normalized split R-hat of multiple chains.
+
+    Parameters
+    ----------
+    x : array_like
+        The samples, with shape `(n_chain, n_iter)` or
+        `(n_chain, n_iter, n_dim)`.
+
+    Returns
+    -------
+    rhat : 1-d array
+        The R-hat of each variable, defined as the larger one of the
+        bulk and the folded R-hat.
+    """
+    x = _split_chains(_check_chains(x))
+    rhat = np.empty(x.shape[-1])
+    for i in range(x.shape[-1]):
+        x_i = x[..., i]
+        x_f = np.abs(x_i - np.median(x_i))
+        rhat[i] = max(_rhat_1d(_rank_normalize(x_i)),
+                      _rhat_1d(_rank_normalize(x_f)))
+    return rhat
+
+
+def ess_bulk(x):
+    """
+    Bulk effective sample size of multiple chains.
+
+    Parameters
+    ----------
+    x : array_like
+        The samples, with shape `(n_chain, n_iter)` or
+        `(n_chain, n_iter, n_dim)`.
+
+    Returns
+    -------
+    ess : 1-d array
+        The effective sample size of the rank-normalized split chains for each
+        variable.
+    """
+    x = _split_chains(_check_chains(x))
+    return np.array([_ess_1d(_rank_normalize(x[..., i])) for i in
+                     range(x.shape[-1])])
+
+
+def ess_tail(x, prob=0.05):
+    """
+    Tail effective sample size of multiple chains.
+
+    Parameters
+    ----------
+    x : array_like
+        The samples, with shape `(n_chain, n_iter)` or
+        `(n_chain, n_iter, n_dim)`.
+    prob : float, optional
+        The tail probability. The result is the smaller one of the effective
+        sample sizes for the `prob` and `1 - prob` quantiles. Set to `0.05` by
+        default.
+
+    Returns
+    -------
+    ess : 1-d array
+        The tail effective sample size of each variable.
+    """
+    x = _split_chains(_check_chains(x))
+    try:
+        prob = float(prob)
+        assert 0. < prob < 0.5
+    except Exception:
+        raise ValueError('prob should be a float between 0 and 0.5.')
+    ess = np.empty(x.shape[-1])
+    for i in range(x.shape[-1]):
+        x_i = x[..., i]
+        q_l, q_u = np.quantile(x_i, (prob, 1. - prob))
+        ess[i] = min(_ess_1d((x_i <= q_l).astype(np.float)),
+                     _ess_1d((x_i <= q_u).astype(np.float)))
+    return ess
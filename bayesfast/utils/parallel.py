@@ -1,10 +1,11 @@
 try:
+    import ray
     from ray.util.multiprocessing import Pool as RayPool
     HAS_RAY = True
 except Exception:
     HAS_RAY = False
 try:
-    from distributed import Client
+    from distributed import Client, get_worker
     HAS_DASK = True
 except Exception:
     HAS_DASK = False
@@ -19,15 +20,27 @@ try:
 except Exception:
     HAS_LOKY = False
 from multiprocess.pool import Pool
+from concurrent.futures import ThreadPoolExecutor
+from threadpoolctl import threadpool_limits
+from collections import OrderedDict, deque
+import asyncio
+import inspect
+import numpy as np
+import threading
+import weakref
+import atexit
 import warnings
-# from copy import deepcopy
+import time
+import os
+import dill
+import hashlib
+import tempfile
+import shutil
 # we have to import Pool after Client to avoid some strange error
 
-__all__ = ['ParallelBackend', 'get_backend', 'set_backend']
+__all__ = ['ParallelBackend', 'Broadcast', 'AsyncioExecutor', 'StragglerPolicy',
+           'TolerantMap', 'get_backend', 'set_backend']
 
-# TODO: maybe we should add a multiprocess-style chunksize for dask
-#       since currently it's not good at handling a very large number of tasks
-#       https://distributed.dask.org/en/latest/efficiency.html#use-larger-tasks
 # TODO: should the default value be None or "multiprocess"?
 
 
@@ -35,9 +48,13 @@ class ParallelBackend:
     """
     The unified backend for parallelization.
     
-    Currently, we support `multiprocess`, `dask`, `sharedmem` and `loky`.
-    `multiprocess` usually has better performance on single-node machines, while
-    `dask` can be used for multi-node parallelization. Note the following known
+    Currently, we support `multiprocess`, `dask`, `sharedmem`, `loky`, `thread`,
+    `asyncio` and `serial`. `multiprocess` usually has better performance on
+    single-node machines, while `dask` can be used for multi-node
+    parallelization. `thread` can be useful when the evaluation releases the
+    GIL, e.g. in external codes, `asyncio` is designed for the modules that
+    wait for external executables or servers, see `AsyncioExecutor`, and
+    `serial` runs everything in the current process. Note the following known
     issues: when used for sampling, (1) `dask` and `loky` do not respect the
     global bayesfast random seed; (2) `sharedmem` may not display the progress
     messages correctly (multiple messages in the same line); (3) `loky` does not
@@ -46,36 +63,293 @@ class ParallelBackend:
     
     Parameters
     ----------
-    backend : None, int, Pool, Client or MapReduce, optional
+    backend : None, int, Pool, Client, MapReduce, ThreadPoolExecutor, AsyncioExecutor, 'thread', 'asyncio' or 'serial', optional
         The backend for parallelization. If `None` or `int`, will be passed as
-        the `processes` argument to initialize a Pool in a with context. Set to
-        `None` by default.
+        the `processes` argument to initialize a Pool in a with context. If
+        `'thread'` or `'asyncio'`, a ThreadPoolExecutor or an AsyncioExecutor
+        with the default settings will be initialized in a with context. Set
+        to `None` by default.
+    persistent : bool, optional
+        Only used when `backend` is `None`, `int`, `'thread'` or `'asyncio'`.
+        If `True`, the
+        Pool will be created when it is first used, and kept alive after the
+        with context exits, so that it can be reused by the following with
+        contexts, until `shutdown` is called or it has been idle for
+        `idle_timeout` seconds. Otherwise, a new Pool will be created and
+        closed for each outermost with context. Set to `True` by default.
+    idle_timeout : None or positive float, optional
+        If not `None`, a persistent Pool will be shut down after it has not been
+        used by any with context for `idle_timeout` seconds. Set to `None` by
+        default.
+    n_thread : None, positive int or 'auto', optional
+        The max number of BLAS/OpenMP threads used by each worker. If `'auto'`,
+        the available cores will be split evenly between the workers, i.e.
+        `max(1, n_core // n_worker)`. If `None`, the threads will not be
+        limited. Set to `'auto'` by default.
+
+    Notes
+    -----
+    The with contexts are reference counted, so it is fine to enter the same
+    backend in nested with contexts, e.g. when `sample` is called inside
+    `Recipe`. The Pool is only created when it is first used in a with
+    context, and the small maps with `chunksize='auto'` that are estimated to
+    finish within 10 ms are evaluated serially in the current process, so the
+    Pool may never be created for tiny workloads.
+
+    Large callables, like the bound methods of a `Density`, can be shipped to
+    the workers only once with `broadcast`, so that only the points are sent
+    with each task.
+
+    Without limiting, each worker process would start as many BLAS and OpenMP
+    (e.g. in the polynomial surrogates) threads as there are cores, which
+    oversubscribes the machine. The `n_thread` limit is applied with
+    threadpoolctl in the worker processes before running the tasks, and is
+    kept by the workers afterwards. For the `thread` and `asyncio` backends,
+    whose workers share the current process, the limit is applied to this
+    process during `map` and `map_tolerant`, but not `map_async`. The `serial`
+    backend and the code running in this process outside the maps, e.g. the
+    surrogate fitting, can use all the cores. The `dask` workers are not
+    limited unless `n_thread` is an int, since they may be on other machines.
+    Note that `sample` always uses a single thread for each chain.
     """
-    def __new__(cls, backend=None):
+    def __new__(cls, backend=None, persistent=True, idle_timeout=None,
+                n_thread='auto'):
         if isinstance(backend, ParallelBackend):
             return backend
         else:
             return super(ParallelBackend, cls).__new__(cls)
 
-    def __init__(self, backend=None):
+    def __init__(self, backend=None, persistent=True, idle_timeout=None,
+                 n_thread='auto'):
         if isinstance(backend, ParallelBackend):
             return
+        self._n_active = 0
+        self._lock = threading.RLock()
+        self._timer = None
+        self._backend_activated = None
+        self._latency = {}
+        self._broadcasts = OrderedDict()
+        self._tmp_dir = None
         self.backend = backend
+        self.persistent = persistent
+        self.idle_timeout = idle_timeout
+        self.n_thread = n_thread
+
+    def __getstate__(self):
+        """The Pool and the lock cannot be pickled."""
+        self_dict = self.__dict__.copy()
+        if self._owns_pool:
+            self_dict['_backend_activated'] = None
+        self_dict['_n_active'] = 0
+        self_dict['_lock'] = None
+        self_dict['_timer'] = None
+        self_dict['_broadcasts'] = OrderedDict()
+        return self_dict
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
     def __enter__(self):
-        if self.backend is None or isinstance(self.backend, int):
-            self._backend_activated = Pool(self.backend)
-        elif HAS_SHAREDMEM and isinstance(self.backend, MapReduce):
-            self.backend.__enter__()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if (HAS_SHAREDMEM and isinstance(self.backend, MapReduce) and
+                  self._n_active == 0):
+                self.backend.__enter__()
+            self._n_active += 1
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if self.backend is None or isinstance(self.backend, int):
+        with self._lock:
+            self._n_active -= 1
+            if self._n_active > 0:
+                return
+            if self._owns_pool:
+                if not self.persistent:
+                    self._close_pool()
+                elif self.idle_timeout is not None:
+                    self._timer = threading.Timer(self.idle_timeout,
+                                                  self._idle_shutdown)
+                    self._timer.daemon = True
+                    self._timer.start()
+            elif HAS_SHAREDMEM and isinstance(self.backend, MapReduce):
+                self.backend.__exit__(exc_type, exc_val, exc_tb)
+
+    @property
+    def _owns_pool(self):
+        return (self.backend is None or isinstance(self.backend, int) or
+                (isinstance(self.backend, str) and self.backend != 'serial'))
+
+    def _close_pool(self):
+        if isinstance(self._backend_activated, Pool):
             self._backend_activated.close()
             self._backend_activated.join()
-            self._backend_activated = None
-        elif HAS_SHAREDMEM and isinstance(self.backend, MapReduce):
-            self.backend.__exit__(exc_type, exc_val, exc_tb)
+        elif isinstance(self._backend_activated,
+                        (ThreadPoolExecutor, AsyncioExecutor)):
+            self._backend_activated.shutdown(wait=True)
+        self._backend_activated = None
+
+    def _idle_shutdown(self):
+        with self._lock:
+            if self._n_active == 0:
+                self._timer = None
+                self._close_pool()
+
+    def shutdown(self):
+        """
+        Shut down the persistent Pool created by this backend, if any.
+
+        Will raise a RuntimeError if it is still being used in a with context.
+        A new Pool will be created the next time the backend is entered.
+        """
+        with self._lock:
+            if self._n_active > 0:
+                raise RuntimeError('the backend is still being used in a with '
+                                   'context.')
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if self._owns_pool:
+                self._close_pool()
+
+    # the number of broadcast objects kept alive by the parent
+    _n_broadcast = 4
+
+    def broadcast(self, obj):
+        """
+        Ship an object to the workers once, and return a handle to it.
+
+        Parameters
+        ----------
+        obj : object
+            The object to broadcast, usually a callable.
+
+        Returns
+        -------
+        handle : Broadcast
+            A small picklable handle, which can be used in place of `obj` in
+            `map` and `map_async`. Calling it calls `obj` in the worker.
+
+        Notes
+        -----
+        `obj` is identified by the hash of its pickle, so broadcasting an object
+        that has not changed since the last time reuses the copy in the
+        workers, while any modification, e.g. refitting the surrogate models of
+        a `Density`, automatically leads to a new copy. For `dask`, `obj` is
+        scattered to all the workers, and for `ray`, it is put into the object
+        store. For the other backends, which run on a single machine, `obj` is
+        written to a temporary file, which is loaded once by each worker,
+        except that nothing needs to be shipped for `serial`, `thread` and
+        `asyncio`.
+        """
+        payload = dill.dumps(obj)
+        key = hashlib.sha1(payload).hexdigest()
+        with self._lock:
+            if key in self._broadcasts:
+                self._broadcasts.move_to_end(key)
+                handle = self._broadcasts[key]
+                handle._obj = obj
+                return handle
+            handle = Broadcast(key, _fun_key(obj))
+            handle._obj = obj
+            be = self.backend_activated
+            if self.kind in ('serial', 'thread', 'asyncio'):
+                # the object is used directly in this process
+                pass
+            elif HAS_DASK and isinstance(be, Client):
+                handle._future = be.scatter(obj, broadcast=True, hash=False)
+                handle._dask_key = handle._future.key
+            elif HAS_RAY and isinstance(be, RayPool):
+                handle._ref = ray.put(obj)
+            else:
+                handle._path = os.path.join(self._get_tmp_dir(), key + '.pkl')
+                with open(handle._path + '.tmp', 'wb') as f:
+                    f.write(payload)
+                os.replace(handle._path + '.tmp', handle._path)
+            self._broadcasts[key] = handle
+            while len(self._broadcasts) > self._n_broadcast:
+                _, old = self._broadcasts.popitem(last=False)
+                old._release()
+            return handle
+
+    @property
+    def persistent(self):
+        return self._persistent
+
+    @persistent.setter
+    def persistent(self, p):
+        self._persistent = bool(p)
+
+    @property
+    def idle_timeout(self):
+        return self._idle_timeout
+
+    @idle_timeout.setter
+    def idle_timeout(self, it):
+        if it is None:
+            self._idle_timeout = None
+        else:
+            try:
+                it = float(it)
+                assert it > 0.
+            except Exception:
+                raise ValueError('idle_timeout should be a positive float or '
+                                 'None.')
+            self._idle_timeout = it
+
+    @property
+    def n_thread(self):
+        return self._n_thread
+
+    @n_thread.setter
+    def n_thread(self, nt):
+        if nt is None or nt == 'auto':
+            self._n_thread = nt
+        else:
+            try:
+                nt = int(nt)
+                assert nt > 0
+            except Exception:
+                raise ValueError('n_thread should be a positive int, "auto" '
+                                 'or None.')
+            self._n_thread = nt
+
+    @property
+    def n_thread_worker(self):
+        """
+        The number of BLAS/OpenMP threads for each worker determined by
+        `n_thread`, or `None` if the workers are not limited.
+        """
+        if self.n_thread is None or self.kind == 'serial':
+            return None
+        elif self.n_thread == 'auto':
+            if self.kind == 'dask':
+                return None
+            return max(1, _n_core() // self.n_worker)
+        else:
+            return self.n_thread
+
+    def _limit_threads(self, fun):
+        """Wrap fun to apply the thread limit in the worker processes."""
+        if self.kind in ('serial', 'thread', 'asyncio'):
+            return fun
+        n_thread = self.n_thread_worker
+        return fun if n_thread is None else _ThreadLimited(fun, n_thread)
+
+    def _thread_context(self):
+        """The thread limit of this process for the in-process workers."""
+        if self.kind in ('thread', 'asyncio'):
+            n_thread = self.n_thread_worker
+            if n_thread is not None:
+                return threadpool_limits(n_thread)
+        return _NullContext()
+
+    @property
+    def is_active(self):
+        """Whether the backend is currently used by a with context."""
+        return self._n_active > 0
 
     @property
     def backend(self):
@@ -85,7 +359,9 @@ class ParallelBackend:
     def backend(self, be):
         if be is None or (isinstance(be, int) and be > 0):
             pass
-        elif isinstance(be, Pool):
+        elif isinstance(be, str) and be in ('serial', 'thread', 'asyncio'):
+            pass
+        elif isinstance(be, (Pool, ThreadPoolExecutor, AsyncioExecutor)):
             pass
         elif HAS_RAY and isinstance(be, RayPool):
             pass
@@ -96,16 +372,30 @@ class ParallelBackend:
         elif HAS_LOKY and isinstance(be,
                                      reusable_executor._ReusablePoolExecutor):
             pass
-        # elif be == 'serial':
-        #     pass
         else:
             raise ValueError('invalid value for backend.')
-        self._backend_activated = be
-        self._backend = be
+        with self._lock:
+            if self._n_active > 0:
+                raise RuntimeError('you should not change backend when it is '
+                                   'being used in a with context.')
+            if self._backend_activated is not None and self._owns_pool:
+                self._close_pool()
+            self._backend = be
+            self._backend_activated = None if self._owns_pool else be
 
     @property
     def backend_activated(self):
-        return self._backend_activated
+        with self._lock:
+            if (self._owns_pool and self._backend_activated is None and
+                self._n_active > 0):
+                if self.backend == 'thread':
+                    self._backend_activated = ThreadPoolExecutor()
+                elif self.backend == 'asyncio':
+                    self._backend_activated = AsyncioExecutor()
+                else:
+                    self._backend_activated = Pool(self.backend)
+                _pool_owners.add(self)
+            return self._backend_activated
 
     @property
     def kind(self):
@@ -113,6 +403,12 @@ class ParallelBackend:
             return 'multiprocess'
         elif isinstance(self.backend, Pool):
             return 'multiprocess'
+        elif isinstance(self.backend, str):
+            return self.backend
+        elif isinstance(self.backend, ThreadPoolExecutor):
+            return 'thread'
+        elif isinstance(self.backend, AsyncioExecutor):
+            return 'asyncio'
         elif HAS_RAY and isinstance(self.backend, RayPool):
             return 'ray'
         elif HAS_DASK and isinstance(self.backend, Client):
@@ -122,16 +418,417 @@ class ParallelBackend:
         elif HAS_LOKY and isinstance(self.backend,
                                      reusable_executor._ReusablePoolExecutor):
             return 'loky'
-        # elif self.backend == 'serial':
-        #     return 'serial'
         else:
             raise RuntimeError('unexpected value for self.backend.')
 
-    def map(self, fun, *iters):
+    @property
+    def n_worker(self):
+        """The number of workers of the activated backend."""
+        if self.kind == 'serial':
+            return 1
+        be = self.backend_activated
+        try:
+            if isinstance(be, Pool):
+                return be._processes
+            elif isinstance(be, ThreadPoolExecutor):
+                return be._max_workers
+            elif isinstance(be, AsyncioExecutor):
+                return be.max_concurrency
+            elif HAS_DASK and isinstance(be, Client):
+                return sum(be.nthreads().values())
+            elif HAS_SHAREDMEM and isinstance(be, MapReduce):
+                return be.np
+            elif HAS_LOKY and isinstance(
+                be, reusable_executor._ReusablePoolExecutor):
+                return be._max_workers
+        except Exception:
+            pass
+        return os.cpu_count() or 1
+
+    # the target wall time of each chunk, and the min number of chunks for
+    # each worker, which are used to determine chunksize='auto'
+    _chunk_time = 0.05
+    _chunk_per_worker = 4
+    # the max estimated wall time of the maps evaluated serially
+    _serial_time = 0.01
+
+    def map(self, fun, *iters, chunksize=None, vectorized=False,
+            shared_memory=False, out_shape=None):
+        """
+        Apply `fun` to each group of elements in `iters` in parallel.
+
+        Parameters
+        ----------
+        fun : callable
+            The function to apply.
+        iters : sequences
+            The arguments of `fun`, which should have the same length.
+        chunksize : None, positive int or 'auto', optional
+            The number of points sent to the workers in each task. If `None`,
+            each point will be a separate task, except that `multiprocess`
+            uses its default chunking. If `'auto'`, will be determined from the
+            per-point latency of `fun` measured in the previous calls (or in a
+            pilot batch with one point for each worker), such that each task
+            takes about `0.05` seconds, while there are still at least `4`
+            tasks for each worker to balance the load. In addition, if there is
+            only one point, or the whole map is estimated to finish within
+            `0.01` seconds, it will be evaluated serially in this process. Set
+            to `None` by default.
+        vectorized : bool, optional
+            If `True`, `fun` will be called once for each chunk, with the
+            arrays of the chunk stacked along the first axis, and should return
+            a sequence of the results for each point. If `chunksize` is `None`,
+            `'auto'` will be used instead. Set to `False` by default.
+        shared_memory : bool or 'auto', optional
+            If `True`, `iters` should be numerical arrays, which will be written
+            once to memory-mapped files (in `/dev/shm` if available), and the
+            workers read their slices from there, so that only the indices are
+            sent with each task. If `out_shape` is not `None`, the results are
+            also written by the workers to such a file. Only works for the
+            `multiprocess`, `sharedmem`, `loky` and `thread` backends, which run
+            on a single machine. If `'auto'`, will be used when possible and the
+            arrays are larger than 1 MB. If `chunksize` is `None`, `'auto'`
+            will be used instead. Set to `False` by default.
+        out_shape : None or tuple of ints, optional
+            If not `None`, the result for each point should be a float (array)
+            with this shape, and the results are returned as an array with
+            shape `(n,) + out_shape`. Set to `None` by default.
+
+        Returns
+        -------
+        result : list or array
+            The results for each point.
+        """
+        if self.kind == 'asyncio':
+            # the executor does the batching itself
+            with self._thread_context():
+                result = self.gather(self.backend_activated.map(
+                    fun, *iters, vectorized=vectorized))
+            if out_shape is not None:
+                result = np.asarray(result, dtype=np.float).reshape(
+                    (-1,) + tuple(out_shape))
+            return result
+        shared = self._use_shared(shared_memory, iters)
+        if chunksize is None and not vectorized and not shared:
+            result = self._map(fun, *iters)
+            if out_shape is not None:
+                result = np.asarray(result, dtype=np.float).reshape(
+                    (-1,) + tuple(out_shape))
+            return result
+        if chunksize is None:
+            chunksize = 'auto'
+        if chunksize != 'auto':
+            try:
+                chunksize = int(chunksize)
+                assert chunksize > 0
+            except Exception:
+                raise ValueError('chunksize should be None, a positive int or '
+                                 '"auto".')
+        iters = [it if isinstance(it, np.ndarray) else list(it) for it in
+                 iters]
+        n = min(len(it) for it in iters) if iters else 0
+        if out_shape is not None:
+            out_shape = (n,) + tuple(out_shape)
+        if n == 0:
+            return [] if out_shape is None else np.empty(out_shape)
+        key = _fun_key(fun)
+        if chunksize == 'auto' and self._use_serial(n, key):
+            result, t = _ChunkRunner(fun, vectorized)(*iters)
+            self._update_latency(key, t / n)
+            if out_shape is not None:
+                result = np.asarray(result, dtype=np.float).reshape(out_shape)
+            return result
+        blocks = []
+        try:
+            if shared:
+                for it in iters:
+                    blocks.append(_SharedArray(self._get_tmp_dir(), it))
+                if out_shape is not None:
+                    blocks.append(_SharedArray(self._get_tmp_dir(),
+                                               shape=out_shape))
+                runner = _ChunkRunner(fun, vectorized, blocks[:len(iters)],
+                                      blocks[-1] if out_shape else None)
+            else:
+                runner = _ChunkRunner(fun, vectorized)
+            result = self._map_chunks(runner, iters, n, chunksize, key)
+            if shared and out_shape is not None:
+                return np.array(blocks[-1].get())
+        finally:
+            for blk in blocks:
+                blk.remove()
+        if out_shape is not None:
+            result = np.asarray(result, dtype=np.float).reshape(out_shape)
+        return result
+
+    def _map_chunks(self, runner, iters, n, chunksize, key):
+        result = []
+        i = 0
+        while i < n:
+            if chunksize == 'auto':
+                if key not in self._latency:
+                    bounds = [(j, j + 1) for j in
+                              range(i, min(i + self.n_worker, n))]
+                else:
+                    bounds = _chunk_bounds(i, n, self._auto_chunksize(
+                        self._latency[key], n - i))
+            else:
+                bounds = _chunk_bounds(i, n, chunksize)
+            if runner.inputs is None:
+                out = self._map(runner, *[[it[a:b] for a, b in bounds] for it
+                                          in iters])
+            else:
+                out = self._map(runner, *zip(*bounds))
+            for res, _ in out:
+                result.extend(res)
+            self._update_latency(key, sum(_[1] for _ in out) /
+                                 (bounds[-1][1] - bounds[0][0]))
+            i = bounds[-1][1]
+        return result
+
+    def _update_latency(self, key, t_item):
+        if key in self._latency:
+            self._latency[key] = 0.5 * (self._latency[key] + t_item)
+        else:
+            self._latency[key] = t_item
+
+    def _use_serial(self, n, key):
+        if self.kind == 'serial' or n == 1:
+            return True
+        return (key in self._latency and
+                n * self._latency[key] < self._serial_time)
+
+    # the min size of the arrays for shared_memory='auto'
+    _shared_min_bytes = 2**20
+
+    def _use_shared(self, shared_memory, iters):
+        if not shared_memory:
+            return False
+        supported = self.kind in ('multiprocess', 'sharedmem', 'loky',
+                                  'thread')
+        numerical = len(iters) > 0 and all(
+            isinstance(it, np.ndarray) and it.ndim >= 1 and
+            it.dtype.kind in 'biuf' for it in iters)
+        if shared_memory == 'auto':
+            return (supported and numerical and sum(it.nbytes for it in iters)
+                    >= self._shared_min_bytes)
+        if not numerical:
+            raise ValueError('iters should be numerical arrays for '
+                             'shared_memory.')
+        if not supported:
+            warnings.warn('shared_memory is not supported by the {} backend, '
+                          'so it will not be used.'.format(self.kind),
+                          RuntimeWarning)
+            return False
+        return True
+
+    def _get_tmp_dir(self):
+        if self._tmp_dir is None:
+            root = '/dev/shm' if os.access('/dev/shm', os.W_OK) else None
+            self._tmp_dir = tempfile.mkdtemp(prefix='bayesfast-', dir=root)
+            atexit.register(shutil.rmtree, self._tmp_dir, True)
+        return self._tmp_dir
+
+    def map_tolerant(self, fun, *iters, policy=None, background=False,
+                     max_in_flight=None):
+        """
+        Apply `fun` to each group of elements in `iters`, tolerating the
+        failed, hung and slow evaluations.
+
+        Parameters
+        ----------
+        fun : callable
+            The function to apply.
+        iters : sequences
+            The arguments of `fun`, which should have the same length.
+        policy : None, dict or StragglerPolicy, optional
+            Controlling the timeouts, retries and speculative re-execution. If
+            dict, will be used as the keyword arguments of `StragglerPolicy`.
+            Set to `None` by default, i.e. the default `StragglerPolicy`.
+        background : bool, optional
+            If `True`, the tasks will be dispatched by a background thread, and
+            a `TolerantMap` will be returned immediately, whose results can be
+            collected as they arrive. Set to `False` by default.
+        max_in_flight : None or non-negative int, optional
+            The max number of tasks running at the same time. If `None`, will
+            be `n_worker`. Can be changed later with `TolerantMap`, e.g. to
+            leave some workers for other tasks. Set to `None` by default.
+
+        Returns
+        -------
+        result : list
+            The results for each point, with `None` for the failed ones.
+        is_done : 1-d bool array
+            Whether each point has been successfully evaluated.
+        Or a `TolerantMap`, if `background` is `True`.
+
+        Notes
+        -----
+        Each point is a separate task, and at most `n_worker` tasks are in
+        flight at the same time, so that the elapsed time of each task can be
+        measured. The `serial` and `sharedmem` backends evaluate the points
+        one by one, without timeouts. The abandoned tasks, i.e. the timed out
+        ones and the slower copies, still hold their workers until they
+        return. If all the busy workers of the Pool or ThreadPoolExecutor
+        created by this backend are held by such tasks, the workers will be
+        replaced, so that a hung evaluation does not block the others. This is
+        not done if `background` is `True`, since the other users of the Pool
+        are unknown, nor for the Pools given by the user.
+        """
+        if policy is None:
+            policy = StragglerPolicy()
+        elif isinstance(policy, dict):
+            policy = StragglerPolicy(**policy)
+        elif not isinstance(policy, StragglerPolicy):
+            raise ValueError('policy should be None, a dict or a '
+                             'StragglerPolicy.')
+        tm = TolerantMap(self, fun, list(zip(*iters)), policy, max_in_flight)
+        if background:
+            tm._thread = threading.Thread(target=tm._run, daemon=True)
+            tm._thread.start()
+            return tm
+        with self._thread_context():
+            tm._run()
+        return tm.wait()
+
+    def _run_tolerant(self, tm):
+        """The dispatch loop of map_tolerant, reporting the results to tm."""
+        n = len(tm._args_list)
+        policy = tm._policy
+        is_failed = np.zeros(n, dtype=bool)
+        n_error = np.zeros(n, dtype=np.int)
+        fun = self._limit_threads(tm._fun)
+        pending = deque(range(n))
+        running = [] # [i, task, start time]
+        abandoned = []
+        durations = []
+
+        def n_copy(i):
+            return sum(r[0] == i for r in running)
+
+        def abandon(r):
+            running.remove(r)
+            if not r[1].cancel():
+                abandoned.append(r[1])
+
+        while pending or running:
+            if tm._cancelled:
+                pending.clear()
+            now = time.time()
+            progress = False
+            for r in list(running):
+                if r not in running:
+                    continue
+                i, task, t_0 = r
+                if task.done():
+                    progress = True
+                    running.remove(r)
+                    if tm._is_done[i] or is_failed[i]:
+                        continue
+                    try:
+                        tm._report(i, task.get())
+                        durations.append(now - t_0)
+                        for r2 in [r2 for r2 in running if r2[0] == i]:
+                            abandon(r2)
+                    except Exception:
+                        n_error[i] += 1
+                        if n_copy(i) == 0:
+                            if n_error[i] <= policy.max_retry:
+                                pending.append(i)
+                            else:
+                                is_failed[i] = True
+                elif (policy.timeout is not None and
+                      now - t_0 > policy.timeout):
+                    progress = True
+                    abandon(r)
+                    if n_copy(i) == 0 and not tm._is_done[i]:
+                        n_error[i] += 1
+                        if n_error[i] <= policy.max_retry:
+                            pending.append(i)
+                        else:
+                            is_failed[i] = True
+            abandoned = [t for t in abandoned if not t.done()]
+            n_slot = (self.n_worker if tm.max_in_flight is None else
+                      tm.max_in_flight)
+            n_free = n_slot - len(running) - len(abandoned)
+            if (pending and n_free <= 0 and abandoned and not running and
+                tm._thread is None and self._recycle_workers()):
+                # all the slots are held by the abandoned tasks
+                abandoned = []
+                n_slot = (self.n_worker if tm.max_in_flight is None else
+                          tm.max_in_flight)
+                n_free = n_slot
+            while n_free > 0 and pending:
+                i = pending.popleft()
+                tm._is_started[i] = True
+                running.append([i, self._submit(fun, tm._args_list[i]), now])
+                n_free -= 1
+                progress = True
+            if (policy.speculative and not pending and n_free > 0 and
+                len(durations) >= policy.min_finished):
+                t_slow = policy.speculative_factor * np.median(durations)
+                slow = sorted([r for r in running if n_copy(r[0]) == 1 and
+                               now - r[2] > t_slow], key=lambda r: r[2])
+                for r in slow[:n_free]:
+                    running.append([r[0], self._submit(
+                        fun, tm._args_list[r[0]]), now])
+                    progress = True
+            if not progress:
+                time.sleep(policy.poll_interval)
+
+        if abandoned and tm._thread is None:
+            self._recycle_workers()
+
+    def _recycle_workers(self):
+        """
+        Replace the workers of the Pool or ThreadPoolExecutor created by this
+        backend, which may be stuck in the abandoned tasks, and return whether
+        they have been replaced. The new workers are created when used.
+        """
+        with self._lock:
+            be = self._backend_activated
+            if not self._owns_pool or be is None:
+                return False
+            if isinstance(be, Pool):
+                be.terminate()
+            elif isinstance(be, ThreadPoolExecutor):
+                # the threads cannot be killed, but will not get new tasks
+                be.shutdown(wait=False)
+            else:
+                return False
+            self._backend_activated = None
+            return True
+
+    def _submit(self, fun, args, dry=False):
+        """Submit a single task, returning a _Task, or None if unsupported."""
+        be = self.backend_activated
+        if be is None:
+            raise RuntimeError('the backend is not activated. Please use it in '
+                               'a with context.')
+        if isinstance(be, Pool) or (HAS_RAY and isinstance(be, RayPool)):
+            return True if dry else _Task(be.apply_async(fun, args))
+        elif HAS_DASK and isinstance(be, Client):
+            return True if dry else _Task(be.submit(fun, *args, pure=False))
+        elif (isinstance(be, (ThreadPoolExecutor, AsyncioExecutor)) or
+              (HAS_LOKY and isinstance(
+              be, reusable_executor._ReusablePoolExecutor))):
+            return True if dry else _Task(be.submit(fun, *args))
+        else:
+            return None
+
+    def _auto_chunksize(self, t_item, n):
+        n_time = int(self._chunk_time / max(t_item, 1e-9))
+        n_balance = n // (self._chunk_per_worker * self.n_worker)
+        return max(1, min(n_time, n_balance))
+
+    def _map(self, fun, *iters):
         if self.backend_activated is None:
             raise RuntimeError('the backend is not activated. Please use it in '
                                'a with context.')
-        elif isinstance(self.backend_activated, Pool):
+        with self._thread_context():
+            return self._map_activated(self._limit_threads(fun), *iters)
+
+    def _map_activated(self, fun, *iters):
+        if isinstance(self.backend_activated, Pool):
             return self.backend_activated.starmap(fun, zip(*iters))
         elif HAS_RAY and isinstance(self.backend_activated, RayPool):
             return self.backend_activated.starmap(fun, list(zip(*iters)))
@@ -144,8 +841,12 @@ class ParallelBackend:
         elif HAS_LOKY and isinstance(self.backend_activated,
                                      reusable_executor._ReusablePoolExecutor):
             return self.gather(self.backend_activated.map(fun, *iters))
-        # elif self.backend_activated == 'serial':
-        #     return [deepcopy(fun)(*[i[j] for i in iters]) for j in range(l)]
+        elif isinstance(self.backend_activated, ThreadPoolExecutor):
+            return list(self.backend_activated.map(fun, *iters))
+        elif isinstance(self.backend_activated, AsyncioExecutor):
+            return self.backend_activated.map(fun, *iters).result()
+        elif self.kind == 'serial':
+            return [fun(*args) for args in zip(*iters)]
         else:
             raise RuntimeError('unexpected value for self.backend_activated.')
 
@@ -153,7 +854,8 @@ class ParallelBackend:
         if self.backend_activated is None:
             raise RuntimeError('the backend is not activated. Please use it in '
                                'a with context.')
-        elif isinstance(self.backend_activated, Pool):
+        fun = self._limit_threads(fun)
+        if isinstance(self.backend_activated, Pool):
             return self.backend_activated.starmap_async(fun, zip(*iters))
         elif HAS_RAY and isinstance(self.backend_activated, RayPool):
             return self.backend_activated.starmap_async(fun, list(zip(*iters)))
@@ -166,8 +868,13 @@ class ParallelBackend:
         elif HAS_LOKY and isinstance(self.backend_activated,
                                      reusable_executor._ReusablePoolExecutor):
             return self.backend_activated.map(fun, *iters)
-        # elif self.backend_activated == 'serial':
-        #     return self.map(fun, *iters)
+        elif isinstance(self.backend_activated, ThreadPoolExecutor):
+            return [self.backend_activated.submit(fun, *args) for args in
+                    zip(*iters)]
+        elif isinstance(self.backend_activated, AsyncioExecutor):
+            return self.backend_activated.map(fun, *iters)
+        elif self.kind == 'serial':
+            return self._map(fun, *iters)
         else:
             raise RuntimeError('unexpected value for self.backend_activated.')
 
@@ -177,7 +884,7 @@ class ParallelBackend:
                                'a with context.')
         elif isinstance(self.backend_activated, Pool):
             return async_result.get()
-        elif isinstance(self.backend_activated, RayPool):
+        elif HAS_RAY and isinstance(self.backend_activated, RayPool):
             return async_result.get()
         elif HAS_DASK and isinstance(self.backend_activated, Client):
             return self.backend_activated.gather(async_result)
@@ -186,12 +893,638 @@ class ParallelBackend:
         elif HAS_LOKY and isinstance(self.backend_activated,
                                      reusable_executor._ReusablePoolExecutor):
             return list(async_result)
-        # elif self.backend_activated == 'serial':
-        #     return async_result
+        elif isinstance(self.backend_activated, ThreadPoolExecutor):
+            return [f.result() for f in async_result]
+        elif isinstance(self.backend_activated, AsyncioExecutor):
+            return async_result.result()
+        elif self.kind == 'serial':
+            return async_result
         else:
             raise RuntimeError('unexpected value for self.backend_activated.')
 
 
+class Broadcast:
+    """
+    Handle of an object shipped to the workers by `ParallelBackend.broadcast`.
+
+    Only the handle is pickled with each task. In the workers, `get` loads the
+    object the first time it is needed, and then keeps it in a cache.
+    """
+    def __init__(self, key, latency_key=None):
+        self.key = key
+        self._latency_key = latency_key
+        self._obj = None
+        self._path = None
+        self._dask_key = None
+        self._future = None
+        self._ref = None
+
+    def __getstate__(self):
+        self_dict = self.__dict__.copy()
+        self_dict['_obj'] = None
+        self_dict['_future'] = None
+        return self_dict
+
+    def get(self):
+        """Return the broadcast object."""
+        if self._obj is not None:
+            return self._obj
+        try:
+            obj = _broadcast_cache[self.key]
+            _broadcast_cache.move_to_end(self.key)
+            return obj
+        except KeyError:
+            pass
+        if self._dask_key is not None:
+            obj = get_worker().data[self._dask_key]
+        elif self._ref is not None:
+            obj = ray.get(self._ref)
+        elif self._path is not None:
+            with open(self._path, 'rb') as f:
+                obj = dill.load(f)
+        else:
+            raise RuntimeError('this Broadcast has been released.')
+        _broadcast_cache[self.key] = obj
+        while len(_broadcast_cache) > _n_broadcast_cache:
+            _broadcast_cache.popitem(last=False)
+        return obj
+
+    def __call__(self, *args, **kwargs):
+        return self.get()(*args, **kwargs)
+
+    def _release(self):
+        """Used by the parent to free the shipped copies."""
+        if self._path is not None:
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+        self._obj = None
+        self._future = None
+        self._ref = None
+
+
+# the broadcast objects loaded by this (worker) process
+_broadcast_cache = OrderedDict()
+_n_broadcast_cache = 8
+
+
+class AsyncioExecutor:
+    """
+    Running many evaluations concurrently in an asyncio event loop.
+
+    Parameters
+    ----------
+    max_concurrency : positive int, optional
+        The max number of evaluations in flight at the same time. Set to `64` by
+        default.
+    batch_size : None or positive int, optional
+        If not `None`, the points will be sent in batches of this size, with
+        the arrays of each batch stacked along the first axis, and the callable
+        should return a sequence of the results for each point, e.g. for a
+        model server that accepts batched requests. Set to `None` by default.
+    timeout : None or positive float, optional
+        If not `None`, an evaluation that does not finish within `timeout`
+        seconds will be cancelled, and a TimeoutError will be raised. Set to
+        `None` by default.
+
+    Notes
+    -----
+    The event loop runs in a background thread, so the maps can be called
+    from the usual synchronous code. If the function is a coroutine function,
+    or a bound method `obj.name` such that `obj.aname` is a coroutine
+    function (e.g. `Density.fun` and `Density.afun`, `Density.logp` and
+    `Density.alogp`), it will be awaited in the event loop. Otherwise, it will
+    be called in a thread pool with `max_concurrency` threads, so the usual
+    synchronous callables, like the sampling chains, still work, with the
+    same limitations as the `thread` backend.
+    """
+    def __init__(self, max_concurrency=64, batch_size=None, timeout=None):
+        self.max_concurrency = max_concurrency
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self._loop = None
+        self._thread = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def max_concurrency(self):
+        return self._max_concurrency
+
+    @max_concurrency.setter
+    def max_concurrency(self, mc):
+        try:
+            mc = int(mc)
+            assert mc > 0
+        except Exception:
+            raise ValueError('max_concurrency should be a positive int.')
+        self._max_concurrency = mc
+
+    @property
+    def batch_size(self):
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, bs):
+        if bs is None:
+            self._batch_size = None
+        else:
+            try:
+                bs = int(bs)
+                assert bs > 0
+            except Exception:
+                raise ValueError('batch_size should be a positive int or None.')
+            self._batch_size = bs
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, t):
+        if t is None:
+            self._timeout = None
+        else:
+            try:
+                t = float(t)
+                assert t > 0.
+            except Exception:
+                raise ValueError('timeout should be a positive float or None.')
+            self._timeout = t
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._executor = ThreadPoolExecutor(self.max_concurrency)
+                self._loop.set_default_executor(self._executor)
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever, daemon=True)
+                self._thread.start()
+        return self._loop
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._loop.stop)
+                if wait:
+                    self._thread.join()
+                self._executor.shutdown(wait=wait)
+                self._loop = None
+                self._thread = None
+                self._executor = None
+
+    def submit(self, fun, *args):
+        """
+        Start a single evaluation in the event loop, and return a
+        concurrent.futures.Future of the result.
+        """
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(
+            self._submit(fun, args), loop)
+
+    async def _submit(self, fun, args):
+        res = await self._map(fun, [[a] for a in args], False)
+        return res[0]
+
+    def map(self, fun, *iters, vectorized=False):
+        """
+        Start the map in the event loop, and return a concurrent.futures.Future
+        of the list of results.
+        """
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(
+            self._map(fun, [list(it) for it in iters], vectorized), loop)
+
+    async def _map(self, fun, iters, vectorized):
+        afun = _get_async(fun)
+        n = min(len(it) for it in iters) if iters else 0
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        batched = vectorized or self.batch_size is not None
+        batch_size = self.batch_size or 1
+
+        async def run_one(a, b):
+            if batched:
+                args = [np.asarray(it[a:b]) for it in iters]
+            else:
+                args = [it[a] for it in iters]
+            async with semaphore:
+                if afun is not None:
+                    aw = afun(*args)
+                else:
+                    aw = asyncio.get_event_loop().run_in_executor(
+                        None, fun, *args)
+                try:
+                    res = await asyncio.wait_for(aw, self.timeout)
+                except asyncio.TimeoutError:
+                    raise TimeoutError('the evaluation of points #{} to #{} '
+                                       'did not finish within {} seconds.'
+                                       .format(a, b - 1, self.timeout))
+            if batched:
+                res = list(res)
+                if len(res) != b - a:
+                    raise RuntimeError('the batched function returned {} '
+                                       'results for {} points.'.format(
+                                       len(res), b - a))
+                return res
+            return [res]
+
+        out = await asyncio.gather(*[run_one(
+            a, min(a + batch_size, n)) for a in range(0, n, batch_size)])
+        return [r for res in out for r in res]
+
+
+def _get_async(fun):
+    """Find the coroutine function version of fun, if any."""
+    if isinstance(fun, Broadcast):
+        fun = fun.get()
+    if inspect.iscoroutinefunction(fun):
+        return fun
+    owner = getattr(fun, '__self__', None)
+    name = getattr(fun, '__name__', None)
+    if owner is not None and name is not None:
+        afun = getattr(owner, 'a' + name, None)
+        if inspect.iscoroutinefunction(afun):
+            return afun
+    return None
+
+
+class StragglerPolicy:
+    """
+    Configuring the timeouts and retries for `ParallelBackend.map_tolerant`.
+
+    Parameters
+    ----------
+    timeout : None or positive float, optional
+        If not `None`, an evaluation that does not finish within `timeout`
+        seconds will be abandoned, and the point will be retried or dropped.
+        Set to `None` by default.
+    max_retry : non-negative int, optional
+        The number of times to retry the points whose evaluation raises an
+        exception or times out, before dropping them. Set to `1` by default.
+    speculative : bool, optional
+        Whether to start a second copy of the slowest tasks on the idle
+        workers, once all the points have been submitted. The result of the
+        copy that finishes first is used. Set to `True` by default.
+    speculative_factor : positive float, optional
+        A task is considered slow if it has been running for more than
+        `speculative_factor` times the median duration of the finished tasks.
+        Set to `2.` by default.
+    min_finished : positive int, optional
+        The min number of finished tasks before starting the speculative
+        copies. Set to `4` by default.
+    poll_interval : positive float, optional
+        The interval in seconds to check the progress of the tasks. Set to
+        `0.01` by default.
+    """
+    def __init__(self, timeout=None, max_retry=1, speculative=True,
+                 speculative_factor=2., min_finished=4, poll_interval=0.01):
+        self.timeout = timeout
+        self.max_retry = max_retry
+        self.speculative = speculative
+        self.speculative_factor = speculative_factor
+        self.min_finished = min_finished
+        self.poll_interval = poll_interval
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @timeout.setter
+    def timeout(self, t):
+        if t is None:
+            self._timeout = None
+        else:
+            try:
+                t = float(t)
+                assert t > 0.
+            except Exception:
+                raise ValueError('timeout should be a positive float or None.')
+            self._timeout = t
+
+    @property
+    def max_retry(self):
+        return self._max_retry
+
+    @max_retry.setter
+    def max_retry(self, mr):
+        try:
+            mr = int(mr)
+            assert mr >= 0
+        except Exception:
+            raise ValueError('max_retry should be a non-negative int.')
+        self._max_retry = mr
+
+    @property
+    def speculative(self):
+        return self._speculative
+
+    @speculative.setter
+    def speculative(self, s):
+        self._speculative = bool(s)
+
+    @property
+    def speculative_factor(self):
+        return self._speculative_factor
+
+    @speculative_factor.setter
+    def speculative_factor(self, sf):
+        try:
+            sf = float(sf)
+            assert sf > 0.
+        except Exception:
+            raise ValueError('speculative_factor should be a positive float.')
+        self._speculative_factor = sf
+
+    @property
+    def min_finished(self):
+        return self._min_finished
+
+    @min_finished.setter
+    def min_finished(self, mf):
+        try:
+            mf = int(mf)
+            assert mf > 0
+        except Exception:
+            raise ValueError('min_finished should be a positive int.')
+        self._min_finished = mf
+
+    @property
+    def poll_interval(self):
+        return self._poll_interval
+
+    @poll_interval.setter
+    def poll_interval(self, pi):
+        try:
+            pi = float(pi)
+            assert pi > 0.
+        except Exception:
+            raise ValueError('poll_interval should be a positive float.')
+        self._poll_interval = pi
+
+
+class TolerantMap:
+    """
+    Handle of `ParallelBackend.map_tolerant` running in the background.
+
+    The backend is kept activated until all the tasks have finished, so the
+    results can be collected with `wait` as they arrive, e.g. to continue once
+    enough points have been evaluated, while the others are still running.
+    """
+    def __init__(self, backend, fun, args_list, policy, max_in_flight=None):
+        self._backend = backend
+        self._fun = fun
+        self._args_list = args_list
+        self._policy = policy
+        self.max_in_flight = max_in_flight
+        self._result = [None] * len(args_list)
+        self._is_done = np.zeros(len(args_list), dtype=bool)
+        self._is_started = np.zeros(len(args_list), dtype=bool)
+        self._finished = False
+        self._cancelled = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def max_in_flight(self):
+        return self._max_in_flight
+
+    @max_in_flight.setter
+    def max_in_flight(self, mif):
+        if mif is None:
+            self._max_in_flight = None
+        else:
+            try:
+                mif = int(mif)
+                assert mif >= 0
+            except Exception:
+                raise ValueError('max_in_flight should be a non-negative int '
+                                 'or None.')
+            self._max_in_flight = mif
+
+    @property
+    def n_done(self):
+        """The number of points that have been successfully evaluated."""
+        return int(np.sum(self._is_done))
+
+    @property
+    def is_started(self):
+        """Whether the evaluation of each point has been started."""
+        return self._is_started.copy()
+
+    @property
+    def finished(self):
+        """Whether all the tasks have finished, failed or been cancelled."""
+        return self._finished
+
+    def wait(self, n_done=None, timeout=None):
+        """
+        Wait until `n_done` points have been successfully evaluated, or all
+        the tasks have finished if `n_done` is `None`, and return the current
+        `(result, is_done)`, like the returns of `map_tolerant`.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._finished or (
+                n_done is not None and self.n_done >= n_done), timeout)
+            if self._error is not None:
+                raise self._error
+            return list(self._result), self._is_done.copy()
+
+    def cancel(self):
+        """Stop submitting the points that have not been started."""
+        self._cancelled = True
+
+    def _report(self, i, res):
+        with self._cond:
+            self._result[i] = res
+            self._is_done[i] = True
+            self._cond.notify_all()
+
+    def _run(self):
+        try:
+            with self._backend:
+                if self._backend._submit(None, None, dry=True) is None:
+                    # the tasks are run sequentially in this process
+                    self._run_sequential()
+                else:
+                    self._backend._run_tolerant(self)
+        except Exception as e:
+            self._error = e
+        finally:
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+
+    def _run_sequential(self):
+        for i, args in enumerate(self._args_list):
+            if self._cancelled:
+                break
+            self._is_started[i] = True
+            for _ in range(self._policy.max_retry + 1):
+                try:
+                    self._report(i, self._fun(*args))
+                    break
+                except Exception:
+                    pass
+
+
+class _Task:
+    """Unified interface of AsyncResult and Future for map_tolerant."""
+    def __init__(self, task):
+        self._task = task
+
+    def done(self):
+        if hasattr(self._task, 'ready'):
+            return self._task.ready()
+        return self._task.done()
+
+    def get(self):
+        if hasattr(self._task, 'get'):
+            return self._task.get()
+        return self._task.result()
+
+    def cancel(self):
+        """Try to cancel the task, returning whether it succeeded."""
+        try:
+            return bool(self._task.cancel())
+        except Exception:
+            return False
+
+
+_pool_owners = weakref.WeakSet()
+
+
+@atexit.register
+def _terminate_pools():
+    """Terminate the persistent Pools and executors still alive at exit."""
+    for pb in list(_pool_owners):
+        be = pb._backend_activated
+        if isinstance(be, Pool):
+            be.terminate()
+        elif isinstance(be, (ThreadPoolExecutor, AsyncioExecutor)):
+            be.shutdown(wait=False)
+        pb._backend_activated = None
+
+
+class _SharedArray:
+    """Array in a memory-mapped file, which can be opened by the workers."""
+    def __init__(self, dirname, a=None, shape=None, dtype=np.float):
+        if a is not None:
+            shape, dtype = a.shape, a.dtype
+        self.path = os.path.join(dirname, 'array-{}.dat'.format(
+            os.urandom(8).hex()))
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        mm = np.memmap(self.path, dtype=self.dtype, mode='w+',
+                       shape=self.shape)
+        if a is not None:
+            mm[:] = a
+            mm.flush()
+        del mm
+
+    def get(self):
+        try:
+            return _memmap_cache[self.path]
+        except KeyError:
+            pass
+        mm = np.memmap(self.path, dtype=self.dtype, mode='r+',
+                       shape=self.shape)
+        _memmap_cache[self.path] = mm
+        while len(_memmap_cache) > _n_memmap_cache:
+            _memmap_cache.popitem(last=False)
+        return mm
+
+    def remove(self):
+        _memmap_cache.pop(self.path, None)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# the memory-mapped arrays opened by this process
+_memmap_cache = OrderedDict()
+_n_memmap_cache = 8
+
+
+def _n_core():
+    """The number of cores available to this process."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except Exception:
+        return os.cpu_count() or 1
+
+
+# the BLAS/OpenMP thread limit applied to this (worker) process
+_worker_n_thread = None
+
+
+class _NullContext:
+    """A no-op context manager, as contextlib.nullcontext requires 3.7+."""
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class _ThreadLimited:
+    """Applying the thread limit in the worker before calling the function."""
+    def __init__(self, fun, n_thread):
+        self.fun = fun
+        self.n_thread = n_thread
+
+    def __call__(self, *args, **kwargs):
+        global _worker_n_thread
+        if _worker_n_thread != self.n_thread:
+            threadpool_limits(self.n_thread)
+            _worker_n_thread = self.n_thread
+        return self.fun(*args, **kwargs)
+
+
+class _ChunkRunner:
+    """Applying the function to a chunk of points, timing the evaluation."""
+    def __init__(self, fun, vectorized, inputs=None, output=None):
+        self.fun = fun
+        self.vectorized = vectorized
+        self.inputs = inputs
+        self.output = output
+
+    def __call__(self, *chunk):
+        t_s = time.perf_counter()
+        if self.inputs is not None:
+            a, b = chunk
+            chunk = [np.array(blk.get()[a:b]) for blk in self.inputs]
+        if self.vectorized:
+            res = list(self.fun(*[np.asarray(c) for c in chunk]))
+            if len(res) != len(chunk[0]):
+                raise RuntimeError('the vectorized function returned {} '
+                                   'results for {} points.'.format(
+                                   len(res), len(chunk[0])))
+        else:
+            res = [self.fun(*args) for args in zip(*chunk)]
+        if self.output is not None:
+            out = self.output.get()
+            out[a:b] = np.reshape(res, (b - a,) + out.shape[1:])
+            out.flush()
+            res = []
+        return res, time.perf_counter() - t_s
+
+
+def _fun_key(fun):
+    if isinstance(fun, Broadcast):
+        return fun._latency_key
+    f = getattr(fun, '__func__', fun)
+    return (getattr(f, '__module__', None),
+            getattr(f, '__qualname__', type(f).__qualname__))
+
+
+def _chunk_bounds(i, n, chunksize):
+    return [(a, min(a + chunksize, n)) for a in range(i, n, chunksize)]
+
+
 _global_backend = ParallelBackend()
 
 
@@ -201,4 +1534,7 @@ def get_backend():
 
 def set_backend(backend):
     global _global_backend
-    _global_backend = ParallelBackend(backend)
+    new_backend = ParallelBackend(backend)
+    if new_backend is not _global_backend and not _global_backend.is_active:
+        _global_backend.shutdown()
+    _global_backend = new_backend
@@ -1,6 +1,6 @@
 import numpy as np
 
-__all__ = ['get_generator', 'set_generator', 'spawn_generator']
+__all__ = ['get_generator', 'set_generator', 'spawn_generator', 'RandomBuffer']
 
 # TODO: review the jump_current option of spawn_generator
 
@@ -30,3 +30,89 @@ def spawn_generator(current_generator, n, jump_current=True):
     if jump_current:
         current_generator.normal()
     return spawned
+
+
+class RandomBuffer:
+    """
+    Buffered random stream of momenta and uniform numbers for one chain.
+
+    Parameters
+    ----------
+    random_generator : np.random.Generator
+        The generator of the chain, from which independent streams are spawned
+        for the momenta, the uniform numbers and the scalar normal numbers
+        respectively.
+    block_size : positive int, optional
+        The number of draws generated at a time. Set to `1024` by default.
+
+    Notes
+    -----
+    Since each stream is drawn sequentially, the results do not depend on
+    `block_size` (up to the rounding of the blocked triangular solve for the
+    full metric), and are reproducible given the seed of `random_generator`,
+    though different from the unbuffered draws. The standard normal draws are
+    transformed into momenta by `QuadMetric._random_block`, once for the
+    remaining block if the metric has not changed since the last draw, which
+    is the case after warmup.
+    """
+    def __init__(self, random_generator, block_size=1024):
+        try:
+            block_size = int(block_size)
+            assert block_size > 0
+        except Exception:
+            raise ValueError('block_size should be a positive int.')
+        self._block_size = block_size
+        (self._normal_generator, self._uniform_generator,
+         self._scalar_generator) = spawn_generator(random_generator, 3,
+                                                   jump_current=False)
+        self._uniforms = np.empty(0)
+        self._i_uniform = 0
+        self._scalars = np.empty(0)
+        self._i_scalar = 0
+        self._normals = np.empty((0, 0))
+        self._i_normal = 0
+        self._momenta = None
+        self._i_momenta = 0
+        self._metric_key = None
+
+    @property
+    def block_size(self):
+        return self._block_size
+
+    def uniform(self):
+        if self._i_uniform >= self._uniforms.shape[0]:
+            self._uniforms = self._uniform_generator.random(self._block_size)
+            self._i_uniform = 0
+        self._i_uniform += 1
+        return self._uniforms[self._i_uniform - 1]
+
+    def normal(self):
+        """Draw a standard normal number, e.g. for the tempering variables."""
+        if self._i_scalar >= self._scalars.shape[0]:
+            self._scalars = self._scalar_generator.standard_normal(
+                self._block_size)
+            self._i_scalar = 0
+        self._i_scalar += 1
+        return self._scalars[self._i_scalar - 1]
+
+    def momentum(self, metric):
+        """Draw a momentum from the metric."""
+        n = metric._n
+        if (self._i_normal >= self._normals.shape[0] or
+            self._normals.shape[1] != n):
+            self._normals = self._normal_generator.standard_normal(
+                (self._block_size, n))
+            self._i_normal = 0
+            self._momenta = None
+        key = (id(metric), metric._version)
+        i = self._i_normal
+        self._i_normal += 1
+        if key != self._metric_key:
+            # the metric is still changing, so only transform this one
+            self._metric_key = key
+            self._momenta = None
+            return metric._random_block(self._normals[i:(i + 1)])[0]
+        if self._momenta is None:
+            self._momenta = metric._random_block(self._normals[i:])
+            self._i_momenta = i
+        return self._momenta[i - self._i_momenta].copy()
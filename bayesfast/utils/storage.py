@@ -0,0 +1,199 @@
+import numpy as np
+from .collections import ArrayBuffer
+import os
+import json
+import tempfile
+
+__all__ = ['MemoryStorage', 'MemmapStorage', 'MemmapBuffer', 'get_storage']
+
+
+class MemoryStorage:
+    """Keeping the sample traces in memory, using `ArrayBuffer`."""
+    def buffer(self, name, size=0, dtype=None):
+        return ArrayBuffer(size, dtype)
+
+
+class MemmapStorage:
+    """
+    Streaming the sample traces to memory-mapped files on disk.
+
+    Parameters
+    ----------
+    path : str or None, optional
+        The directory to store the files. Will be created if it does not exist.
+        If `None`, will create a new temporary directory. Set to `None` by
+        default.
+    flush_every : positive int, optional
+        Flushing the buffer to disk every `flush_every` new elements. Set to
+        `100` by default.
+    prefix : str, optional
+        Prefix of the file names, e.g. to store several runs in the same
+        directory. Set to `''` by default.
+
+    Notes
+    -----
+    Each buffer is stored as a raw binary file `*.dat`, together with a json
+    file `*.json` that records its dtype and shape when last flushed, so that
+    it can be recovered with `MemmapBuffer.load` even if the process dies. The
+    files are named after the chain and the item, e.g. `chain-0-samples.dat`
+    and `chain-0-logp.dat`, or `{prefix}-chain-0-samples.dat` if `prefix` is
+    given. Existing files with the same names will be overwritten, and the
+    files will not be removed automatically.
+
+    Each chain, e.g. `trace[0].samples`, reads its memory-mapped file lazily,
+    but `TraceTuple.get` still concatenates all the chains in memory.
+    """
+    def __init__(self, path=None, flush_every=100, prefix=''):
+        if path is None:
+            path = tempfile.mkdtemp(prefix='bayesfast-')
+        try:
+            path = os.fspath(path)
+            os.makedirs(path, exist_ok=True)
+        except Exception:
+            raise ValueError('invalid value for path.')
+        self._path = path
+        try:
+            flush_every = int(flush_every)
+            assert flush_every > 0
+        except Exception:
+            raise ValueError('flush_every should be a positive int.')
+        self._flush_every = flush_every
+        self._prefix = str(prefix)
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def flush_every(self):
+        return self._flush_every
+
+    @property
+    def prefix(self):
+        return self._prefix
+
+    def buffer(self, name, size=0, dtype=None):
+        if self._prefix:
+            name = '{}-{}'.format(self._prefix, name)
+        filename = os.path.join(self._path, '{}.dat'.format(name))
+        # create or empty the file, which will be extended when allocated
+        open(filename, 'wb').close()
+        buffer = MemmapBuffer(filename, size, dtype, self._flush_every)
+        if os.path.exists(buffer._meta_filename):
+            os.remove(buffer._meta_filename)
+        return buffer
+
+
+class MemmapBuffer(ArrayBuffer):
+    """
+    Growable buffer of arrays, backed by a memory-mapped file.
+
+    Parameters
+    ----------
+    filename : str
+        The file to store the data.
+    size : non-negative int, optional
+        The number of elements to preallocate. Set to `0` by default.
+    dtype : None or data-type, optional
+        The dtype of the buffer. If `None`, will be determined by the first
+        element appended to the buffer. Set to `None` by default.
+    flush_every : positive int, optional
+        Flushing the buffer to disk every `flush_every` new elements. Set to
+        `100` by default.
+
+    Notes
+    -----
+    When pickled, only the file name and the metadata are saved, and the data
+    will be memory-mapped again after unpickling. Growing the buffer extends
+    the file without copying the existing data.
+    """
+    def __init__(self, filename, size=0, dtype=None, flush_every=100):
+        self._filename = os.fspath(filename)
+        self._flush_every = int(flush_every)
+        self._n_flushed = 0
+        super().__init__(size, dtype)
+
+    def __getstate__(self):
+        self.flush()
+        self_dict = self.__dict__.copy()
+        if self._data is not None:
+            self_dict['_data'] = (self._data.shape, self._data.dtype.str)
+        return self_dict
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self._data is not None:
+            shape, dtype = self._data
+            self._data = np.memmap(self._filename, dtype=dtype, mode='r+',
+                                   shape=shape)
+
+    @property
+    def filename(self):
+        return self._filename
+
+    @property
+    def _meta_filename(self):
+        return os.path.splitext(self._filename)[0] + '.json'
+
+    def _allocate(self, n, shape, dtype):
+        with open(self._filename, 'r+b') as f:
+            f.truncate(n * int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        return np.memmap(self._filename, dtype=dtype, mode='r+',
+                         shape=(n,) + shape)
+
+    def _resize(self, n):
+        self._data.flush()
+        shape, dtype = self._data.shape[1:], self._data.dtype
+        self._data = None
+        self._data = self._allocate(n, shape, dtype)
+
+    def append(self, x):
+        super().append(x)
+        if self._n - self._n_flushed >= self._flush_every:
+            self.flush()
+
+    def extend(self, xs):
+        super().extend(xs)
+        if self._n - self._n_flushed >= self._flush_every:
+            self.flush()
+
+    def truncate(self, n):
+        super().truncate(n)
+        self._n_flushed = min(self._n_flushed, self._n)
+
+    def flush(self):
+        """Write the data and the metadata to disk."""
+        if self._data is None:
+            return
+        self._data.flush()
+        with open(self._meta_filename, 'w') as f:
+            json.dump({'dtype': self._data.dtype.str,
+                       'shape': [self._n] + list(self._data.shape[1:]),
+                       'capacity': self._data.shape[0]}, f)
+        self._n_flushed = self._n
+
+    @classmethod
+    def load(cls, filename, flush_every=100):
+        """Recover a buffer from the files on disk."""
+        buffer = cls(filename, 0, None, flush_every)
+        with open(buffer._meta_filename) as f:
+            meta = json.load(f)
+        buffer._dtype = np.dtype(meta['dtype'])
+        buffer._data = np.memmap(
+            buffer._filename, dtype=buffer._dtype, mode='r+',
+            shape=(meta['capacity'],) + tuple(meta['shape'][1:]))
+        buffer._n = buffer._n_flushed = meta['shape'][0]
+        return buffer
+
+
+def get_storage(storage):
+    if storage is None:
+        return MemoryStorage()
+    elif isinstance(storage, (MemoryStorage, MemmapStorage)):
+        return storage
+    elif isinstance(storage, dict):
+        return MemmapStorage(**storage)
+    elif isinstance(storage, (str, os.PathLike)):
+        return MemmapStorage(storage)
+    else:
+        raise ValueError('invalid value for storage.')
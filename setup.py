@@ -30,6 +30,11 @@ ext_modules = [
         ["bayesfast/modules/_poly.pyx"],
         # include_dirs=[np.get_include()],
         # libraries=["m"],
+    ),
+    Extension(
+        "bayesfast.samplers.hmc_utils._cholupdate",
+        ["bayesfast/samplers/hmc_utils/_cholupdate.pyx"],
+        libraries=["m"],
     )
 ]
 